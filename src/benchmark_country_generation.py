@@ -0,0 +1,40 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # Adding the src folder to PYTHONPATH
+
+import numpy as np
+
+from src.simulation.params import Params
+from src.world.population_generation import PopulationLoader, generate_entire_country
+
+
+def main():
+    """
+    Compare the time it takes to generate the entire country with different numbers of worker processes.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--scale", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    config_path = os.path.join(os.path.dirname(__file__), "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    city_list = PopulationLoader(citiesDataPath, with_caching=False).get_all_large_enough_cities(args.scale)
+    print("{} cities at scale {} on {} CPUs".format(len(city_list), args.scale, os.cpu_count()))
+    for num_workers in args.workers:
+        random.seed(0)
+        np.random.seed(0)
+        start = time.time()
+        world = generate_entire_country(city_list, scaling=args.scale, num_workers=num_workers)
+        print("{} workers: {:.1f}s ({} people)".format(num_workers, time.time() - start, world.num_people()))
+
+
+if __name__ == "__main__":
+    main()
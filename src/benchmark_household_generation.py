@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # Adding the src folder to PYTHONPATH
+
+import numpy as np
+
+from src.world.city_data import get_city_list_from_dem_xls
+from src.world.population_generation.household_generation import sim_houses
+from src.world.population_generation.smart_population_generation import get_distribution_distance
+from src.world.population_generation.vectorized_household_generation import sim_houses_vectorized, \
+    CHILD_MAX_AGE, MIN_PARENT_AGE_GAP, MAX_PARENT_AGE_GAP
+
+
+def household_report(city, households_ages, scale):
+    """
+    Compare the simulated households of a city with its demographic data
+    :param city: City object
+    :param households_ages: list of households, each a list of ages, see sim_houses
+    :param scale: the scale the households were simulated with
+    :return: dict of the distances of the age and household size distributions (see get_distribution_distance),
+    the relative errors in the number of households and people, and the fraction of the households with children
+    that have an adult MIN_PARENT_AGE_GAP-MAX_PARENT_AGE_GAP years older than the oldest child
+    """
+    age_groups = [min(age // 5, 15) for household in households_ages for age in household]
+    household_sizes = [min(len(household), len(city.household_size_data) - 1) for household in households_ages]
+    with_children = [household for household in households_ages if min(household) <= CHILD_MAX_AGE]
+    with_parent = [
+        any(MIN_PARENT_AGE_GAP <= age - max(a for a in household if a <= CHILD_MAX_AGE) <= MAX_PARENT_AGE_GAP
+            for age in household)
+        for household in with_children
+    ]
+    return {
+        "age": get_distribution_distance(age_groups, [t[0] for t in city.age_data])[0],
+        "size": get_distribution_distance(household_sizes, city.household_size_data)[0],
+        "houses": len(households_ages) / int(city.total_households * scale) - 1,
+        "people": len(age_groups) / int(city.population * scale) - 1,
+        "parents": np.mean(with_parent) if with_parent else 1.0,
+    }
+
+
+def main():
+    """
+    Compare the run time and the quality of the households of sim_houses and sim_houses_vectorized.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--cities", nargs="+", default=["atlit", "holon", "bene beraq", "jerusalem"])
+    parser.add_argument("--scale", type=float, default=1.0)
+    args = parser.parse_args()
+    config_path = os.path.join(os.path.dirname(__file__), "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+    cities = {city.get_name(): city for city in get_city_list_from_dem_xls(citiesDataPath)}
+    for city_name in args.cities:
+        city = cities[city_name]
+        for generator in [sim_houses, sim_houses_vectorized]:
+            random.seed(0)
+            np.random.seed(0)
+            start = time.time()
+            households_ages = generator(
+                city.age_data,
+                city.household_size_data,
+                city.percentage_of_households_with_65_plus,
+                city.percentage_of_households_with_17_minus,
+                int(city.total_households * args.scale),
+                int(city.population * args.scale),
+                city.percentage_of_households_with_single_parent,
+                city.percentage_of_children_with_single_parent_in_household,
+                city.kids_per_household_data
+            )
+            run_time = time.time() - start
+            report = household_report(city, households_ages, args.scale)
+            print("{} {}: {:.2f}s, age distance {:.4f}, size distance {:.4f}, houses error {:+.4f}, "
+                  "people error {:+.4f}, households with a parent {:.2f}".format(
+                      city_name, generator.__name__, run_time, report["age"], report["size"],
+                      report["houses"], report["people"], report["parents"]))
+
+
+if __name__ == "__main__":
+    main()
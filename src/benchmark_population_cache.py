@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # Adding the src folder to PYTHONPATH
+
+from src.simulation.params import Params
+from src.world.population_generation import PopulationLoader, PICKLE_FORMAT, COLUMNAR_FORMAT
+
+
+def time_cache_format(cache_format, world, cities_data_path, output_dir, num_loads):
+    """
+    Save the given world in the given cache format, and load it back num_loads times
+    :param cache_format: PICKLE_FORMAT or COLUMNAR_FORMAT, see PopulationLoader
+    :return: dict of the save time, file size, best load time and peak memory of a load
+    """
+    loader = PopulationLoader(cities_data_path, output_dir=output_dir, cache_format=cache_format)
+    city_name, scale = world._generating_city_name, world._generating_scale
+    start = time.time()
+    loader._save_to_file(world, True)
+    save_time = time.time() - start
+    load_times = []
+    for _ in range(num_loads):
+        start = time.time()
+        loader.try_deserialize(city_name, True, scale)
+        load_times.append(time.time() - start)
+    tracemalloc.start()
+    loader.try_deserialize(city_name, True, scale)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "save": save_time,
+        "size": os.path.getsize(loader._get_filepath(city_name, True, scale)),
+        "load": min(load_times),
+        "peak": peak_memory,
+    }
+
+
+def main():
+    """
+    Compare saving and loading a generated world with the pickle and the columnar population caches.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--city", default="all")
+    parser.add_argument("--scale", type=float, default=0.05)
+    parser.add_argument("--loads", type=int, default=3)
+    args = parser.parse_args()
+    config_path = os.path.join(os.path.dirname(__file__), "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    world = PopulationLoader(citiesDataPath, with_caching=False).get_world(city_name=args.city, scale=args.scale)
+    print("{} at scale {}: {} people, {} environments".format(
+        args.city, args.scale, world.num_people(), len(world.all_environments)))
+    output_dir = tempfile.mkdtemp()
+    for cache_format in [PICKLE_FORMAT, COLUMNAR_FORMAT]:
+        result = time_cache_format(cache_format, world, citiesDataPath, output_dir, args.loads)
+        print("{}: save {:.1f}s, file {:.1f}MB, load {:.2f}s, load peak memory {:.0f}MB".format(
+            cache_format, result["save"], result["size"] / 1e6, result["load"], result["peak"] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..')) # Adding the src folder to PYTHONPATH
+
+from src.run_utils import RepeatJob, SimpleJob, run
+from src.simulation.initial_infection_params import NaiveInitialInfectionParams
+
+
+def time_run(use_fork_templates, city_name, scale, days, num_repetitions, num_workers):
+    """
+    Run a job of num_repetitions repetitions of a short simulation, so most of the run is the startup of the tasks.
+    :param use_fork_templates: bool, which executor of run() to use
+    :return: the run time in seconds
+    """
+    executor = "fork" if use_fork_templates else "spawn"
+    job = RepeatJob(
+        SimpleJob(
+            "startup_benchmark_" + executor, city_name, scale,
+            infection_params=NaiveInitialInfectionParams(20), days=days
+        ),
+        num_repetitions
+    )
+    start = time.time()
+    run([job], with_population_caching=True, verbosity=False,
+        use_fork_templates=use_fork_templates, num_workers=num_workers)
+    return time.time() - start
+
+
+def main():
+    """
+    Compare the startup time of the two executors of run_utils.run:
+    spawned workers that each load the world, and forked workers that inherit a world built once in the parent.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--city", default="holon")
+    parser.add_argument("--scale", type=float, default=0.2)
+    parser.add_argument("--days", type=int, default=20)
+    parser.add_argument("--repetitions", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    results = {}
+    for use_fork_templates in [False, True]:
+        results[use_fork_templates] = time_run(
+            use_fork_templates, args.city, args.scale, args.days, args.repetitions, args.workers
+        )
+    print("{} repetitions of {} days of {} at scale {} with {} workers:".format(
+        args.repetitions, args.days, args.city, args.scale, args.workers))
+    print("spawn: {:.1f}s, fork with template: {:.1f}s".format(results[False], results[True]))
+
+
+if __name__ == "__main__":
+    main()
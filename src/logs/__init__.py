@@ -7,7 +7,8 @@ from src.logs.stats import \
     get_mean_and_confidence_from_statistics, \
     compute_r_from_statistics, \
     get_multiple_stats_summary_file, \
-    get_r_mean_and_confidence_from_statistics
+    get_r_mean_and_confidence_from_statistics, \
+    get_repetitions_outputs_from_statistics
 
 __all__ = [
     'Statistics',
@@ -21,4 +22,5 @@ __all__ = [
     'compute_r_from_statistics',
     'get_multiple_stats_summary_file',
     'get_r_mean_and_confidence_from_statistics',
+    'get_repetitions_outputs_from_statistics',
 ]
@@ -1,6 +1,8 @@
+import io
 import os
 from functools import lru_cache
 import pickle
+import shutil
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
@@ -8,23 +10,37 @@ import matplotlib.dates as mdates
 import warnings
 from numpy import sqrt, nanmean, nanstd, NaN, isnan, array, logical_or
 import csv
+import json
 import logging
 from collections import Counter, namedtuple, defaultdict
 from itertools import cycle
-from datetime import timedelta
-from itertools import combinations
+from datetime import timedelta, date as _date
+from itertools import combinations, product
+import numpy as np
 
 from src.simulation.interventions import *
 from src.world import InfectionData
 from src.logs.summary import make_summary_by_age_table, TableFormat
 from src.simulation.params import Params
 from src.seir import DiseaseState
-from src.world import RedactedPersonAndEnv,World
+from src.world import RedactedPerson, RedactedPersonAndEnv,World
 from src.logs.r0_data import calculate_r0_data
 
 
 logging.getLogger('matplotlib.font_manager').disabled = True
 
+# The name of the file in the output directory that StreamedDaysData writes to
+DAYS_DATA_FILENAME = 'days_data.csv'
+
+# The ages that the counts of DayStatistics have room for
+MAX_AGE = 120
+NUM_AGES = MAX_AGE + 1
+# The disease states by their index in the counts of DayStatistics (index 0 is no disease state)
+STATES_BY_INDEX = (None,) + tuple(DiseaseState)
+assert all(STATES_BY_INDEX[state.value] is state for state in DiseaseState)
+_IS_INFECTED_INDEX = array([state is not None and state.is_infected() for state in STATES_BY_INDEX])
+INFECTED_STATES = tuple(state for state in DiseaseState if state.is_infected())
+
 BackgroundStripe = namedtuple("BackgroundStripe", ("start", "end", "color", "label"))
 
 INTERVENTION_TYPE_TO_COLOR = {
@@ -83,64 +99,328 @@ def integral_list(l):
 
 class DayStatistics(object):
     """
-    A summary of the changes that happened at a certain date.
-    self.person_count saves the age-stratified changes in the disease states of of all people
-    self.infection_data_projection saves the data of this date's infections (see InfectionData for details).
-
+    A summary of the changes that happened at a certain date, in numpy arrays of a fixed shape.
+    self.person_counts saves the age-stratified changes in the disease states of all people
+    self.infections saves the data of this date's infections (see InfectionData for details).
 
-    self.person_count is a counter object which saves, for each state and age, the number of new people in that state
-    minus the number of people which are no longer in that state.
+    self.person_counts is an array of shape (NUM_AGES, len(STATES_BY_INDEX)) which saves, for each age and state,
+    the number of new people in that state minus the number of people which are no longer in that state.
 
-    self.infection_data_projection is a dictionary from subsets of the properties it saves to a counter
-    (not of complete InfectionData objects in order to save memory).
-    Currently it saves single properties and pairs of properties.
+    self.infections is an array with a row for each infection and a column for each of InfectionData.get_keys(),
+    holding the index of the value of that key (see DayStatistics.get_infection_values).
+    Counting the days data evaluates a property once for each index, into a mask over these arrays
+    (see DayStatistics.get_person_mask and DayStatistics.get_infection_mask).
     """
-    __slots__ = ('date', 'person_count', 'infection_data_projection', 'diff_infect')
+    __slots__ = ('date', 'person_counts', 'infections', 'environment_names', 'diff_infect')
 
-    def __init__(self, date, changed_population):
-        self.date = date
+    def __init__(self, date, changed_population, environment_names):
+        """
+        :param date: The date of the day
+        :param changed_population: The people whose state changed today
+        :param environment_names: tuple of the short names of the environments people can get infected in
+        (see Statistics.environment_names)
+        """
+        env_index = {name: index for index, name in enumerate(environment_names)}
+        ages, states, last_ages, last_states, infections = [], [], [], [], []
+        for person in changed_population:
+            ages.append(person.get_age())
+            states.append(person.get_disease_state().value)
+            last_state = person.get_last_state()
+            if last_state is not None:
+                last_ages.append(last_state.age)
+                last_states.append(last_state.disease_state.value)
+            infection_data = person.get_infection_data()
+            if (infection_data is not None) and (infection_data.date == date):
+                transmitter = infection_data.transmitter
+                infections.append((
+                    env_index[infection_data.environment.name],
+                    person.get_age(),
+                    NUM_AGES if transmitter is None else transmitter.get_age(),
+                    0 if transmitter is None else transmitter.get_disease_state().value
+                ))
         #how many people change to each state
-        self.person_count = Counter(
-            person.get_state()
-            for person in changed_population
+        person_counts = np.zeros((NUM_AGES, len(STATES_BY_INDEX)), dtype=np.int32)
+        np.add.at(person_counts, (ages, states), 1)
+        np.add.at(person_counts, (last_ages, last_states), -1)
+        self._set_counts(
+            date, person_counts,
+            np.array(infections, dtype=np.uint8).reshape(len(infections), len(InfectionData.get_keys())),
+            environment_names
         )
-        self.person_count.subtract(
-            person.get_last_state()
-            for person in changed_population
-        ) 
-        #for each person that change state today get dictionary of date
-        infected_today_stats = list(
-            person.get_infection_data().get_stats()
-            for person in changed_population
-            if (person.get_infection_data() is not None) and (person.get_infection_data().date == date)
-        )
-        #how many got infected divided into inector_state,env_name,etc'
-        self.infection_data_projection = {
-            key: Counter(stat[key] for stat in infected_today_stats)
-            for key in InfectionData.get_keys()
-        }
-        #Creating 2 dimentiona table of the data listed above
-        self.infection_data_projection.update({
+
+    @classmethod
+    def from_counts(cls, date, person_counts, infections, environment_names):
+        """
+        Make a DayStatistics out of the counts of a day that were already computed (see StreamedDaysData)
+        :param date: The date of the day
+        :param person_counts: np.ndarray, see DayStatistics.person_counts
+        :param infections: np.ndarray, see DayStatistics.infections
+        :param environment_names: see DayStatistics.__init__
+        :return: DayStatistics object
+        """
+        day = cls.__new__(cls)
+        day._set_counts(date, person_counts, infections, environment_names)
+        return day
+
+    def _set_counts(self, date, person_counts, infections, environment_names):
+        self.date = date
+        self.person_counts = person_counts
+        self.infections = infections
+        self.environment_names = environment_names
+        self.diff_infect = int(person_counts[:, _IS_INFECTED_INDEX].sum())
+
+    @property
+    def person_count(self):
+        """
+        :return: Counter of the nonzero changes of self.person_counts, by RedactedPerson
+        """
+        return Counter({
+            RedactedPerson(int(age), STATES_BY_INDEX[state]): int(self.person_counts[age, state])
+            for age, state in zip(*np.nonzero(self.person_counts))
+        })
+
+    @property
+    def infection_data_projection(self):
+        """
+        :return: dict from each key of InfectionData.get_keys() and each pair of keys to a Counter of their values
+        in today's infections
+        """
+        keys = InfectionData.get_keys()
+        values = [self.get_infection_values(key, self.environment_names) for key in keys]
+        infected_today_stats = [
+            {key: key_values[index] for key, key_values, index in zip(keys, values, row)}
+            for row in self.infections.tolist()
+        ]
+        projection = {key: Counter(stat[key] for stat in infected_today_stats) for key in keys}
+        projection.update({
             pair: Counter((stat[pair[0]], stat[pair[1]]) for stat in infected_today_stats)
-            for pair in combinations(InfectionData.get_keys(), 2)
+            for pair in combinations(keys, 2)
         })
+        return projection
+
+    @staticmethod
+    def get_infection_values(key, environment_names):
+        """
+        :param key: One of InfectionData.get_keys()
+        :param environment_names: see DayStatistics.__init__
+        :return: tuple of the values of that key, by their index in DayStatistics.infections
+        """
+        if key == 'infection_env_short':
+            return tuple(environment_names)
+        if key == 'infected_age':
+            return tuple(range(NUM_AGES))
+        if key == 'infector_age':
+            return tuple(range(NUM_AGES)) + (None,)
+        assert key == 'infector_disease_state', "Unknown infection data key %s" % key
+        return STATES_BY_INDEX
+
+    @staticmethod
+    def get_person_mask(property_to_count):
+        """
+        :param property_to_count: A function that takes a RedactedPerson and returns a boolean
+        :return: Boolean np.ndarray of the shape of DayStatistics.person_counts, of the property of each count
+        """
+        return np.array([
+            [state is not None and bool(property_to_count(RedactedPerson(age, state))) for state in STATES_BY_INDEX]
+            for age in range(NUM_AGES)
+        ])
+
+    @staticmethod
+    def get_infection_mask(property_to_count, infection_data, environment_names):
+        """
+        :param property_to_count: A function that takes the values of infection_data and returns a boolean
+        :param infection_data: A key of InfectionData.get_keys() or a pair of them
+        :param environment_names: see DayStatistics.__init__
+        :return: Boolean np.ndarray with an axis for each of the keys, of the property of each index of their values
+        """
+        if isinstance(infection_data, str):
+            return np.array([
+                bool(property_to_count(value))
+                for value in DayStatistics.get_infection_values(infection_data, environment_names)
+            ])
+        values = [DayStatistics.get_infection_values(key, environment_names) for key in infection_data]
+        return np.array([bool(property_to_count(pair)) for pair in product(*values)]).reshape(
+            [len(key_values) for key_values in values])
+
+    def count_people(self, person_mask):
+        """
+        :param person_mask: see DayStatistics.get_person_mask
+        :return: The change in the number of people satisfying the property of the mask
+        """
+        return int(self.person_counts[person_mask].sum())
 
-        self.person_count.pop(None, None)
-        self.diff_infect = sum(weight for state, weight in self.person_count.items() if state[1].is_infected())
+    def count_infections(self, infection_mask, infection_data):
+        """
+        :param infection_mask: see DayStatistics.get_infection_mask
+        :param infection_data: The key or pair of keys of the mask
+        :return: The number of today's infections satisfying the property of the mask
+        """
+        keys = (infection_data,) if isinstance(infection_data, str) else infection_data
+        columns = [InfectionData.get_keys().index(key) for key in keys]
+        return int(np.count_nonzero(infection_mask[tuple(self.infections[:, columns].T)]))
 
     def __repr__(self):
         return 'day: ' + repr(self.date) + '\n' + \
             repr(self.person_count)
 
 
+@lru_cache(maxsize=None)
+def _get_age_group_and_states_mask(age_group, disease_states):
+    """
+    :param age_group: pair of the minimal and maximal ages (inclusive), or None for all ages
+    :param disease_states: tuple of DiseaseState-s
+    :return: The person mask (see DayStatistics.get_person_mask) of the people in the age group in one of the states
+    """
+    return DayStatistics.get_person_mask(
+        lambda person: (age_group is None or age_group[0] <= person.age <= age_group[1]) and
+                       person.disease_state in disease_states
+    )
+
+
+class StreamedDaysData(object):
+    """
+    A list of DayStatistics that is kept in a csv file instead of in memory.
+    Each appended day is written to the end of the file right away, one row per count:
+    (date, projection, JSON list of the counted values, count), where projection is
+    'day' for the single row that every day starts with, 'person' for the nonzero counts of
+    DayStatistics.person_counts (values are [age, disease state]) or 'infection' for the infections
+    (values are the values of InfectionData.get_keys()).
+    Iterating over it reads the days back from the file one at a time, so only the last day is held in memory.
+    The offset of each day in the file is kept, so a single day is read without reading the days before it.
+    """
+    __slots__ = ('path', 'environment_names', '_num_days', '_last_day', '_size', '_day_offsets')
+
+    def __init__(self, path, environment_names):
+        """
+        :param path: The path of the csv file, which is created (it should not exist)
+        :param environment_names: see DayStatistics.__init__
+        """
+        assert not os.path.exists(path), "File %s already exists!" % path
+        self.path = path
+        self.environment_names = environment_names
+        self._num_days = 0
+        self._last_day = None
+        with open(self.path, 'w', newline='') as f:
+            csv.writer(f).writerow(('date', 'projection', 'values', 'count'))
+        # The size of the file with the appended days, so a copy of this object can copy the file as it was
+        self._size = os.path.getsize(self.path)
+        # The offset in the file of the first row of each day
+        self._day_offsets = []
+
+    def append(self, day):
+        """
+        Write the counts of a day to the end of the file
+        :param day: DayStatistics object
+        """
+        date = day.date.isoformat()
+        rows = [(date, 'day', '[]', 0)]
+        rows.extend(
+            (date, 'person', json.dumps([int(age), STATES_BY_INDEX[state].name]), int(day.person_counts[age, state]))
+            for age, state in zip(*np.nonzero(day.person_counts))
+        )
+        if len(day.infections):
+            infections, counts = np.unique(day.infections, axis=0, return_counts=True)
+            values = [
+                self._encode_values(DayStatistics.get_infection_values(key, self.environment_names))
+                for key in InfectionData.get_keys()
+            ]
+            rows.extend(
+                (date, 'infection', json.dumps([key_values[index] for key_values, index in zip(values, row)]), count)
+                for row, count in zip(infections.tolist(), counts.tolist())
+            )
+        with open(self.path, 'a', newline='') as f:
+            csv.writer(f).writerows(rows)
+        self._day_offsets.append(self._size)
+        self._size = os.path.getsize(self.path)
+        self._num_days += 1
+        self._last_day = day
+
+    @staticmethod
+    def _encode_values(values):
+        return [value.name if isinstance(value, DiseaseState) else value for value in values]
+
+    def move_to(self, path):
+        """
+        Continue writing the days to a copy of the file at the given path, leaving the current file as it is
+        (so two simulations that continue from the same checkpoint don't write to the same file).
+        The copy has only the days of this object, even if more days were appended to the file since it was copied.
+        :param path: The path of the new csv file (it should not exist)
+        """
+        assert not os.path.exists(path), "File %s already exists!" % path
+        shutil.copyfile(self.path, path)
+        os.truncate(path, self._size)
+        self.path = path
+
+    def __len__(self):
+        return self._num_days
+
+    def __iter__(self):
+        with open(self.path, newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            yield from self._read_days(reader)
+
+    def _read_days(self, rows):
+        """
+        :param rows: iterator of the csv rows of consecutive days, starting with the 'day' row of the first of them
+        :return: generator of the DayStatistics of these days
+        """
+        keys = InfectionData.get_keys()
+        value_to_index = [
+            {value: index for index, value in enumerate(
+                self._encode_values(DayStatistics.get_infection_values(key, self.environment_names)))}
+            for key in keys
+        ]
+        day_counts = None
+        for date, projection, values, count in rows:
+            if projection == 'day':
+                if day_counts is not None:
+                    yield self._make_day(*day_counts)
+                day_counts = (_date.fromisoformat(date), np.zeros((NUM_AGES, len(STATES_BY_INDEX)), np.int32), [])
+                continue
+            values = json.loads(values)
+            if projection == 'person':
+                day_counts[1][values[0], DiseaseState[values[1]].value] = int(count)
+                continue
+            assert projection == 'infection', "Unknown projection %s" % projection
+            day_counts[2].extend([[indices[value] for indices, value in zip(value_to_index, values)]] * int(count))
+        if day_counts is not None:
+            yield self._make_day(*day_counts)
+
+    def _make_day(self, date, person_counts, infections):
+        return DayStatistics.from_counts(
+            date, person_counts,
+            np.array(infections, dtype=np.uint8).reshape(len(infections), len(InfectionData.get_keys())),
+            self.environment_names
+        )
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._num_days
+        if not 0 <= index < self._num_days:
+            raise IndexError("day index out of range")
+        if index == self._num_days - 1:
+            return self._last_day
+        start, end = self._day_offsets[index], self._day_offsets[index + 1]
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode()
+        [day] = self._read_days(csv.reader(io.StringIO(text, newline='')))
+        return day
+
+
 class Statistics(object):
     """
     The main object documenting the result of a single simulation.
-    Saves in self._days_data the DayStatistics object of each day.
+    Saves in self._days_data the DayStatistics object of each day
+    (in a list, or in a StreamedDaysData file if 'stream_days_data' is on in params.json).
+    Once the simulation is marked as ended, the days data is also indexed in self._series,
+    a time series of the counts of each index of the DayStatistics arrays (see Statistics._get_series).
     """
     __slots__ = (
         '_output_path',
         '_days_data',
+        '_series',
         '_final_state',
         'num_infected',
         '_interventions',
@@ -150,21 +430,29 @@ class Statistics(object):
         '_params_at_init',
         'all_environment_names',
         'full_env_name_to_short_env_name',
+        'environment_names',
         '_hood_data',
+        '_hood_infected',
     )
 
     def __init__(self, output_path, world):
         self._output_path = output_path
         if not os.path.isdir(output_path):
             os.mkdir(output_path)
-        self._days_data = []
+        self._series = None
         self._final_state = None
         self._interventions = []
         self._r0_data = None
         self.num_infected = 0
         self.min_date = None
         self.max_date = None
-        self._hood_data= {}
+        # The number of infected people in each neighborhood id, per date
+        self._hood_data = None
+        # The current number of infected people in each neighborhood id, updated from the daily changes
+        self._hood_infected = None
+        if Params.loader()['statistics']['track_neighborhoods']:
+            self._hood_data = {}
+            self._hood_infected = {}
         self.all_environment_names = set([env._full_name for env in world.all_environments])
         self.all_environment_names.add('initial_group')
         self.full_env_name_to_short_env_name = {'initial_group': 'initial_group'}
@@ -172,26 +460,60 @@ class Statistics(object):
             if env._full_name in self.full_env_name_to_short_env_name:
                 assert self.full_env_name_to_short_env_name[env._full_name] == env.name
             self.full_env_name_to_short_env_name[env._full_name] = env.name
+        # The short names of the environments, by their index in the infections of DayStatistics
+        self.environment_names = tuple(sorted(set(self.full_env_name_to_short_env_name.values())))
+        if Params.loader()['statistics']['stream_days_data']:
+            self._days_data = StreamedDaysData(os.path.join(output_path, DAYS_DATA_FILENAME), self.environment_names)
+        else:
+            self._days_data = []
         self._params_at_init = Params.loader()
 
+    def set_output_path(self, output_path):
+        """
+        Write the outputs of this object to another directory from now on (see Simulation.restore)
+        :param output_path: The path of the new output directory
+        """
+        self._output_path = output_path
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path)
+        if isinstance(self._days_data, StreamedDaysData):
+            self._days_data.move_to(os.path.join(output_path, DAYS_DATA_FILENAME))
+
     def add_daily_data(self, daily_data: DayStatistics,world:World):
         """
         Register the data of this day
         """
         assert self._final_state is None, "Can't add daily data after marked ending!"
         self._days_data.append(daily_data)
-        self.num_infected += self._days_data[-1].diff_infect
+        self.num_infected += daily_data.diff_infect
         self.update_date_range(daily_data.date)
-        #Counts how many are sick in each neighborhood
-        hood_data = {}
-        for person in world.all_people():
-            if person.get_disease_state().is_infected():
-                hoodID = person.get_neighberhood().get_neighborhood_id()
-                if hoodID not in hood_data:
-                    hood_data[hoodID] = 1 
-                else:
-                    hood_data[hoodID] +=1
-        self._hood_data[daily_data.date] = hood_data
+        if self._hood_data is not None:
+            self._update_hood_data(daily_data.date, world.get_changed_people())
+
+    def _update_hood_data(self, date, changed_population):
+        """
+        Count how many are sick in each neighborhood,
+        by updating the counts of the last day with the people that got infected or recovered today
+        :param date: the date of the day
+        :param changed_population: the people whose state changed today (see World.get_changed_people)
+        """
+        hood_infected = self._hood_infected
+        for person in changed_population:
+            last_state = person.get_last_state()
+            was_infected = last_state is not None and last_state.disease_state.is_infected()
+            if was_infected == person.get_disease_state().is_infected():
+                continue
+            hood = person.get_neighberhood()
+            if hood is None:
+                continue
+            hoodID = hood.get_neighborhood_id()
+            if was_infected:
+                hood_infected[hoodID] -= 1
+                if hood_infected[hoodID] == 0:
+                    del hood_infected[hoodID]
+            else:
+                hood_infected[hoodID] = hood_infected.get(hoodID, 0) + 1
+        self._hood_data[date] = dict(hood_infected)
 
     def get_neiborhood_data(self,date,hood_id):
         '''
@@ -221,6 +543,58 @@ class Statistics(object):
                     RedactedPersonAndEnv(person.get_age(), person.get_disease_state(), None)
                 )
         self._final_state = Counter(all_redacted_people)
+        self._series = {}
+        self._build_series([None] + list(InfectionData.get_keys()))
+
+    def _build_series(self, projections):
+        """
+        Index the days data by the given projections, in one pass over the days
+        :param projections: list of the projections to index (see Statistics._get_series)
+        """
+        series = {projection: [] for projection in projections}
+        keys = InfectionData.get_keys()
+        for day in self._days_data:
+            for projection, counts in series.items():
+                if projection is None:
+                    counts.append(day.person_counts)
+                    continue
+                projection_keys = (projection,) if isinstance(projection, str) else projection
+                columns = [keys.index(key) for key in projection_keys]
+                indices = np.ravel_multi_index(
+                    tuple(day.infections[:, columns].T.astype(np.intp)), self._get_projection_shape(projection))
+                counts.append(np.bincount(indices, minlength=np.prod(self._get_projection_shape(projection))))
+        for projection, counts in series.items():
+            self._series[projection] = np.array(counts, dtype=np.int32).reshape(
+                (len(counts),) + self._get_projection_shape(projection))
+
+    def _get_projection_shape(self, projection):
+        """
+        :param projection: None for the counts of people, otherwise the key or pair of keys of the infection data
+        :return: The shape of the counts of a day of that projection
+        """
+        if projection is None:
+            return NUM_AGES, len(STATES_BY_INDEX)
+        projection_keys = (projection,) if isinstance(projection, str) else projection
+        return tuple(len(DayStatistics.get_infection_values(key, self.environment_names)) for key in projection_keys)
+
+    def _get_series(self, infection_data):
+        """
+        :param infection_data: None for the counts of people,
+        otherwise the key or pair of keys of the infection data (see DataToPlot)
+        :return: np.ndarray with the day as the first axis and the axes of DayStatistics.get_person_mask or
+        DayStatistics.get_infection_mask as the rest, of the counts of each day.
+        The people and single keys are indexed on mark_ending, pairs of keys on their first use.
+        """
+        if infection_data not in self._series:
+            self._build_series([infection_data])
+        return self._series[infection_data]
+
+    def __getstate__(self):
+        # The series are not saved, they are indexed again on the first query after loading
+        state = {slot: getattr(self, slot) for slot in self.__slots__ if hasattr(self, slot)}
+        if state['_series'] is not None:
+            state['_series'] = {}
+        return None, state
 
     def update_date_range(self, date):
         """
@@ -247,7 +621,7 @@ class Statistics(object):
     def get_days_data(self):
         """
         Return the list of DayStatistics held on this object
-        :return: self._days_data
+        :return: self._days_data (a list or a StreamedDaysData)
         """
         return self._days_data
 
@@ -365,23 +739,33 @@ class Statistics(object):
         :return: A list of the number of people satisfying the property each day
         (or the daily change in that number, in the case where is_integral is False)
         """
-        data = []
-        for day in self._days_data:
-            if infection_data is None:
-                today_data = sum(
-                    count
-                    for reducted_person, count
-                    in day.person_count.items()
-                    if property_to_count(reducted_person)
-                )
-            else:
-                today_data = sum(
-                    count
-                    for reducted_infection, count
-                    in day.infection_data_projection[infection_data].items()
-                    if property_to_count(reducted_infection)
-                )
-            data.append(today_data)
+        return self.sum_days_data_by_mask(
+            self.get_days_data_mask(property_to_count, infection_data), is_integral, infection_data
+        )
+
+    def get_days_data_mask(self, property_to_count, infection_data=None):
+        """
+        :param property_to_count: see Statistics.sum_days_data
+        :param infection_data: see Statistics.sum_days_data
+        :return: The mask of the property over the counts of the days data
+        (see DayStatistics.get_person_mask and DayStatistics.get_infection_mask)
+        """
+        if infection_data is None:
+            return DayStatistics.get_person_mask(property_to_count)
+        return DayStatistics.get_infection_mask(property_to_count, infection_data, self.environment_names)
+
+    def sum_days_data_by_mask(self, mask, is_integral, infection_data=None):
+        """
+        Same as Statistics.sum_days_data, for a property that was already evaluated into a mask,
+        so the same mask can be used to sum the days data of several simulations
+        :param mask: see Statistics.get_days_data_mask
+        """
+        if self._series is not None:
+            data = self._get_series(infection_data)[:, mask].sum(axis=1).tolist()
+        elif infection_data is None:
+            data = [day.count_people(mask) for day in self._days_data]
+        else:
+            data = [day.count_infections(mask, infection_data) for day in self._days_data]
         if is_integral:
             data = integral_list(data)
         return data
@@ -427,13 +811,11 @@ class Statistics(object):
             lambda person: person_in_age_group(person) and
                            person.disease_state != DiseaseState.SUSCEPTIBLE
         )
-        maximum_infected_simultaneously = max(self.sum_days_data(
-            lambda person: person_in_age_group(person) and
-                   person.disease_state.is_infected(), True
+        maximum_infected_simultaneously = max(self.sum_days_data_by_mask(
+            _get_age_group_and_states_mask(age_group, INFECTED_STATES), True
         ))
-        maximum_critical_simultaneously = max(self.sum_days_data(
-            lambda person: person_in_age_group(person) and
-                           person.disease_state == DiseaseState.CRITICAL, True
+        maximum_critical_simultaneously = max(self.sum_days_data_by_mask(
+            _get_age_group_and_states_mask(age_group, (DiseaseState.CRITICAL,)), True
         ))
         
         ret = defaultdict(int)
@@ -479,18 +861,11 @@ class Statistics(object):
         """
         #Collecting the data
         lst = []
-        for i in range(len(self._days_data)):
-            if self._days_data[i].person_count == 0:
-                tmp = (self._days_data[i].date,None)
-            else:
-                d = self._days_data[i].date
-                states_col = []
-                for reducted_person, count in self._days_data[i].person_count.items():
-                    for i in range(count):
-                        states_col.append(reducted_person.disease_state)
-                cnt = Counter(states_col)
-                tmp = (d,cnt)
-            lst.append(tmp)
+        for day in self._days_data:
+            # The number of new people in each state
+            new_people = np.maximum(day.person_counts, 0).sum(axis=0)
+            cnt = Counter({STATES_BY_INDEX[state]: int(new_people[state]) for state in np.flatnonzero(new_people)})
+            lst.append((day.date, cnt))
         
         #Create corresponding string 
         table = [[] for i in range(len(lst)+1)]
@@ -1089,12 +1464,25 @@ def get_mean_and_confidence_from_statistics(stats_files, datas_to_plot, name, ou
         Statistics.load(file_name) for file_name in
         stats_files
     ]
-    list_of_samples_with_props = []
+    plot_mean_and_confidence_of_statistics(all_stats, datas_to_plot, name, outdir)
+
+
+def plot_mean_and_confidence_of_statistics(all_stats, datas_to_plot, name, outdir):
+    """
+    Same as get_mean_and_confidence_from_statistics, for Statistics objects that are already loaded
+    """
     longest_date_range = max_date_range(all_stats)
+    list_of_samples_with_props = []
     for data_to_plot in datas_to_plot:
+        # The property is evaluated once for all the simulations that have the same environments
+        masks = {}
         data_with_ranges = []
         for stat in all_stats:
-            days_data = stat.sum_days_data(data_to_plot.property_to_count, data_to_plot.is_integral, data_to_plot.infection_data)
+            if stat.environment_names not in masks:
+                masks[stat.environment_names] = stat.get_days_data_mask(
+                    data_to_plot.property_to_count, data_to_plot.infection_data)
+            days_data = stat.sum_days_data_by_mask(
+                masks[stat.environment_names], data_to_plot.is_integral, data_to_plot.infection_data)
             data_with_ranges.append((days_data, (stat.min_date, stat.max_date)))
         aligned_data = fill_in_dates(data_with_ranges, True)
         list_of_samples_with_props.append({
@@ -1113,6 +1501,13 @@ def get_r_mean_and_confidence_from_statistics(stats_files, name, outdir):
         Statistics.load(file_name) for file_name in
         stats_files
     ]
+    plot_r_mean_and_confidence_of_statistics(all_stats, name, outdir)
+
+
+def plot_r_mean_and_confidence_of_statistics(all_stats, name, outdir):
+    """
+    Same as get_r_mean_and_confidence_from_statistics, for Statistics objects that are already loaded
+    """
     longest_date_range = max_date_range(all_stats)
     smoothed_r0_avg_with_date_range = [
         (s.get_r0_data()['smoothed_avg_r0'], (s.get_r0_data()['dates'][0], s.get_r0_data()['dates'][-1]))
@@ -1139,42 +1534,71 @@ def get_multiple_stats_summary_file(stats_files, name, outdir, shortened=False):
     Statistics.write_multiple_stats_summary_file(all_stats, outdir, name, shortened=shortened)
 
 
-def apply_unless_all_nans(func, arr):
-    if all(isnan(arr)):
-        return NaN
-    else:
-        return func(arr)
+def get_repetitions_outputs_from_statistics(stats_files, datas_to_plot, name, outdir):
+    """
+    write all the outputs of multiple runs of the same simulation whose simulation dumps are stored in stats_files:
+    the mean and confidence of each group of datas_to_plot and of r, and the short and long summaries.
+    Each dump is loaded once for all the outputs.
+    :param datas_to_plot: dict from a name to a list of DataToPlot objects, that are plotted together
+    """
+    all_stats = [
+        Statistics.load(file_name) for file_name in
+        stats_files
+    ]
+    for data_name, data_to_plot in datas_to_plot.items():
+        plot_mean_and_confidence_of_statistics(all_stats, data_to_plot, name + "_" + data_name, outdir)
+    Statistics.write_multiple_stats_summary_file(all_stats, outdir, name, shortened=False)
+    Statistics.write_multiple_stats_summary_file(all_stats, outdir, name, shortened=True)
+    plot_r_mean_and_confidence_of_statistics(all_stats, name, outdir)
+
+
+def nan_mean_std_confidence(samples):
+    """
+    Compute the statistics of samples along their first axis, ignoring NaNs
+    :param samples: np.ndarray of samples, with the repetitions as the first axis
+    :return: tuple of np.ndarray-s of the mean, the standard deviation and the confidence
+    (the standard deviation over the square root of the number of repetitions),
+    NaN where all the samples are NaN
+    """
+    all_nans = isnan(samples).all(axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        expectation = nanmean(samples, axis=0)
+        std = nanstd(samples, axis=0)
+        confidence = std / sqrt(len(samples))
+    expectation[all_nans] = NaN
+    std[all_nans] = NaN
+    confidence[all_nans] = NaN
+    return expectation, std, confidence
 
 
 def compute_and_plot_mean_stddev_confidence(dates, list_of_all_samples_with_props, outdir, name):
     """
     process the samples in list_of_all_samples_with_props to compute the mean, the stddev and the confidence and plot them
     """
+    num_repetitions = len(list_of_all_samples_with_props[0]['samples'])
+    # repetition x day x series
+    samples = array(
+        [samples_with_props['samples'] for samples_with_props in list_of_all_samples_with_props], dtype=float
+    ).reshape(len(list_of_all_samples_with_props), num_repetitions, len(dates)).transpose(1, 2, 0)
+    expectation, std, confidence = nan_mean_std_confidence(samples)
     exp_data = []
     std_data = []
     confidence_data = []
-    for samples_with_props in list_of_all_samples_with_props:
-        samples = samples_with_props['samples']
+    for index, samples_with_props in enumerate(list_of_all_samples_with_props):
         props = samples_with_props['props']
         std_conf_props = props.copy()
         std_conf_props.pop('label')
-        expectation = [apply_unless_all_nans(nanmean, nums) for nums in zip(*samples)]
-        std = [apply_unless_all_nans(nanstd, nums) for nums in zip(*samples)]
-        confidence = [
-            apply_unless_all_nans(nanstd, nums) / sqrt(apply_unless_all_nans(len, nums))
-            for nums in zip(*samples)
-        ]
-
         exp_data.append({
-            'data': expectation,
+            'data': expectation[:, index].tolist(),
             'props': props
         })
         std_data.append({
-            'data': std,
+            'data': std[:, index].tolist(),
             'props': std_conf_props
         })
         confidence_data.append({
-            'data': confidence,
+            'data': confidence[:, index].tolist(),
             'props': std_conf_props
         })
     Statistics.plot_with_err(os.path.join(outdir, name + '_exp_std'), dates, exp_data, std_data)
@@ -1200,13 +1624,10 @@ def compute_r_from_statistics(param_and_stats_files, max_num_days, name, outdir)
         ]
         longest_date_range = max_date_range(all_stats, max_num_days=max_num_days)
         aligned_data = fill_in_dates(smoothed_r0_avg_with_date_range, False, longest_date_range)
-        expectation = [apply_unless_all_nans(nanmean, nums) for nums in zip(*aligned_data)]
-        std = [apply_unless_all_nans(nanstd, nums) for nums in zip(*aligned_data)]
-        confidence = [
-            apply_unless_all_nans(nanstd, nums) / sqrt(apply_unless_all_nans(len, nums))
-            for nums in zip(*aligned_data)
-        ]
-        data.append((expectation, std, confidence))
+        # The r data may go on after the date range that was cut to max_num_days
+        aligned_data = [samples[:len(longest_date_range)] for samples in aligned_data]
+        data.append(nan_mean_std_confidence(
+            array(aligned_data, dtype=float).reshape(len(aligned_data), len(longest_date_range))))
         params.append(param)
     exp_data = []
     std_data = []
@@ -1,24 +1,152 @@
+import functools
+import gc
 import json
 import math
 import multiprocessing as mp
 import os
+import shutil
 import sys
+import threading
 import time
 from datetime import date
+import bisect
 import copy
+import csv
 
+import numpy as np
 from tqdm import tqdm
 
 from src.util import seed
 from src.logs import *
+from src.logs.stats import nan_mean_std_confidence
 from src.simulation.params import Params
-from src.world.population_generation import PopulationLoader
+from src.world.city_data import get_cities_file_path, get_city_list_from_dem_xls
+from src.world.population_generation import PopulationLoader, population_key
+from src.world.population_generation.population_loader import MIN_CITY_SIZE
 from src.simulation.simulation import Simulation
 from src.simulation.initial_infection_params import SmartInitialInfectionParams, NaiveInitialInfectionParams
 from src.seir import DiseaseState
 
 INITIAL_DATE = date(year=2020, month=2, day=27)
 
+# The cost model of a task (see TaskCostModel), measured on Atlit and Kefar Yona:
+# the seconds it takes to load a person, and to simulate a person for a day
+SECONDS_PER_PERSON_LOADED = 2.5e-5
+SECONDS_PER_PERSON_DAY = 2.5e-6
+# The memory of a worker process before it loads a world, and the memory of each person of its world and simulation
+WORKER_BASE_MEMORY = 150e6
+MEMORY_PER_PERSON = 4e3
+# The seconds it takes to finalize a job for each simulation output it reads (mostly drawing its plots),
+# and the memory of each output it reads, per person of the world
+SECONDS_PER_OUTPUT_FINALIZED = 5.
+OUTPUT_MEMORY_PER_PERSON = 200
+# The part of the physical memory that the estimated memory of the running tasks may take, see TaskScheduler
+MEMORY_PERCENT = 0.8
+MAX_WORKERS = 30
+
+# The last world loaded by this process for a job with reuse_world, and the key it was loaded with.
+# see load_reusable_world and get_world_key
+_reusable_world = None
+_reusable_world_key = None
+# The worlds built by the parent process before forking the workers, by their get_world_key,
+# and the keys of the ones that a task of this process already ran on. see build_world_templates
+_world_templates = {}
+_used_world_templates = set()
+
+
+def get_world_key(cities_data_path, city_name, scale):
+    """
+    The key of the world a task of the given city runs on, with the loaded Params.
+    Params that differ only in what the population generation doesn't read (see population_key)
+    have the same key, so a sweep over the disease parameters shares a single world.
+    :param cities_data_path: path of the cities data file, see PopulationLoader
+    :param city_name: str city name, can be 'all' for entire country simulation
+    :param scale: float between 0-1, represents the size scale of the city
+    :return: str
+    """
+    return population_key(get_cities_file_path(cities_data_path), city_name.lower(), True, scale, Params.loader())
+
+
+def load_reusable_world(cities_data_path, city_name, scale, with_population_caching=True, verbosity=False):
+    """
+    Load the world of the given city once per process, and reuse it for the next tasks of this process
+    that ask for the same world, by resetting it in place (see World.reset) instead of generating or loading it again.
+    Only the last loaded world is kept, so a process that runs several configurations holds a single world.
+    The world depends on the loaded Params, so they should be loaded before calling this.
+    :param cities_data_path: path of the cities data file, see PopulationLoader
+    :param city_name: str city name, can be 'all' for entire country simulation
+    :param scale: float between 0-1, represents the size scale of the city
+    :param with_population_caching: bool, if False generates the population, else - tries to use the cache
+    :param verbosity: bool, if it's True then additional output logs will be printed to the screen
+    :return: World object, in the state it had before any simulation ran on it
+    """
+    global _reusable_world, _reusable_world_key
+    key = get_world_key(cities_data_path, city_name, scale)
+    if key in _world_templates:
+        world = _world_templates[key]
+        if key in _used_world_templates:
+            world.reset()
+        _used_world_templates.add(key)
+        return world
+    if _reusable_world_key == key:
+        _reusable_world.reset()
+        return _reusable_world
+    # Drop the previous world before loading the next one
+    _reusable_world, _reusable_world_key = None, None
+    population_loader = PopulationLoader(
+        cities_data_path,
+        with_caching=with_population_caching,
+        verbosity=verbosity
+    )
+    _reusable_world = population_loader.get_world(city_name=city_name, scale=scale, is_smart=True)
+    _reusable_world_key = key
+    return _reusable_world
+
+
+def build_world_templates(jobs, with_population_caching=True, verbosity=False):
+    """
+    Build every distinct world of the given jobs once, in this process (see get_world_key).
+    Workers that are forked from this process afterwards inherit the worlds copy-on-write,
+    and their tasks run on them instead of loading the world again (see load_reusable_world).
+    :param jobs: all the jobs to be running
+    :param with_population_caching: bool, if False generates the population, else - tries to use the cache
+    :param verbosity: bool, if it's True then additional output logs will be printed to the screen
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    print("Building all worlds...")
+    for job in jobs:
+        for params_to_change in job.get_all_params_changes():
+            # The same params as the task would load, see SimpleJob.create_and_run_simulation
+            Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+            for param, val in params_to_change.items():
+                Params.loader()[param] = val
+            key = get_world_key(citiesDataPath, job.city_name, job.scale)
+            if key in _world_templates:
+                continue
+            population_loader = PopulationLoader(
+                citiesDataPath,
+                with_caching=with_population_caching,
+                verbosity=verbosity
+            )
+            _world_templates[key] = population_loader.get_world(city_name=job.city_name, scale=job.scale, is_smart=True)
+    # Move the worlds out of the garbage collector's reach,
+    # so the collections in the workers don't write to (and copy) their memory pages
+    gc.freeze()
+    print("Done building {} worlds.".format(len(_world_templates)))
+
+
+def clear_world_templates():
+    """
+    Drop the worlds built by build_world_templates, once the workers that use them are done
+    """
+    _world_templates.clear()
+    _used_world_templates.clear()
+    gc.unfreeze()
+
 
 class Task:
     """""
@@ -92,6 +220,16 @@ class RunningJob(object):
         """
         raise NotImplementedError()
 
+    def generate_next_tasks(self, outdir, stop_early=None):
+        """
+        Called after all the tasks of this job so far are done, to let the job run more tasks before it's finalized
+        (e.g. the waves of a RepeatJob with tolerances)
+        :param outdir: path to the output directory, for all the output files of the tasks
+        :param stop_early: relevant for R computation, see Simulation doc
+        :return: list of Task objects to run, empty if the job is done
+        """
+        return []
+
     def finalize(self, outdir):
         """
         This func handles the outputs that need to be written after all the tasks are finished.
@@ -107,6 +245,18 @@ class RunningJob(object):
         """
         return [self.params_to_change]
 
+    def get_days_per_task(self):
+        """
+        :return: int number of days that each task of this job simulates, see TaskCostModel
+        """
+        return self.days
+
+    def get_num_finalized_outputs(self):
+        """
+        :return: int number of simulation outputs (statistics files) that finalize reads, see TaskCostModel
+        """
+        return 0
+
 
 class SimpleJob(RunningJob):
     """
@@ -115,7 +265,7 @@ class SimpleJob(RunningJob):
 
     def __init__(self, scenario_name, city_name, scale, infection_params=SmartInitialInfectionParams(100, 50),
                  days=250, city_name_to_infect=None, initial_date=INITIAL_DATE,
-                 params_to_change=None, datas_to_plot=None, interventions=None):
+                 params_to_change=None, datas_to_plot=None, interventions=None, reuse_world=False):
         """
         Initialize a simple job, that runs one simulation task
         :param scenario_name: str name to use for the directories and filenames of the outputs
@@ -129,6 +279,8 @@ class SimpleJob(RunningJob):
         :param params_to_change: dict of the temporary changes to make to Param object
         :param datas_to_plot: states what data from the simulation will be counted and saved to output plots,
         see DataToPlot doc. Has a default behavior if the param is omitted.
+        :param reuse_world: bool, if True the process running the task keeps the world it loaded,
+        and resets it for its next tasks of the same world instead of loading it again (see load_reusable_world)
         """
 
         super(SimpleJob, self).__init__(
@@ -138,6 +290,7 @@ class SimpleJob(RunningJob):
         )
         self.infection_params = infection_params
         self.city_name_to_infect = city_name_to_infect
+        self.reuse_world = reuse_world
         self.datas_to_plot = datas_to_plot
         if self.datas_to_plot is None:
             self.datas_to_plot = {
@@ -171,6 +324,22 @@ class SimpleJob(RunningJob):
         :param with_population_caching: bool, if False generates the population, else - tries to use the cache and save time.
         :param verbosity: bool, if it's True then additional output logs will be printed to the screen
         """
+        world, Extensionslst = self.load_params_and_world(with_population_caching, verbosity)
+        sim = Simulation(world, self.initial_date, self.interventions,
+                         verbosity=verbosity, outdir=outdir, stop_early=stop_early)
+        self.infection_params.infect_simulation(sim, outdir)
+        if len(Extensionslst) > 0:
+            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = Extensionslst)
+        else:
+            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = None)
+
+    def load_params_and_world(self, with_population_caching=True, verbosity=False):
+        """
+        Seed the random generators, load the params with the params changes of this job and load its world
+        :param with_population_caching: bool, if False generates the population, else - tries to use the cache and save time.
+        :param verbosity: bool, if it's True then additional output logs will be printed to the screen
+        :return: pair of the World object and the list of names of the extensions in config.json
+        """
         seed.set_random_seed()
         config_path = os.path.join(os.path.dirname(__file__),"config.json")
         with open(config_path) as json_data_file:
@@ -186,24 +355,21 @@ class SimpleJob(RunningJob):
         citiesDataPath  = citiesDataPath
         
 
-        population_loader = PopulationLoader(
-            citiesDataPath,
-            added_description=Params.loader().description(),
-            with_caching=with_population_caching,
-            verbosity=verbosity
-        )
-
-        world = population_loader.get_world(city_name=self.city_name, scale=self.scale,is_smart = True)
-
-        ExtensionType = None
-        
-        sim = Simulation(world, self.initial_date, self.interventions,
-                         verbosity=verbosity, outdir=outdir, stop_early=stop_early)
-        self.infection_params.infect_simulation(sim, outdir)
-        if len(Extensionslst) > 0:
-            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = Extensionslst)
+        # Workers forked with world templates always run on them, see run
+        if self.reuse_world or _world_templates:
+            world = load_reusable_world(
+                citiesDataPath, self.city_name, self.scale,
+                with_population_caching=with_population_caching,
+                verbosity=verbosity
+            )
         else:
-            sim.run_simulation(self.days, self.scenario_name, datas_to_plot=self.datas_to_plot,extensionsList = None)
+            population_loader = PopulationLoader(
+                citiesDataPath,
+                with_caching=with_population_caching,
+                verbosity=verbosity
+            )
+            world = population_loader.get_world(city_name=self.city_name, scale=self.scale,is_smart = True)
+        return world, Extensionslst
 
 
 class RepeatJob(RunningJob):
@@ -211,15 +377,24 @@ class RepeatJob(RunningJob):
     A subclass that implements a job which repeat a given SimpleJob several times,
     and plots the mean, std and confidence of each of the outputs.
     If datas_to_plot is not given it plots the same graphs of its repeated job.
+    With tolerances, the repetitions run in waves, until the outputs are precise enough.
     """
 
-    def __init__(self, job, num_repetitions, datas_to_plot=None):
+    def __init__(self, job, num_repetitions, datas_to_plot=None, reuse_world=False, tolerances=None, wave_size=10):
         """
         initialize a repeated job
         :param job: SimpleJob object to repeatedly run
-        :param num_repetitions: int times to run the job
+        :param num_repetitions: int times to run the job, the maximal number of times if tolerances is given
         :param datas_to_plot: states what data from the simulation will be counted and saved to output plots,
         see DataToPlot doc. The default behavior if the param is omitted, is to generate the outputs of the given job
+        :param reuse_world: bool, if True the repetitions that run in the same process share one world,
+        which is reset between them instead of being loaded again (see SimpleJob)
+        :param tolerances: dict from the name of a summary metric (a key of Statistics.get_summary_data_for_age_group,
+        e.g. "Total infected" or "Maximum critical simultaneously") to the largest confidence of its mean
+        (see nan_mean_std_confidence) relative to the mean. If given, the repetitions run in waves of wave_size,
+        and stop when the confidence of every metric is within its tolerance.
+        The precision that was achieved is written to the precision file of the job.
+        :param wave_size: int number of repetitions in a wave, see tolerances
         """
         super(RepeatJob, self).__init__(
             job.scenario_name, job.city_name, job.scale,
@@ -233,6 +408,15 @@ class RepeatJob(RunningJob):
         self.jobs = [copy.deepcopy(job) for ind in range(num_repetitions)]
         for ind in range(num_repetitions):
             self.jobs[ind].scenario_name = "sample_" + str(ind)
+            if reuse_world:
+                self.jobs[ind].reuse_world = True
+        assert tolerances is None or wave_size > 1, "The confidence of a single repetition is meaningless"
+        self.tolerances = tolerances
+        self.wave_size = wave_size
+        # The number of repetitions whose tasks were generated so far
+        self.num_launched = 0
+        # The values of the metrics of the tolerances in each of the finished repetitions
+        self.metric_values = []
 
     def update_params(self, params_change):
         """
@@ -253,7 +437,47 @@ class RepeatJob(RunningJob):
         outdir = os.path.join(outdir, self.scenario_name)
         assert not os.path.exists(outdir), "Directory '%s' already exists!" % outdir
         os.makedirs(outdir)
-        return sum([job.generate_tasks(outdir, stop_early) for job in self.jobs], [])
+        return self._generate_wave(outdir, stop_early)
+
+    def generate_next_tasks(self, outdir, stop_early=None):
+        """
+        With tolerances, returns the tasks of the next wave of repetitions,
+        unless the metrics are precise enough or all the repetitions were launched
+        :param outdir: the path to the output directory
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :return: list of Task objects
+        """
+        if self.tolerances is None:
+            return []
+        outdir = os.path.join(outdir, self.scenario_name)
+        for job in self.jobs[len(self.metric_values):self.num_launched]:
+            summary = Statistics.load(os.path.join(outdir, job.scenario_name, "statistics.pkl")) \
+                .get_summary_data_for_age_group(None)
+            for metric in self.tolerances:
+                assert metric in summary, "Unknown summary metric '%s'" % metric
+            self.metric_values.append([summary[metric] for metric in self.tolerances])
+        if self.num_launched == self.num_repetitions or all(
+                converged for _, _, converged in self.get_precision().values()):
+            return []
+        return self._generate_wave(outdir, stop_early)
+
+    def _generate_wave(self, outdir, stop_early):
+        first = self.num_launched
+        wave_size = self.num_repetitions if self.tolerances is None else self.wave_size
+        self.num_launched = min(first + wave_size, self.num_repetitions)
+        return sum([job.generate_tasks(outdir, stop_early) for job in self.jobs[first:self.num_launched]], [])
+
+    def get_precision(self):
+        """
+        The precision of the metrics of the tolerances over the finished repetitions
+        :return: dict from the name of a metric to a tuple of its mean, its confidence
+        and whether the confidence is within the tolerance of the metric
+        """
+        expectation, _, confidence = nan_mean_std_confidence(np.array(self.metric_values, dtype=float))
+        return {
+            metric: (mean, conf, bool(conf <= tolerance * abs(mean)))
+            for metric, tolerance, mean, conf in zip(self.tolerances, self.tolerances.values(), expectation, confidence)
+        }
 
     def finalize(self, outdir):
         """
@@ -263,16 +487,39 @@ class RepeatJob(RunningJob):
         """
         outdir = os.path.join(outdir, self.scenario_name)
         stats_files = []
-        for index in range(self.num_repetitions):
+        for index in range(self.num_launched):
             stats_files.append(os.path.join(
                 outdir, self.jobs[index].scenario_name,
                 "statistics.pkl"
             ))
-        for name, data_to_plot in self.datas_to_plot.items():
-            get_mean_and_confidence_from_statistics(stats_files, data_to_plot, self.scenario_name + "_" + name, outdir)
-        get_multiple_stats_summary_file(stats_files, self.scenario_name, outdir, shortened=False)
-        get_multiple_stats_summary_file(stats_files, self.scenario_name, outdir, shortened=True)
-        get_r_mean_and_confidence_from_statistics(stats_files, self.scenario_name, outdir)
+        get_repetitions_outputs_from_statistics(stats_files, self.datas_to_plot, self.scenario_name, outdir)
+        if self.tolerances is not None:
+            self.write_precision_file(outdir)
+
+    def write_precision_file(self, outdir):
+        """
+        Write the precision of the metrics of the tolerances, and the number of repetitions it took, to a csv file
+        :param outdir: output directory path
+        """
+        path = os.path.join(outdir, self.scenario_name + "_precision.csv")
+        assert not os.path.exists(path), "File %s already exists!" % path
+        with open(path, 'w', newline='') as f:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow((
+                'metric', 'mean', 'confidence', 'relative confidence', 'tolerance', 'converged',
+                'repetitions', 'max repetitions'
+            ))
+            for metric, (mean, confidence, converged) in self.get_precision().items():
+                csv_writer.writerow((
+                    metric, mean, confidence, confidence / abs(mean) if mean else 0.0, self.tolerances[metric],
+                    converged, len(self.metric_values), self.num_repetitions
+                ))
+
+    def get_num_finalized_outputs(self):
+        """
+        :return: int number of repetitions that finalize reads
+        """
+        return self.num_launched
 
     def get_all_params_changes(self):
         """
@@ -281,6 +528,154 @@ class RepeatJob(RunningJob):
         return sum([job.get_all_params_changes() for job in self.jobs], [])
 
 
+class BranchingJob(RunningJob):
+    """
+    A subclass that implements a job which runs several SimpleJobs that differ only in the interventions
+    that start on or after some date (the branch date).
+    Each of its tasks simulates the common prefix of the jobs once - the initial infection, the interventions
+    that all the jobs have and the days before the branch date - and takes a checkpoint of it (see Simulation.checkpoint).
+    Then it continues each of the jobs from the checkpoint, with the rest of the job's interventions.
+    The outputs of each job are in a directory with its scenario name. If there are several repetitions,
+    each of them simulates its own prefix, and the outputs of each job are the ones of a RepeatJob of it.
+    """
+
+    def __init__(self, scenario_name, jobs, num_repetitions=1, datas_to_plot=None):
+        """
+        initialize a branching job
+        :param scenario_name: str name of the directory of the outputs of all the jobs
+        :param jobs: list of SimpleJob objects, with the same city, scale, initial date, params changes
+        and initial infection. The jobs share the interventions that are equal (see Intervention.__eq__),
+        even if they are different objects
+        :param num_repetitions: int times to run each of the jobs
+        :param datas_to_plot: states what data from the repetitions will be counted and saved to output plots,
+        see RepeatJob. The default behavior if the param is omitted, is to generate the outputs of each job
+        """
+        first = jobs[0]
+        shared_interventions = [
+            intervention for intervention in first.interventions
+            if all(intervention in job.interventions for job in jobs)
+        ]
+        super(BranchingJob, self).__init__(
+            scenario_name, first.city_name, first.scale,
+            max(job.days for job in jobs), first.initial_date, first.params_to_change, shared_interventions
+        )
+        for job in jobs:
+            assert isinstance(job, SimpleJob), "No implementation of BranchingJob for job of type %s" % type(job)
+            assert (job.city_name, job.scale, job.initial_date, job.params_to_change) == \
+                (first.city_name, first.scale, first.initial_date, first.params_to_change) and \
+                type(job.infection_params) == type(first.infection_params) and \
+                vars(job.infection_params) == vars(first.infection_params), \
+                "Job %s doesn't start like job %s" % (job.scenario_name, first.scenario_name)
+        assert len(set(job.scenario_name for job in jobs)) == len(jobs), "The jobs must have different scenario names"
+        self.jobs = jobs
+        self.num_repetitions = num_repetitions
+        self.datas_to_plot = datas_to_plot
+        # The interventions of each job that it adds to the checkpoint
+        self.branch_interventions = [
+            [intervention for intervention in job.interventions if intervention not in shared_interventions]
+            for job in jobs
+        ]
+        # The number of days of the prefix, up to the first intervention that not all the jobs have
+        self.prefix_days = min(job.days for job in jobs)
+        for interventions in self.branch_interventions:
+            for intervention in interventions:
+                self.prefix_days = min(self.prefix_days, max((intervention.start_date - self.initial_date).days, 0))
+
+    def update_params(self, params_change):
+        """
+        Update the param changes from the given job to all the jobs
+        :param params_change: dict of changes to Params
+        """
+        super(BranchingJob, self).update_params(params_change)
+        for job in self.jobs:
+            job.update_params(params_change)
+
+    def generate_tasks(self, outdir, stop_early=None):
+        """
+        creates the output directory for the run, and returns a task for each repetition
+        :param outdir: the path to the output directory
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :return: list of Task objects
+        """
+        outdir = os.path.join(outdir, self.scenario_name)
+        assert not os.path.exists(outdir), "Directory '%s' already exists!" % outdir
+        os.makedirs(outdir)
+        return [
+            Task(functools.partial(self.run_branches, self._get_sample_name(index)), (outdir, stop_early))
+            for index in range(self.num_repetitions)
+        ]
+
+    def get_days_per_task(self):
+        """
+        :return: int number of days that each task simulates, the prefix once and the rest of each job
+        """
+        return self.prefix_days + sum(job.days - self.prefix_days for job in self.jobs)
+
+    def get_num_finalized_outputs(self):
+        """
+        :return: int number of repetitions of a job that finalize reads at a time
+        """
+        return 0 if self.num_repetitions == 1 else self.num_repetitions
+
+    def _get_sample_name(self, index):
+        if self.num_repetitions == 1:
+            return None
+        return "sample_" + str(index)
+
+    def _get_job_outdir(self, outdir, job, sample_name):
+        job_outdir = os.path.join(outdir, job.scenario_name)
+        if sample_name is not None:
+            job_outdir = os.path.join(job_outdir, sample_name)
+        return job_outdir
+
+    def run_branches(self, sample_name, outdir, stop_early, with_population_caching=True, verbosity=False):
+        """
+        The main function of a task. It simulates the prefix once, and then each of the jobs from its checkpoint.
+        :param sample_name: str name of the directory of the repetition in the directory of each job,
+        None if there is a single repetition (which writes to the directory of the job itself)
+        :param outdir: the output directory of this BranchingJob
+        :param stop_early: only relevant to R computation, see Simulation doc
+        :param with_population_caching: bool, if False generates the population, else - tries to use the cache and save time.
+        :param verbosity: bool, if it's True then additional output logs will be printed to the screen
+        """
+        first = self.jobs[0]
+        world, Extensionslst = first.load_params_and_world(with_population_caching, verbosity)
+        prefix_outdir = os.path.join(outdir, "prefix" if sample_name is None else "prefix_" + sample_name)
+        sim = Simulation(world, self.initial_date, self.interventions,
+                         verbosity=verbosity, outdir=prefix_outdir, stop_early=stop_early)
+        first.infection_params.infect_simulation(sim, prefix_outdir)
+        stopped_early = sim.simulate_days(self.prefix_days, sim.load_extensions(Extensionslst))
+        snapshot = sim.checkpoint()
+        del sim
+        for job, interventions in zip(self.jobs, self.branch_interventions):
+            branch = Simulation.restore(snapshot, self._get_job_outdir(outdir, job, sample_name))
+            branch.add_interventions(interventions)
+            branch.run_simulation(
+                0 if stopped_early else job.days - self.prefix_days, job.scenario_name,
+                datas_to_plot=job.datas_to_plot, extensionsList=Extensionslst if len(Extensionslst) > 0 else None
+            )
+        shutil.rmtree(prefix_outdir)
+
+    def finalize(self, outdir):
+        """
+        If there are several repetitions, computes the mean, std and confidence of the repetitions of each job,
+        and saves them to the output directory of the job (see RepeatJob)
+        :param outdir: output directory path
+        """
+        if self.num_repetitions == 1:
+            return
+        outdir = os.path.join(outdir, self.scenario_name)
+        for job in self.jobs:
+            stats_files = [
+                os.path.join(self._get_job_outdir(outdir, job, self._get_sample_name(index)), "statistics.pkl")
+                for index in range(self.num_repetitions)
+            ]
+            datas_to_plot = self.datas_to_plot if self.datas_to_plot is not None else job.datas_to_plot
+            get_repetitions_outputs_from_statistics(
+                stats_files, datas_to_plot, job.scenario_name, os.path.join(outdir, job.scenario_name)
+            )
+
+
 class ParamChangeRJob(RunningJob):
     """
     A subclass that implements a job which repeat a given job and change each time one given parameter value.
@@ -333,6 +728,16 @@ class ParamChangeRJob(RunningJob):
         os.makedirs(outdir)
         return sum([job.generate_tasks(outdir, ("r", self.num_rs)) for job in self.jobs], [])
 
+    def generate_next_tasks(self, outdir, stop_early=None):
+        """
+        generates the next tasks of each job, see RepeatJob.generate_next_tasks
+        :param outdir: the output directory path
+        :param stop_early: TBD, multiple stopping when computing R
+        :return: list of the tasks to run
+        """
+        outdir = os.path.join(outdir, self.scenario_name)
+        return sum([job.generate_next_tasks(outdir, ("r", self.num_rs)) for job in self.jobs], [])
+
     def finalize(self, outdir):
         """
         After all the jobs are done, make the output files that are related to R computations
@@ -343,7 +748,7 @@ class ParamChangeRJob(RunningJob):
         for index in range(self.num_repetitions):
             stats_files = []
             job = self.jobs[index]
-            for job2 in job.jobs:
+            for job2 in job.jobs[:job.num_launched]:
                 stats_files.append(os.path.join(
                     outdir, job.scenario_name, job2.scenario_name,
                     "statistics.pkl"
@@ -351,6 +756,12 @@ class ParamChangeRJob(RunningJob):
             param_and_stats_files.append((self.param_range[index], stats_files))
         compute_r_from_statistics(param_and_stats_files, self.num_rs, self.scenario_name, outdir)
 
+    def get_num_finalized_outputs(self):
+        """
+        :return: int number of repetitions of all the jobs, which finalize reads
+        """
+        return sum(job.num_launched for job in self.jobs)
+
     def get_all_params_changes(self):
         """
         returns all the param changes of this job
@@ -361,8 +772,8 @@ class ParamChangeRJob(RunningJob):
 
 def create_city_and_serialize(city_name, scale, params_to_change):
     """
-    Generate population of a given city.
-    Done once for each triplet (city, scale, params_to_change).
+    Generate population of a given city, and save it in the population cache.
+    Done once for each distinct world of the jobs (see get_world_key).
     :param city_name: str city name, "all" for entire country
     :param scale: float between 0-1, that states the size proportion of the city. 1 if for actual size
     :param params_to_change: dict of params to change, in Params object
@@ -375,20 +786,9 @@ def create_city_and_serialize(city_name, scale, params_to_change):
         paramsDataPath = ConfigData['ParamsFilePath']
 
     Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
-    
-    #Check if dictionary is empty
-    if not params_to_change:
-        for param, val in params_to_change.items():
-            Params.loader()[param] = val
-        population_loader = PopulationLoader(citiesDataPath,
-            added_description=Params.loader().description(),
-            with_caching= False
-        )
-    else:
-        population_loader = PopulationLoader(citiesDataPath,
-            added_description="",
-            with_caching= False
-        )
+    for param, val in params_to_change.items():
+        Params.loader()[param] = val
+    population_loader = PopulationLoader(citiesDataPath, with_caching=True)
     population_loader.get_world(city_name=city_name, scale=scale)
 
 
@@ -399,23 +799,23 @@ def generate_all_cities_for_jobs(jobs, cpus_to_use):
     :param jobs: all the jobs to be running
     :param cpus_to_use: the number of cpu cores to use, if grater than 1, the run will be multi processed
     """
-    appearing_cities = set((job.city_name, job.scale) for job in jobs)
-    appearing_cities_to_params = {city: [] for city in appearing_cities}
+    config_path = os.path.join(os.path.dirname(__file__), "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    # Params changes that don't change the generated world share its cache file, so each world is generated once
+    key_to_city_and_params = {}
     for job in jobs:
-        appearing_cities_to_params[(job.city_name, job.scale)] += job.get_all_params_changes()
-    for city in appearing_cities:
-        appearing_cities_to_params[city] = list(
-            map(dict, set(tuple(sorted(d.items())) for d in appearing_cities_to_params[city])))
-
-    appearing_cities_and_params = [
-        (city_name, scale, params_to_change)
-        for city_name, scale in appearing_cities
-        for params_to_change in appearing_cities_to_params[(city_name, scale)]
-    ]
+        for params_to_change in job.get_all_params_changes():
+            Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+            for param, val in params_to_change.items():
+                Params.loader()[param] = val
+            key = get_world_key(citiesDataPath, job.city_name, job.scale)
+            key_to_city_and_params.setdefault(key, (job.city_name, job.scale, params_to_change))
+    appearing_cities_and_params = list(key_to_city_and_params.values())
     print("Generating all cities...")
     if cpus_to_use == 1:
-        for city_name, scale in appearing_cities:
-            create_city_and_serialize(city_name, scale, Params.loader())
         for city_name, scale, params_to_change in appearing_cities_and_params:
             create_city_and_serialize(city_name, scale, params_to_change)
     else:
@@ -446,88 +846,334 @@ def create_outdir():
     print('your outputs will be in: {}'.format(curr_outdir))
     return curr_outdir
 
-def calc_CPU_count(maxCPU:int,percentCPU:float,jobs):
-    if len(jobs) > 700:
-        percentCPU = 0.75
-    if len(jobs) > 850:
-        percentCPU = 0.5
-    if len(jobs) > 1000:
-        percentCPU = 0.25
+def get_num_workers(maxCPU:int,percentCPU:float,num_tasks:int):
+    """
+    The number of worker processes of a run: the given percentage of the cores, but no more than the tasks.
+    Running more tasks at once than fit in the memory is prevented by the TaskScheduler, not by fewer workers.
+    :param maxCPU: int maximal number of workers
+    :param percentCPU: float part of the cores to use
+    :param num_tasks: int number of tasks to run
+    :return: int
+    """
+    return max(min(int(math.floor(mp.cpu_count() * percentCPU)), maxCPU, num_tasks), 1)
+
+
+def get_physical_memory():
+    """
+    :return: The size of the physical memory in bytes, or None if it's unknown on this platform
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
 
-    return min(int(math.floor(mp.cpu_count() * percentCPU)), maxCPU)
 
-def run(jobs, multi_processed=True, with_population_caching=True, verbosity=True):
+class TaskCostModel(object):
+    """
+    Estimates the run time and the memory of the tasks of a job, from the number of people it simulates
+    (the population of its city times its scale) and the number of days it simulates.
+    The time grows linearly with the people and with people * days, and the memory linearly with the people.
+    """
+    __slots__ = ('_populations',)
+
+    def __init__(self, cities_data_path):
+        """
+        :param cities_data_path: path of the cities data file, see PopulationLoader
+        """
+        self._populations = {city.get_name(): city.population for city in get_city_list_from_dem_xls(cities_data_path)}
+
+    def get_num_people(self, city_name, scale):
+        """
+        :param city_name: str city name, can be 'all' for entire country simulation
+        :param scale: float between 0-1, represents the size scale of the city
+        :return: float estimated number of people in the world
+        """
+        if city_name == 'all':
+            # The cities that are generated for the entire country, see PopulationLoader.get_all_large_enough_cities
+            return scale * sum(population for population in self._populations.values()
+                               if population * scale > MIN_CITY_SIZE)
+        return scale * self._populations.get(city_name.lower(), 0)
+
+    def estimate(self, job):
+        """
+        :param job: RunningJob
+        :return: pair of the estimated seconds and bytes of memory of each of the tasks of the job
+        """
+        num_people = self.get_num_people(job.city_name, job.scale)
+        seconds = num_people * (SECONDS_PER_PERSON_LOADED + SECONDS_PER_PERSON_DAY * job.get_days_per_task())
+        return seconds, WORKER_BASE_MEMORY + MEMORY_PER_PERSON * num_people
+
+    def estimate_finalize(self, job):
+        """
+        :param job: RunningJob
+        :return: pair of the estimated seconds and bytes of memory of the task that finalizes the job (see finalize_job)
+        """
+        num_outputs = job.get_num_finalized_outputs()
+        num_people = self.get_num_people(job.city_name, job.scale)
+        return SECONDS_PER_OUTPUT_FINALIZED * num_outputs, \
+            WORKER_BASE_MEMORY + OUTPUT_MEMORY_PER_PERSON * num_people * num_outputs
+
+
+class TaskScheduler(object):
+    """
+    Starts tasks on a pool of workers, the longest first (by their estimated run time, see TaskCostModel),
+    as long as there is a free worker and the estimated memory of the running tasks fits in the memory budget.
+    A task that doesn't fit in the budget still runs when no other task is running.
+    No task starts before start is called, so the first tasks to start are the longest of all the tasks added before it.
+    Tasks are added and marked done from different threads (the pool calls its callbacks in a thread of its own),
+    and wait_finished lets the thread that added them handle the tasks that finished.
+    """
+    __slots__ = (
+        '_num_workers',
+        '_memory_budget',
+        '_start_task',
+        '_condition',
+        '_pending',
+        '_num_added',
+        '_running',
+        '_finished',
+        '_memory_in_use',
+        '_peak_memory',
+        '_busy_time',
+        '_start_time'
+    )
+
+    def __init__(self, num_workers, memory_budget, start_task):
+        """
+        :param num_workers: int number of workers of the pool
+        :param memory_budget: the bytes of memory that the running tasks may take, None for no limit
+        :param start_task: function that gets a Task and starts running it on the pool
+        """
+        self._num_workers = num_workers
+        self._memory_budget = memory_budget
+        self._start_task = start_task
+        # Notified when tasks finish
+        self._condition = threading.Condition()
+        # Tuples of (-seconds, the number of tasks added before, memory, task), sorted from the longest task
+        self._pending = []
+        self._num_added = 0
+        # The memory and the start time of each running task, by its python id
+        self._running = {}
+        # Tuples of (task, error) of the tasks that finished since the last call to wait_finished
+        self._finished = []
+        self._memory_in_use = 0
+        self._peak_memory = 0
+        # The total time of the tasks that finished
+        self._busy_time = 0
+        # None until the scheduler is started
+        self._start_time = None
+
+    def start(self):
+        """
+        Start the tasks that can start, and from now on start tasks as soon as they can start
+        """
+        with self._condition:
+            self._start_time = time.time()
+            self._start_pending()
+
+    def add(self, tasks, seconds, memory):
+        """
+        Add tasks to run, and start the ones that can start (if the scheduler was started)
+        :param tasks: list of Task objects
+        :param seconds: the estimated run time of each task
+        :param memory: the estimated memory of each task
+        """
+        with self._condition:
+            for task in tasks:
+                bisect.insort(self._pending, (-seconds, self._num_added, memory, task))
+                self._num_added += 1
+            self._start_pending()
+
+    def done(self, task, error=None):
+        """
+        Mark a running task as done, and start the tasks that can start now
+        :param task: Task object
+        :param error: the exception that the task raised, None if it succeeded
+        """
+        with self._condition:
+            memory, start_time = self._running.pop(id(task))
+            self._memory_in_use -= memory
+            self._busy_time += time.time() - start_time
+            self._finished.append((task, error))
+            self._start_pending()
+            self._condition.notify_all()
+
+    def wait_finished(self):
+        """
+        Wait until some tasks finish, or until no task is running or pending
+        :return: list of (task, error) of the tasks that finished since the last call, in the order they finished
+        (see done). The list is empty only when no task is running or pending
+        """
+        with self._condition:
+            while not self._finished and (self._running or self._pending):
+                self._condition.wait()
+            finished, self._finished = self._finished, []
+            return finished
+
+    def _start_pending(self):
+        if self._start_time is None:
+            return
+        while self._pending and len(self._running) < self._num_workers:
+            index = next((index for index, (_, _, memory, _) in enumerate(self._pending) if self._fits(memory)), None)
+            if index is None:
+                return
+            _, _, memory, task = self._pending.pop(index)
+            self._running[id(task)] = (memory, time.time())
+            self._memory_in_use += memory
+            self._peak_memory = max(self._peak_memory, self._memory_in_use)
+            self._start_task(task)
+
+    def _fits(self, memory):
+        return self._memory_budget is None or not self._running or \
+            self._memory_in_use + memory <= self._memory_budget
+
+    def get_report(self):
+        """
+        :return: str of the utilization of the workers and the peak estimated memory of the tasks so far
+        """
+        with self._condition:
+            wall_time = 0 if self._start_time is None else time.time() - self._start_time
+            utilization = self._busy_time / (wall_time * self._num_workers) if wall_time > 0 else 0
+            return "{} tasks on {} workers in {:.0f}s: {:.0%} utilization, {:.2f}GB peak estimated memory".format(
+                self._num_added, self._num_workers, wall_time, utilization, self._peak_memory / 1e9
+            )
+
+
+def create_task_pool(num_workers, use_fork_templates):
+    """
+    :param num_workers: int number of worker processes
+    :param use_fork_templates: bool, whether to fork the workers (see run) or spawn them
+    :return: multiprocessing Pool, whose workers draw different random numbers even when they are forked
+    """
+    ctx = mp.get_context("fork" if use_fork_templates else "spawn")
+    return ctx.Pool(num_workers, initializer=seed.reseed_process)
+
+
+def finalize_job(job, outdir, stop_early, with_population_caching=True, verbosity=False):
+    """
+    The task that finalizes the given job (see RunningJob.finalize), which run starts like the simulation tasks
+    :param job: RunningJob whose tasks are all done
+    :param outdir: path to the output directory of the run
+    The other params are the ones of every task (see SimpleJob.create_and_run_simulation), finalize doesn't use them
+    """
+    job.finalize(outdir)
+
+
+def run(jobs, multi_processed=True, with_population_caching=True, verbosity=True,
+        use_fork_templates=False, num_workers=None, memory_budget=None):
     """
     This func handles the user's run of the given simulation jobs.
     The run of the jobs can be multi processed, with each simulation as a unique process, and can use cached population
     to save time.
+    Multi processed tasks are started by a TaskScheduler, the longest first, as long as their memory fits.
+    The tasks that finalize the jobs are started by it too, once the other tasks of their job are done.
+    :param use_fork_templates: bool, relevant for multi processed runs. If False the workers are spawned,
+    and each task loads its world. If True the worlds are built once in this process (see build_world_templates),
+    and the workers are forked from it, so they start without importing or loading anything,
+    and share the worlds copy-on-write. Requires the 'fork' start method (not available on Windows).
+    :param num_workers: int number of worker processes, if None it's computed from 'CPU_percent' in config.json
+    :param memory_budget: the bytes of memory that the running tasks may take by their estimates (see TaskCostModel),
+    if None it's MEMORY_PERCENT of the physical memory
     """
     config_path =os.path.join(os.path.dirname(__file__), "config.json")
     with open(config_path) as json_data_file:
         ConfigData = json.load(json_data_file)
         percentStr = ConfigData['CPU_percent']
         percent = float(percentStr)
+        citiesDataPath = ConfigData['CitiesFilePath']
 
     outdir = create_outdir()
-    cpus_to_use = calc_CPU_count(30,percent,jobs)
+    tasks_sets = [job.generate_tasks(outdir) for job in jobs]
+    num_tasks = sum(len(task_set) for task_set in tasks_sets)
+    cpus_to_use = get_num_workers(MAX_WORKERS, percent, num_tasks) if num_workers is None else num_workers
 
     if cpus_to_use == 0 or not multi_processed:
         cpus_to_use = 1
-            
-    tasks_sets = [job.generate_tasks(outdir) for job in jobs]
-    finalizers = [job.finalize for job in jobs]
     if cpus_to_use == 1:
         prog_bar = tqdm(total=sum(len(task_set) + 1 for task_set in tasks_sets))
-        for task_set, finalizer in zip(tasks_sets, finalizers):
-            for task in task_set:
-                job_outdir, stop_early = task.params
-                task.func(
-                    job_outdir,
-                    stop_early,
-                    with_population_caching=with_population_caching,
-                    verbosity=verbosity
-                )
-                prog_bar.update()
-            finalizer(outdir)
+        for task_set, job in zip(tasks_sets, jobs):
+            while len(task_set) > 0:
+                for task in task_set:
+                    job_outdir, stop_early = task.params
+                    task.func(
+                        job_outdir,
+                        stop_early,
+                        with_population_caching=with_population_caching,
+                        verbosity=verbosity
+                    )
+                    prog_bar.update()
+                task_set = job.generate_next_tasks(outdir)
+                prog_bar.total += len(task_set)
+            job.finalize(outdir)
             prog_bar.update()
     else:
-        if with_population_caching:
+        if use_fork_templates:
+            assert "fork" in mp.get_all_start_methods(), "Forking processes isn't supported on this platform"
+            build_world_templates(jobs, with_population_caching, verbosity)
+        elif with_population_caching:
             generate_all_cities_for_jobs(jobs, cpus_to_use)
         print('running a pool of {} threads parallelly'.format(cpus_to_use))
         sys.stdout.flush()
         prog_bar = tqdm(total=sum(len(task_set) + 1 for task_set in tasks_sets))
-        ctx = mp.get_context("spawn")
-        pool = ctx.Pool(cpus_to_use)
+        pool = create_task_pool(cpus_to_use, use_fork_templates)
 
-        finalize_futures = []
+        # The job and the task set of each task, by its python id (the task set is None for the finalize tasks)
+        task_owners = {}
 
-        def get_callback(finalizer, task_set, task):
-            def callback(_):
-                prog_bar.update()
-                task.is_done = True
-                if all(t.is_done for t in task_set):
-                    finalize_futures.append(pool.apply_async(
-                        finalizer, args=(outdir,),
-                        callback=lambda _: prog_bar.update()
-                    ))
+        # The callbacks run in the thread of the pool that handles the results, so they only mark the task as done,
+        # which starts the next pending tasks, and this thread handles the finished tasks (see wait_finished)
+        def start_task(task):
+            pool.apply_async(
+                task.func,
+                args=(*task.params, with_population_caching, verbosity),
+                callback=lambda _: scheduler.done(task),
+                error_callback=lambda error: scheduler.done(task, error)
+            )
 
-            return callback
+        if memory_budget is None:
+            physical_memory = get_physical_memory()
+            memory_budget = None if physical_memory is None else physical_memory * MEMORY_PERCENT
+        cost_model = TaskCostModel(citiesDataPath)
+        scheduler = TaskScheduler(cpus_to_use, memory_budget, start_task)
 
-        futures = []
-        for task_set, finalizer in zip(tasks_sets, finalizers):
-            for task in task_set:
-                futures.append(pool.apply_async(
-                    task.func,
-                    args=(*task.params, with_population_caching, verbosity),
-                    callback=get_callback(finalizer, task_set, task)
-                ))
-        for future in futures:
-            future.wait()
-            future.get()
+        def add_tasks(job, task_set, tasks):
+            for task in tasks:
+                task_owners[id(task)] = (job, task_set)
+            seconds, memory = cost_model.estimate(job)
+            scheduler.add(tasks, seconds, memory)
+
+        for task_set, job in zip(tasks_sets, jobs):
+            add_tasks(job, task_set, task_set)
+        scheduler.start()
+        try:
+            finished = scheduler.wait_finished()
+            while len(finished) > 0:
+                for task, error in finished:
+                    if error is not None:
+                        raise error
+                    prog_bar.update()
+                    task.is_done = True
+                    job, task_set = task_owners.pop(id(task))
+                    if task_set is None or not all(t.is_done for t in task_set):
+                        continue
+                    next_tasks = job.generate_next_tasks(outdir)
+                    if len(next_tasks) > 0:
+                        prog_bar.total += len(next_tasks)
+                        task_set.extend(next_tasks)
+                        add_tasks(job, task_set, next_tasks)
+                    else:
+                        finalize_task = Task(functools.partial(finalize_job, job), (outdir, None))
+                        task_owners[id(finalize_task)] = (job, None)
+                        scheduler.add([finalize_task], *cost_model.estimate_finalize(job))
+                finished = scheduler.wait_finished()
+        except BaseException:
+            pool.terminate()
+            raise
         pool.close()
         pool.join()
-        for future in finalize_futures:
-            future.get()
+        if use_fork_templates:
+            clear_world_templates()
+        print(scheduler.get_report())
     sys.stderr.flush()
     print('end')
     return outdir
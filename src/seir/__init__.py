@@ -1,4 +1,5 @@
-from src.seir.seir_times import sample_seir_times, daysdelta,RealDataSeirTimesGeneration,SIRS
+from src.seir.seir_times import sample_seir_times, daysdelta,RealDataSeirTimesGeneration,SIRS,\
+    BatchSeirTimesSampler, SeirTimesCache
 from src.seir.disease_state import DiseaseState
 
 __all__ = [
@@ -6,5 +7,7 @@ __all__ = [
     'daysdelta',
     'DiseaseState',
     'RealDataSeirTimesGeneration',
-    'SIRS'
+    'SIRS',
+    'BatchSeirTimesSampler',
+    'SeirTimesCache'
 ]
@@ -1,6 +1,7 @@
 from datetime import timedelta
 from enum import Enum
 import random as _random
+import numpy as _np
 from scipy.stats import gamma
 import warnings
 
@@ -301,6 +302,8 @@ class RealDataSeirTimesGeneration(StatisticalSeirTimesGeneration):
         Clean the value of the singleton in case we want to update it's values
         """
         cls.singleton = None
+        # The cached courses were sampled with the old values
+        SeirTimesCache.clean()
 
 class SIRS(RealDataSeirTimesGeneration):
     """
@@ -377,6 +380,182 @@ class SIRS(RealDataSeirTimesGeneration):
             cls.singleton = cls()
         return cls.singleton
 
+# DiseaseState by its value, to decode the sampled stages without calling the Enum constructor
+_STATE_BY_VALUE = [None] + [DiseaseState(value) for value in range(1, DiseaseState.IMMUNE.value + 1)]
+
+
+class BatchSeirTimesSampler(object):
+    """
+    Samples the whole disease courses of many people at once with NumPy,
+    with the same model (and the same params) as RealDataSeirTimesGeneration.
+    A course is one of:
+    LATENT -> ASYMPTOMATICINFECTIOUS -> IMMUNE
+    LATENT -> INCUBATINGPOSTLATENT -> SYMPTOMATICINFECTIOUS -> IMMUNE
+    LATENT -> INCUBATINGPOSTLATENT -> SYMPTOMATICINFECTIOUS -> CRITICAL -> IMMUNE / DECEASED
+    """
+    __slots__ = (
+        '_symptomatic_per_age',
+        '_critical_given_symptomatic_per_age',
+        '_deceased_given_critical_per_age',
+        '_latent_period',
+        '_infectious_before_symptomatic',
+        '_infectious_before_immune',
+        '_symptomatic_before_critical',
+        '_symptomatic_before_immune',
+        '_critical_before_deceased',
+        '_critical_before_immune'
+    )
+    MAX_STAGES = 5
+    NUM_AGE_GROUPS = 9
+
+    def __init__(self, generation):
+        """
+        :param generation: RealDataSeirTimesGeneration whose per age tables and distributions to use
+        """
+        self._symptomatic_per_age = _np.array(generation.symptomatic_given_infected_per_age, dtype=float)
+        self._critical_given_symptomatic_per_age = \
+            _np.array(generation.critical_given_hospitalized_per_age, dtype=float) * \
+            _np.array(generation.hospitalization_given_symptomatic_per_age, dtype=float)
+        self._deceased_given_critical_per_age = _np.array(generation.deceased_given_critical_per_age, dtype=float)
+        self._latent_period = self._to_arrays(generation._latent_period_distribution)
+        self._infectious_before_symptomatic = self._to_arrays(generation._infectious_before_symptomatic_distribution)
+        self._infectious_before_immune = self._to_arrays(generation._infectious_before_immune_distribution)
+        self._symptomatic_before_critical = self._to_arrays(generation._symptomatic_before_critical_distribution)
+        self._symptomatic_before_immune = self._to_arrays(generation._symptomatic_before_immune_distribution)
+        self._critical_before_deceased = self._to_arrays(generation._critical_before_deceased_distribution)
+        self._critical_before_immune = self._to_arrays(generation._critical_before_immune_distribution)
+
+    @staticmethod
+    def _to_arrays(distribution):
+        """
+        :param distribution: integer Distribution of single day segments, see generate_gamma_distribution
+        :return: (values, cumulative probabilities normalized to end at 1) arrays
+        """
+        values = _np.array([segment[0] for segment in distribution.segments], dtype=_np.int16)
+        discrete = distribution.segment_distribution
+        return values, _np.array(discrete.cumprob, dtype=float) / discrete.sum_probs
+
+    @staticmethod
+    def _sample_durations(distribution, size):
+        values, cumprob = distribution
+        return values[_np.searchsorted(cumprob, _np.random.random(size), side='right') - 1]
+
+    def sample(self, ages):
+        """
+        Sample the disease courses of people of the given ages
+        :param ages: array of N ints
+        :return: (stages, durations, lengths):
+        stages is an (N, MAX_STAGES) array of DiseaseState values,
+        durations is an (N, MAX_STAGES) array of days (-1 after the last stage, which has no duration),
+        and course i is the first lengths[i] columns of row i
+        """
+        groups = _np.minimum(_np.asarray(ages) // 10, self.NUM_AGE_GROUPS - 1)
+        num_people = len(groups)
+        symptomatic = _np.random.random(num_people) < self._symptomatic_per_age[groups]
+        critical = symptomatic & (_np.random.random(num_people) < self._critical_given_symptomatic_per_age[groups])
+        deceased = critical & (_np.random.random(num_people) < self._deceased_given_critical_per_age[groups])
+        asymptomatic = ~symptomatic
+        recovering = symptomatic & ~critical
+
+        stages = _np.zeros((num_people, self.MAX_STAGES), dtype=_np.int8)
+        durations = _np.full((num_people, self.MAX_STAGES), -1, dtype=_np.int16)
+        lengths = _np.full(num_people, 3, dtype=_np.int8)
+
+        stages[:, 0] = DiseaseState.LATENT.value
+        durations[:, 0] = self._sample_durations(self._latent_period, num_people)
+
+        stages[asymptomatic, 1] = DiseaseState.ASYMPTOMATICINFECTIOUS.value
+        durations[asymptomatic, 1] = self._sample_durations(self._infectious_before_immune, asymptomatic.sum())
+        stages[asymptomatic, 2] = DiseaseState.IMMUNE.value
+
+        stages[symptomatic, 1] = DiseaseState.INCUBATINGPOSTLATENT.value
+        durations[symptomatic, 1] = self._sample_durations(self._infectious_before_symptomatic, symptomatic.sum())
+        stages[symptomatic, 2] = DiseaseState.SYMPTOMATICINFECTIOUS.value
+        lengths[symptomatic] = 4
+
+        durations[recovering, 2] = self._sample_durations(self._symptomatic_before_immune, recovering.sum())
+        stages[recovering, 3] = DiseaseState.IMMUNE.value
+
+        durations[critical, 2] = self._sample_durations(self._symptomatic_before_critical, critical.sum())
+        stages[critical, 3] = DiseaseState.CRITICAL.value
+        lengths[critical] = 5
+        survivors = critical & ~deceased
+        durations[deceased, 3] = self._sample_durations(self._critical_before_deceased, deceased.sum())
+        stages[deceased, 4] = DiseaseState.DECEASED.value
+        durations[survivors, 3] = self._sample_durations(self._critical_before_immune, survivors.sum())
+        stages[survivors, 4] = DiseaseState.IMMUNE.value
+        return stages, durations, lengths
+
+
+class SeirTimesCache(object):
+    """
+    Pre-sampled disease courses (see BatchSeirTimesSampler) per age group,
+    sampled in batches and handed out one at a time by draw().
+    """
+    __slots__ = ('_sampler', '_batch_size', '_courses', '_day_deltas')
+
+    def __init__(self, sampler, batch_size):
+        """
+        :param sampler: BatchSeirTimesSampler
+        :param batch_size: int number of courses to sample for an age group whenever it runs out
+        """
+        assert batch_size > 0
+        self._sampler = sampler
+        self._batch_size = batch_size
+        self._courses = [[] for _ in range(sampler.NUM_AGE_GROUPS)]
+        self._day_deltas = {}
+
+    def draw(self, age):
+        """
+        :param age: int age of the infected person
+        :return: A list of (stage, duration) like RealDataSeirTimesGeneration.sample_seir_times
+        """
+        group = min(age // 10, self._sampler.NUM_AGE_GROUPS - 1)
+        courses = self._courses[group]
+        if not courses:
+            self._refill(group)
+        return list(courses.pop())
+
+    def _refill(self, group):
+        stages, durations, lengths = self._sampler.sample(_np.full(self._batch_size, group * 10))
+        courses = self._courses[group]
+        for stage_row, duration_row, length in zip(stages.tolist(), durations.tolist(), lengths.tolist()):
+            course = [
+                (_STATE_BY_VALUE[stage_row[i]], self._days(duration_row[i]))
+                for i in range(length - 1)
+            ]
+            course.append((_STATE_BY_VALUE[stage_row[length - 1]], None))
+            courses.append(tuple(course))
+        # pop() takes from the end, so hand out the courses in the order they were sampled
+        courses.reverse()
+
+    def _days(self, days):
+        delta = self._day_deltas.get(days)
+        if delta is None:
+            delta = self._day_deltas[days] = daysdelta(days)
+        return delta
+
+    # For singleton use:
+    singleton = None
+    @classmethod
+    def make(cls):
+        """
+        :return: The SeirTimesCache of the current params
+        """
+        if cls.singleton is None:
+            cls.singleton = cls(
+                BatchSeirTimesSampler(RealDataSeirTimesGeneration.make()),
+                Params.loader()['seir_times_sampling']['batch_size']
+            )
+        return cls.singleton
+
+    @classmethod
+    def clean(cls):
+        """
+        Clean the value of the singleton in case we want to update it's values
+        """
+        cls.singleton = None
+
 def sample_seir_times(sir_type:machine_type ,person):
     """
     Samples and returns the SEIR stages and durations for a given Person
@@ -387,6 +566,8 @@ def sample_seir_times(sir_type:machine_type ,person):
     """
        
     if sir_type == machine_type.SIR:
+        if Params.loader()['seir_times_sampling']['batch_sampling']:
+            return SeirTimesCache.make().draw(person.get_age())
         return RealDataSeirTimesGeneration.make().sample_seir_times(person)
     elif sir_type == machine_type.SIRS:
         return SIRS.make().sample_seir_times(person)
@@ -0,0 +1,49 @@
+class CalendarQueue(object):
+    """
+    The events scheduled in a simulation, in a bucket (list) per day.
+    Days are ints (days since the initial date of the simulation), which are cheaper to hash than dates.
+    The events of a day are applied in the order they were pushed,
+    including events pushed for that day while it is being drained.
+    """
+    __slots__ = ('_buckets',)
+
+    def __init__(self):
+        self._buckets = {}
+
+    def push(self, day, event):
+        """
+        Schedule the given event to the given day
+        :param day: int day index
+        :param event: an object with an apply(simulation) method
+        """
+        bucket = self._buckets.get(day)
+        if bucket is None:
+            bucket = self._buckets[day] = []
+        bucket.append(event)
+
+    def drain(self, day):
+        """
+        Iterate over the events of the given day, and forget them afterwards
+        :param day: int day index
+        :return: generator of events
+        """
+        bucket = self._buckets.get(day)
+        if bucket is None:
+            return
+        i = 0
+        while i < len(bucket):
+            yield bucket[i]
+            i += 1
+        del self._buckets[day]
+
+    def days(self):
+        """
+        :return: sorted list of the days that have events
+        """
+        return sorted(self._buckets)
+
+    def __contains__(self, day):
+        return day in self._buckets
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
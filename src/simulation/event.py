@@ -209,6 +209,7 @@ class DiseaseStateChangeEffect:
             " of id " + str(self._person._id)
         )
         self._person.set_disease_state(self._new_state)
+        simulation.apply_state_change_rules(self._person, self._old_state, self._new_state)
 
     def get_person(self):
         return self._person
@@ -320,6 +321,97 @@ class RemoveRoutineChangeEffect:
         self._person.remove_routine_change(self.routine_change_key)
 
 
+class ActivatePolicyEffect:
+    """
+    An effect which starts applying a policy to the people that joined it, see PolicyMultipliers
+    """
+    __slots__ = ('_policies', 'policy')
+
+    def __init__(self, policies, policy):
+        """
+        :param policies: PolicyMultipliers
+        :param policy: int id of the policy
+        """
+        self._policies = policies
+        self.policy = policy
+
+    def apply(self, simulation):
+        self._policies.activate(self.policy)
+
+
+class DeactivatePolicyEffect:
+    """
+    An effect which stops applying a policy to the people that joined it, see PolicyMultipliers
+    """
+    __slots__ = ('_policies', 'policy')
+
+    def __init__(self, policies, policy):
+        """
+        :param policies: PolicyMultipliers
+        :param policy: int id of the policy
+        """
+        self._policies = policies
+        self.policy = policy
+
+    def apply(self, simulation):
+        self._policies.deactivate(self.policy)
+
+
+class CallEffect:
+    """
+    An effect which calls a function with the simulation and the given arguments.
+    Lets a StateChangeRule schedule its own actions on later days.
+    """
+    __slots__ = ('_function', '_args')
+
+    def __init__(self, function, *args):
+        """
+        :param function: function that gets the simulation and the given args
+        :param args: extra args for the function
+        """
+        self._function = function
+        self._args = args
+
+    def apply(self, simulation):
+        self._function(simulation, *self._args)
+
+
+class StateChangeRule(object):
+    """
+    A rule that is applied whenever any person's disease state changes between some given states,
+    instead of hooking an event on the state changes of each person in advance (see Person.hook_on_change).
+    Interventions return their rules from generate_events, and the simulation registers them
+    and applies them from the DiseaseStateChangeEffect of each matching state change.
+    Each subclass implements the apply() func
+    """
+    __slots__ = ('states',)
+
+    def __init__(self, states):
+        """
+        :param states: list of the (old_state, new_state) pairs of DiseaseState-s on which the rule applies
+        """
+        self.states = list(states)
+
+    def apply(self, simulation, person, old_state, new_state):
+        """
+        Apply the rule on the given state change, right after the person changed its state
+        :param simulation: Simulation object
+        :param person: Person whose state changed
+        :param old_state: DiseaseState
+        :param new_state: DiseaseState
+        """
+        raise NotImplementedError()
+
+    def catch_up(self, simulation):
+        """
+        Apply the rule on the state changes that happened before it was registered,
+        when it is added to a simulation that already started (see Simulation.add_interventions).
+        By default the rule ignores them.
+        :param simulation: Simulation object
+        """
+        pass
+
+
 class _Hookable():
     """
     The interface of hooks, which are lists of other events that should be applied after a successful application of some trigger.
@@ -421,3 +513,38 @@ class DayEvent(Event):
             effect = EmptyEffect()
         super().__init__(DayTrigger(date), effect)
         self._date = date
+
+
+class StateChangeEvent(object):
+    """
+    A scheduled change of a person's disease state on some date.
+    Applying it applies the given person.state_to_events[(old_state, new_state)] event, with everything hooked on it.
+    This is the lightweight version of a DayEvent that hooks that event:
+    one small object per transition, instead of a DayEvent, a DayTrigger, an EmptyEffect and a hooks list.
+    The simulation schedules the hooked event itself, so this object only lives until it is registered.
+    """
+    __slots__ = ('_date', '_event')
+
+    def __init__(self, date, event):
+        """
+        :param date: datetime.date of the change
+        :param event: Event whose effect is a DiseaseStateChangeEffect
+        """
+        self._date = date
+        self._event = event
+
+    def apply(self, simulation):
+        """
+        Apply the person's event for this state change
+        :param simulation: Simulation object
+        """
+        self._event.apply(simulation)
+
+    def get_event(self):
+        return self._event
+
+    def get_person(self):
+        return self._event.effect.get_person()
+
+    def get_states(self):
+        return self._event.effect.get_states()
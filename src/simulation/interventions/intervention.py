@@ -5,25 +5,31 @@ from datetime import date, timedelta
 
 from src.seir import DiseaseState, seir_times
 from src.simulation.event import (
+    ActivatePolicyEffect,
     AddRoutineChangeEffect,
-    AfterTrigger,
     AddRoutineChangeEnvironmentEffect,
-    AndTrigger,
+    CallEffect,
     DayEvent,
-    DelayedEffect,
+    DeactivatePolicyEffect,
     DiseaseStateChangeEffect,
     EmptyEffect,
-    EmptyTrigger,
-    Event,
-    OrTrigger,
     RemoveRoutineChangeEffect,
     RemoveRoutineChangeEnvironmentEffect,
-    TimeRangeTrigger
+    StateChangeRule
 )
 from src.simulation.params import Params
 from src.world import Person, World
 from src.world.environments.household import Household
 
+def lockdown_multiplier(env_name):
+    """
+    The weight multiplier of the given environment in lockdown, see lockdown_routine
+    :param env_name: str environment name
+    :return: float weight multiplier
+    """
+    return Params.loader()["interventions_routines"]["lockdown"]["all"]
+
+
 def lockdown_routine(person: Person):
     """
     Create a routine change that represents a person being in lockdown.
@@ -31,8 +37,20 @@ def lockdown_routine(person: Person):
     :param person: Person
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["lockdown"]
-    return {env_name: params["all"] for env_name in person.get_routine()}
+    return {env_name: lockdown_multiplier(env_name) for env_name in person.get_routine()}
+
+
+def workplace_closure_multiplier(env_name):
+    """
+    The weight multiplier of the given environment when the workplace is closed, see workplace_closure_routine
+    :param env_name: str environment name
+    :return: float weight multiplier
+    """
+    params = Params.loader()["interventions_routines"]["workplace_closure"]
+    if env_name == 'workplace':
+        return params["workplace"]
+    return params["other"]
+
 
 def workplace_closure_routine(person: Person):
     """
@@ -42,14 +60,7 @@ def workplace_closure_routine(person: Person):
     :param person: Person
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["workplace_closure"]
-    routine = {}
-    for env_name in person.get_routine():
-        if env_name == 'workplace':
-            routine['workplace'] = params["workplace"]
-        else:
-            routine[env_name] = params["other"]
-    return routine
+    return {env_name: workplace_closure_multiplier(env_name) for env_name in person.get_routine()}
 
 
 def quarantine_routine(person: Person):
@@ -63,6 +74,18 @@ def quarantine_routine(person: Person):
     return {env_name: params["all"] for env_name in person.get_routine()}
 
 
+def social_distancing_multiplier(env_name):
+    """
+    The weight multiplier of the given environment under social distancing, see social_distancing_routine
+    :param env_name: str environment name
+    :return: float weight multiplier
+    """
+    params = Params.loader()["interventions_routines"]["social_distancing"]
+    if env_name in ('household', 'workplace', 'school'):
+        return params[env_name]
+    return params["other"]
+
+
 def social_distancing_routine(person: Person):
     """
     Create a routine change that represents a social distancing effect on a person routine.
@@ -71,18 +94,7 @@ def social_distancing_routine(person: Person):
     :param person: Person
     :return: routine change dict, keys are environment names, values are weight multipliers.
     """
-    params = Params.loader()["interventions_routines"]["social_distancing"]
-    routine = {}
-    for env_name in person.get_routine():
-        if env_name == 'household':
-            routine['household'] = params["household"]
-        elif env_name == 'workplace':
-            routine['workplace'] = params["workplace"]
-        elif env_name == 'school':
-            routine[env_name] = params["school"]
-        else:
-            routine[env_name] = params["other"]
-    return routine
+    return {env_name: social_distancing_multiplier(env_name) for env_name in person.get_routine()}
 
 
 def household_isolation_routine(person: Person):
@@ -167,6 +179,7 @@ class Intervention(object):
     When the simulation starts, it calls intervention.generate_events(world) (for each intervention),
     and the Intervention creates events,
     some it hooks on person state changes and some are DayEvents which it returns and the simulation then hooks on itself.
+    It may also return StateChangeRules, which the simulation applies on the state changes of all the people.
     """
     __slots__ = ('compliance', 'start_date', 'duration', 'end_date')
 
@@ -197,6 +210,25 @@ class Intervention(object):
         attributes['duration'] = self.duration.days
         return attributes
 
+    def _values(self):
+        """
+        :return: tuple of the type of the intervention and the values of all its attributes
+        """
+        names = set(getattr(self, '__dict__', ()))
+        for cls in type(self).__mro__:
+            names.update(getattr(cls, '__slots__', ()))
+        return type(self), tuple((name, getattr(self, name, None)) for name in sorted(names))
+
+    def __eq__(self, other):
+        """
+        Interventions are equal when they have the same type and the same constructor args,
+        so jobs may share interventions they create separately (see BranchingJob)
+        """
+        return isinstance(other, Intervention) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash((type(self), self.start_date, self.duration))
+
     def __str__(self):
         attr = self.attributes()
         params_strings = ["{}={}".format(key, value) for (key, value) in attr.items()]
@@ -211,7 +243,7 @@ class TimedIntervention(Intervention):
     Implementation of an intervention, that is time range based. Meaning, it happens between from some start date,
     for example, school closure on the 1.5 for 40 days
     """
-    __slots__ = ('_key', '_routine_generator', '_args')
+    __slots__ = ('_key', '_routine_generator', '_args', '_multiplier_generator')
 
     def __init__(
             self,
@@ -220,12 +252,23 @@ class TimedIntervention(Intervention):
             compliance: float,
             key: str,
             routine_generator,
-            args=None
+            args=None,
+            multiplier_generator=None
     ):
+        """
+        :param key: str key of the routine change, see Person.add_routine_change
+        :param routine_generator: function that creates the routine change dict, for person (and args)
+        :param args: extra args for the routine_generator (and multiplier_generator)
+        :param multiplier_generator: optional function that gets an environment name (and args)
+        and returns its weight multiplier in the routine change, the same for all the people.
+        If given, the routine change is a policy which all the compliant people join (see PolicyMultipliers),
+        so the intervention starts and ends with a single event instead of two events for each person.
+        """
         super(TimedIntervention, self).__init__(compliance, start_date, duration)
         self._key = key
         self._routine_generator = routine_generator
         self._args = args
+        self._multiplier_generator = multiplier_generator
 
     def _condition(self, x):
         """
@@ -242,6 +285,8 @@ class TimedIntervention(Intervention):
         :param world: World object
         :return: list of Event objects
         """
+        if self._multiplier_generator is not None:
+            return self._generate_policy_events(world)
         new_events = []
         for person in world.all_people():
             if self._condition(person):
@@ -258,6 +303,24 @@ class TimedIntervention(Intervention):
                         new_events.append(event)
         return new_events
 
+    def _generate_policy_events(self, world: World):
+        """
+        Make the relevant people (that comply) join a new policy of the world,
+        and generate the events that activate it and deactivate it after the given duration.
+        :param world: World object
+        :return: list of Event objects
+        """
+        policies = world.get_policies()
+        policy = policies.add_policy(self._key, self._multiplier_generator, self._args)
+        for person in world.all_people():
+            if self._condition(person):
+                if random.random() < self.compliance:
+                    person.join_policy(policies, policy)
+        return [
+            DayEvent(date=self.start_date, effect=ActivatePolicyEffect(policies, policy)),
+            DayEvent(date=self.end_date, effect=DeactivatePolicyEffect(policies, policy))
+        ]
+
 
 class WorkplaceClosureIntervention(TimedIntervention):
     """
@@ -269,7 +332,7 @@ class WorkplaceClosureIntervention(TimedIntervention):
     def __init__(self, start_date: date, duration: timedelta, compliance: float):
         super(WorkplaceClosureIntervention, self).__init__(
             start_date, duration, compliance, 'workplace_closure',
-            workplace_closure_routine
+            workplace_closure_routine, multiplier_generator=workplace_closure_multiplier
         )
 
     def _condition(self, person):
@@ -285,7 +348,7 @@ class SocialDistancingIntervention(TimedIntervention):
     def __init__(self, start_date: date, duration: timedelta, compliance: float, age_range: tuple):
         super(SocialDistancingIntervention, self).__init__(
             start_date, duration, compliance, 'social_distancing',
-            social_distancing_routine
+            social_distancing_routine, multiplier_generator=social_distancing_multiplier
         )
         self.min_age, self.max_age = age_range
 
@@ -339,7 +402,7 @@ class LockdownIntervention(TimedIntervention):
     def __init__(self, city_name, start_date: date, duration: timedelta, compliance: float):
         super(LockdownIntervention, self).__init__(
             start_date, duration, compliance, 'lockdown',
-            lockdown_routine
+            lockdown_routine, multiplier_generator=lockdown_multiplier
         )
         self.city_name = city_name
 
@@ -351,6 +414,110 @@ class LockdownIntervention(TimedIntervention):
         return True
 
 
+# The disease state change on which people get symptoms, and the ones on which their symptoms are over
+SYMPTOMS_ONSET = (DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS)
+SYMPTOMS_END = list(itertools.product(
+    [DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.CRITICAL],
+    [DiseaseState.IMMUNE, DiseaseState.DECEASED]
+))
+
+
+class SymptomsIsolationRule(StateChangeRule):
+    """
+    The rule of an intervention that isolates people some delay after they get symptoms,
+    if that happens between the start date and the end date of the intervention.
+    People whose isolation should have started before the start date are isolated on the start date.
+    When the isolation ends with the symptoms, people whose symptoms are over before their isolation is due
+    are not isolated at all. Otherwise they are isolated as usual, since their isolation lasts a fixed time.
+    Whether a person complies is drawn when the person gets symptoms.
+    The intervention makes a new rule for each simulation, so the rule keeps the isolations of that simulation.
+    """
+    __slots__ = ('_intervention', '_delay', '_ends_with_symptoms', '_pending', '_waiting', '_isolated')
+
+    def __init__(self, intervention, delay: timedelta, ends_with_symptoms=True):
+        """
+        :param intervention: the Intervention, which implements _start_isolation(simulation, person)
+        and _end_isolation(simulation, person)
+        :param delay: timedelta from the symptoms to the isolation
+        :param ends_with_symptoms: whether the isolation depends on the end of the symptoms.
+        If False, _end_isolation is never called, and the intervention ends the isolation by itself.
+        """
+        super(SymptomsIsolationRule, self).__init__(
+            [SYMPTOMS_ONSET] + (SYMPTOMS_END if ends_with_symptoms else [])
+        )
+        self._intervention = intervention
+        self._delay = delay
+        self._ends_with_symptoms = ends_with_symptoms
+        # The compliant people that got symptoms, until the delay passes (or the symptoms are over)
+        self._pending = {}
+        # The people whose isolation should have started before the start date
+        self._waiting = {}
+        # The people that were isolated, until their symptoms are over (only if ends_with_symptoms)
+        self._isolated = {}
+
+    def apply(self, simulation, person, old_state, new_state):
+        if (old_state, new_state) == SYMPTOMS_ONSET:
+            if random.random() < self._intervention.compliance:
+                self._pending[person] = None
+                if self._delay:
+                    simulation.register_events(
+                        DayEvent(simulation._date + self._delay, CallEffect(self._enter, person))
+                    )
+                else:
+                    self._enter(simulation, person)
+        else:
+            self._pending.pop(person, None)
+            self._waiting.pop(person, None)
+            if person in self._isolated:
+                del self._isolated[person]
+                self._intervention._end_isolation(simulation, person)
+
+    def catch_up(self, simulation):
+        """
+        Apply the rule on the people that got symptoms before it was registered (by their disease course),
+        as if it was registered from the start of the simulation: draw whether they comply,
+        and let them enter the isolation when the delay from their symptoms passes (or today, if it passed).
+        When the isolation ends with the symptoms, only the people that still have symptoms are relevant.
+        """
+        symptomatic_states = set(old_state for old_state, _ in SYMPTOMS_END)
+        for person in simulation._world.all_people():
+            if self._ends_with_symptoms and person.get_disease_state() not in symptomatic_states:
+                continue
+            course = person.get_disease_course()
+            for (old_state, _), (new_state, onset_date) in zip(course, course[1:]):
+                if (old_state, new_state) == SYMPTOMS_ONSET and onset_date < simulation._date:
+                    if random.random() < self._intervention.compliance:
+                        self._pending[person] = None
+                        simulation.register_events(DayEvent(
+                            max(onset_date + self._delay, simulation._date), CallEffect(self._enter, person)
+                        ))
+
+    def _enter(self, simulation, person):
+        """
+        Isolate the given person, now that the delay from its symptoms passed
+        """
+        if person not in self._pending:
+            return
+        del self._pending[person]
+        if simulation._date < self._intervention.start_date:
+            self._waiting[person] = None
+        elif simulation._date < self._intervention.end_date:
+            self._isolate(simulation, person)
+
+    def start(self, simulation):
+        """
+        Isolate the people that are waiting for the start date
+        """
+        for person in self._waiting:
+            self._isolate(simulation, person)
+        self._waiting = {}
+
+    def _isolate(self, simulation, person):
+        if self._ends_with_symptoms:
+            self._isolated[person] = None
+        self._intervention._start_isolation(simulation, person)
+
+
 class SymptomaticIsolationIntervention(Intervention):
     """
     Implementation of a policy of isolating the symptomatic people in the simulation, for some given time.
@@ -371,68 +538,19 @@ class SymptomaticIsolationIntervention(Intervention):
 
     def generate_events(self, world: World):
         """
-        generate events that are applied on the person when his state changes to symptomatic,
-        and add the isolation routine. After the given duration, an event will remove the change.
+        generate the rule that is applied on people when their state changes to symptomatic,
+        and adds the isolation routine. When their symptoms are over, the rule removes the change.
         :param world: World object
-        :return: list of new Events to register on the simulation
+        :return: list of the rule and the event that starts the intervention, to register on the simulation
         """
-        ret = []
-        for person in world.all_people():
-            if random.random() < self.compliance:
-                add_effect = AddRoutineChangeEffect(
-                    person=person,
-                    routine_change_key='quarantine',
-                    routine_change_val=quarantine_routine(person)
-                )
-                states = (
-                    DiseaseState.INCUBATINGPOSTLATENT,
-                    DiseaseState.SYMPTOMATICINFECTIOUS
-                )
-                person._init_event(*states)
-                entry_moment = Event()
-                add_trigger = AndTrigger(
-                    AfterTrigger(entry_moment),
-                    TimeRangeTrigger(self.start_date, self.end_date)
-                )
-                add_event = Event(
-                    add_trigger, add_effect
-                )
-                entry_moment.hook(add_event)
-                day_event = DayEvent(self.start_date)  # Wasteful in memory!
-                day_event.hook(add_event)
-                ret.append(day_event)
-                if self.delay != 0:
-                    delay_time = timedelta(self.delay)
-                    person.hook_on_change(
-                        states,
-                        Event(
-                            EmptyTrigger(),
-                            DelayedEffect(entry_moment, delay_time)
-                        )
-                    )
-                else:
-                    person.hook_on_change(states, entry_moment)
-
-                remove_effect = RemoveRoutineChangeEffect(
-                    person=person, routine_change_key='quarantine'
-                )
-                state_changes = list(itertools.product(
-                    [DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.CRITICAL],
-                    [DiseaseState.IMMUNE, DiseaseState.DECEASED]
-                ))
-                for states in state_changes:
-                    person._init_event(*states)
-                remove_trigger = AndTrigger(
-                    OrTrigger([
-                        AfterTrigger(person.state_to_events[states])
-                        for states in state_changes
-                    ]),
-                    AfterTrigger(add_event)
-                )
-                remove_event = Event(remove_trigger, remove_effect)
-                for states in state_changes:
-                    person.hook_on_change(states, remove_event)
-        return ret
+        rule = SymptomsIsolationRule(self, timedelta(self.delay))
+        return [rule, DayEvent(self.start_date, CallEffect(rule.start))]
+
+    def _start_isolation(self, simulation, person):
+        person.add_routine_change('quarantine', quarantine_routine(person))
+
+    def _end_isolation(self, simulation, person):
+        person.remove_routine_change('quarantine')
 
 
 class HouseholdIsolationIntervention(Intervention):
@@ -469,81 +587,39 @@ class HouseholdIsolationIntervention(Intervention):
 
     def generate_events(self, world: World):
         """
-        generate events that are applied on the person when his state changes to symptomatic,
-        and add the isolation routine to the whole house. After the given duration and params,
+        generate the rule that is applied on people when their state changes to symptomatic,
+        and adds the isolation routine to their whole house. After the given duration and params,
         an event will remove the change.
         :param world: World object
-        :return: list of new Events to register on the simulation
+        :return: list of the rule and the event that starts the intervention, to register on the simulation
         """
-        ret = []
-        for person in world.all_people():
-            if random.random() < self.compliance:
-                household_environment = person.get_environment('household')
-                add_effect = AddRoutineChangeEnvironmentEffect(
-                    environment=household_environment,
-                    routine_change_key='household_isolation',
-                    routine_change_generator=household_isolation_routine
-                )
-                states = (
-                    DiseaseState.INCUBATINGPOSTLATENT,
-                    DiseaseState.SYMPTOMATICINFECTIOUS
-                )
-                person._init_event(*states)
-                entry_moment = Event()
-                add_trigger = AndTrigger(
-                    AfterTrigger(entry_moment),
-                    TimeRangeTrigger(self.start_date, self.end_date)
-                )
-                add_event = Event(
-                    add_trigger, add_effect
-                )
-                entry_moment.hook(add_event)
-                day_event = DayEvent(self.start_date)  # Wasteful in memory!
-                day_event.hook(add_event)
-                ret.append(day_event)
-                if self.delay_on_enter:
-                    delay_time = self.delay_on_enter
-                    person.hook_on_change(
-                        states,
-                        Event(
-                            EmptyTrigger(),
-                            DelayedEffect(entry_moment, delay_time)
-                        )
-                    )
-                else:
-                    person.hook_on_change(states, entry_moment)
-
-                remove_effect = RemoveRoutineChangeEnvironmentEffect(
-                    environment=household_environment, routine_change_key='household_isolation'
-                )
-                if self.is_exit_after_recovery:
-                    state_changes = list(itertools.product(
-                        [DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.CRITICAL],
-                        [DiseaseState.IMMUNE, DiseaseState.DECEASED]
-                    ))
-                    for states in state_changes:
-                        person._init_event(*states)
-                    remove_trigger = AndTrigger(
-                        OrTrigger([
-                            AfterTrigger(person.state_to_events[states])
-                            for states in state_changes
-                        ]),
-                        AfterTrigger(add_event)
-                    )
-                    remove_event = Event(
-                        remove_trigger,
-                        DelayedEffect(Event(effect=remove_effect), self.delay_on_exit)
-                    )
-                    for states in state_changes:
-                        person.hook_on_change(states, remove_event)
-                else:
-                    remove_trigger = AfterTrigger(add_event)
-                    remove_event = Event(
-                        remove_trigger,
-                        DelayedEffect(Event(effect=remove_effect), self.delay_on_exit)
-                    )
-                    add_event.hook(remove_event)
-        return ret
+        rule = SymptomsIsolationRule(self, self.delay_on_enter, ends_with_symptoms=self.is_exit_after_recovery)
+        return [rule, DayEvent(self.start_date, CallEffect(rule.start))]
+
+    def _start_isolation(self, simulation, person):
+        household_environment = person.get_environment('household')
+        AddRoutineChangeEnvironmentEffect(
+            environment=household_environment,
+            routine_change_key='household_isolation',
+            routine_change_generator=household_isolation_routine
+        ).apply(simulation)
+        if not self.is_exit_after_recovery:
+            self._schedule_exit(simulation, household_environment)
+
+    def _end_isolation(self, simulation, person):
+        self._schedule_exit(simulation, person.get_environment('household'))
+
+    def _schedule_exit(self, simulation, household_environment):
+        """
+        Remove the isolation routine from the given household after delay_on_exit
+        """
+        simulation.register_events(DayEvent(
+            simulation._date + self.delay_on_exit,
+            RemoveRoutineChangeEnvironmentEffect(
+                environment=household_environment, routine_change_key='household_isolation'
+            )
+        ))
+
     
 class ImmuneGeneralPopulationIntervention(Intervention):
     """
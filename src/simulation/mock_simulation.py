@@ -2,7 +2,7 @@ import os
 from collections import namedtuple
 
 from src.simulation.simulation import Simulation
-from src.simulation.event import DiseaseStateChangeEffect
+from src.simulation.event import DiseaseStateChangeEffect, StateChangeEvent
 from src.seir import DiseaseState
 from src.world import World
 
@@ -157,26 +157,29 @@ class InitialStateSimulation(Simulation):
         return all_infected_for_initial_state
 
     def register_event_on_day(self, event, date):
-        for e in [event, *event.hooks]:
-            if isinstance(e.effect, DiseaseStateChangeEffect):
-                person = e.effect.get_person()
-                if person.get_disease_state() != DiseaseState.IMMUNE:
-	                city = person.get_city_name()
-	                if city not in self._infected_people_seir_times_per_city:
-	                    self._infected_people_seir_times_per_city[city] = {}
-
-	                person_data = self._infected_people_seir_times_per_city[city].setdefault(
-	                    person,
-	                    self.InfectedPersonData(
-	                        symptomatic=False,
-	                        symptomatic_date=None,
-	                        infection_date=self._date,
-	                        states_and_dates=[(self._date, None, DiseaseState.LATENT)]
-	                    )
-	                )
-	                if e.effect.get_states()[1] == DiseaseState.SYMPTOMATICINFECTIOUS:
-	                    person_data.symptomatic = True
-	                    person_data.symptomatic_date = date
-	                person_data.states_and_dates.append((date, *e.effect.get_states()))
+        if isinstance(event, StateChangeEvent):
+            state_changes = [event]
+        else:
+            state_changes = [e.effect for e in [event, *event.hooks] if isinstance(e.effect, DiseaseStateChangeEffect)]
+        for change in state_changes:
+            person = change.get_person()
+            if person.get_disease_state() != DiseaseState.IMMUNE:
+                city = person.get_city_name()
+                if city not in self._infected_people_seir_times_per_city:
+                    self._infected_people_seir_times_per_city[city] = {}
+
+                person_data = self._infected_people_seir_times_per_city[city].setdefault(
+                    person,
+                    self.InfectedPersonData(
+                        symptomatic=False,
+                        symptomatic_date=None,
+                        infection_date=self._date,
+                        states_and_dates=[(self._date, None, DiseaseState.LATENT)]
+                    )
+                )
+                if change.get_states()[1] == DiseaseState.SYMPTOMATICINFECTIOUS:
+                    person_data.symptomatic = True
+                    person_data.symptomatic_date = date
+                person_data.states_and_dates.append((date, *change.get_states()))
 
         super(InitialStateSimulation, self).register_event_on_day(event, date)
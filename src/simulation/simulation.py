@@ -7,9 +7,13 @@ import logging
 import os
 import random as random
 
+import numpy as np
+
 from src.seir import seir_times
 from src.seir.disease_state import DiseaseState
-from src.simulation.event import DayEvent
+from src.simulation.calendar_queue import CalendarQueue
+from src.simulation.event import DayEvent, StateChangeEvent, StateChangeRule
+from src.simulation.snapshot import dump_snapshot, load_snapshot
 from src.logs import Statistics, DayStatistics
 from src.world import Person
 from src.world.environments import InitialGroup,Household
@@ -17,6 +21,8 @@ from src.world.environments import InitialGroup,Household
 
 log = logging.getLogger(__name__)
 
+ONE_DAY = timedelta(days=1)
+
 class ORDER(Enum):
     NONE =0,
     ASCENDING=1,
@@ -32,9 +38,11 @@ class Simulation(object):
         '_verbosity',
         '_world',
         '_date',
+        '_day',
         '_initial_date',
         'interventions',
         '_events',
+        '_state_change_rules',
         'stats',
         'stop_early',
         'last_day_to_record_r',
@@ -65,8 +73,12 @@ class Simulation(object):
         self._world = world
         self._date = initial_date
         self._initial_date = deepcopy(initial_date)
+        # The number of days since the initial date, which keys the scheduled events
+        self._day = 0
         self.interventions = interventions
-        self._events = {}
+        self._events = CalendarQueue()
+        # The StateChangeRule-s of the interventions, by the (old_state, new_state) pairs they apply on
+        self._state_change_rules = {}
         self.stats = Statistics(outdir, world)
         # It's important that we sign people up before we init interventions!
         self._world.sign_all_people_up_to_environments()
@@ -97,26 +109,21 @@ class Simulation(object):
         (either applying intervention effects or
         advancing the disease states of people)
         2. register people who changed weights to their environments
-        3. spread the infection throughout the environments
+        3. spread the infection throughout the environments that have infectious people
         4. register the changes to the Statistics object
         """
-        if self._date in self._events:
-            self._events[self._date].apply(self)
-            del self._events[self._date]
+        for event in self._events.drain(self._day):
+            event.apply(self)
 
-        changed_population = [
-            person for person in self._world.all_people() if person._changed
-        ]
+        changed_population = self._world.get_changed_people()
 
         for individual in changed_population:
             individual.register_to_daily_environments()
 
-        for env in self._world.all_environments:
+        for env in self._world.get_active_environments():
             self.register_events(env.propagate_infection(self._date))
 
-        changed_population = [
-            person for person in self._world.all_people() if person._changed
-        ]
+        changed_population = self._world.get_changed_people()
 
         if self._verbosity and self._date.weekday() == 6:
             log.info("------ day-{}: disease state ------------".format(self._date))
@@ -127,41 +134,112 @@ class Simulation(object):
 
         daily_data = DayStatistics(
             self._date,
-            changed_population
+            changed_population,
+            self.stats.environment_names
         )
         self.stats.add_daily_data(daily_data,self._world)
-        for person in changed_population:
-            person.save_state()
+        self._world.clear_changed_people()
 
         if self.last_day_to_record_r is not None and self._date <= self.last_day_to_record_r:
             for person in changed_population:
                 if person.is_infected:
                     self.first_infectious_people.add(person)
-        self._date += timedelta(days=1)
+        self._date += ONE_DAY
+        self._day += 1
+
+    def checkpoint(self):
+        """
+        Take a snapshot of this simulation, to continue it later or to branch several scenarios from it (see restore).
+        The snapshot holds the world (the disease state and routines of every person), the scheduled events,
+        the state change rules, the statistics of the days so far and the states of the random generators,
+        so a simulation restored from it continues exactly like this one would.
+        Streamed days data (see StreamedDaysData) stays in its file, only its path is in the snapshot.
+        :return: bytes
+        """
+        return dump_snapshot((self, random.getstate(), np.random.get_state()))
+
+    @staticmethod
+    def restore(snapshot, outdir):
+        """
+        Make a simulation out of a snapshot, and set the random generators to their states at the snapshot
+        :param snapshot: bytes returned by Simulation.checkpoint
+        :param outdir: The path of the directory the restored simulation writes its output files into,
+        other than the directory of the simulation the snapshot was taken of
+        :return: a new Simulation object, at the date the snapshot was taken on
+        """
+        sim, python_random_state, numpy_random_state = load_snapshot(snapshot)
+        random.setstate(python_random_state)
+        np.random.set_state(numpy_random_state)
+        sim.stats.set_output_path(outdir)
+        return sim
+
+    def add_interventions(self, interventions):
+        """
+        Add interventions to a simulation that already started, e.g. a scenario that branches from a checkpoint.
+        The interventions must not start before the current date of the simulation.
+        Their StateChangeRules catch up on the state changes of the days so far (see StateChangeRule.catch_up),
+        so they apply like in a simulation that had the interventions from its start.
+        :param interventions: list of Intervention objects
+        """
+        for intervention in interventions:
+            assert intervention.start_date >= self._date, \
+                "Intervention {} starts before the current date {}".format(intervention, self._date)
+        self.interventions = self.interventions + list(interventions)
+        for intervention in interventions:
+            self.stats.add_intervention(intervention)
+            events = intervention.generate_events(self._world)
+            self.register_events(events)
+            for event in events:
+                if isinstance(event, StateChangeRule):
+                    event.catch_up(self)
 
     def register_event_on_day(self, event, date):
         """
         hook the given event to the given date, so in that day this event will happen.
-        :param event: Event
+        :param event: Event or StateChangeEvent
         :param date: datetime Date
         """
-        if date not in self._events:
-            self._events[date] = DayEvent(date)
-        self._events[date].hook(event)
+        if isinstance(event, StateChangeEvent):
+            # Schedule the person's event itself, the StateChangeEvent was only needed to carry the date
+            event = event.get_event()
+        self._events.push(self.get_day_index(date), event)
+
+    def get_day_index(self, date):
+        """
+        :param date: datetime.date
+        :return: int number of days from the initial date of the simulation to the given date
+        """
+        return (date - self._initial_date).days
 
     def register_events(self, event_list):
         """
         Add all the given events to their dates on the simulation.
-        This applies only to DayEvents that need to be triggered on a specific date.
+        This applies only to DayEvents and StateChangeEvents that need to be triggered on a specific date,
+        and to StateChangeRules that are applied on every matching state change (see apply_state_change_rules).
         :param event_list: list of Event objects
         """
         if not isinstance(event_list, list):
             event_list = [event_list]
         for event in event_list:
-            assert isinstance(event, DayEvent), \
+            if isinstance(event, StateChangeRule):
+                for states in event.states:
+                    self._state_change_rules.setdefault(states, []).append(event)
+                continue
+            assert isinstance(event, (DayEvent, StateChangeEvent)), \
                 'Unexpected event type: {}'.format(type(event))
             self.register_event_on_day(event, event._date)
 
+    def apply_state_change_rules(self, person, old_state, new_state):
+        """
+        Apply the registered StateChangeRules on the given change of a person's disease state.
+        Called by DiseaseStateChangeEffect right after the person changed its state.
+        :param person: Person
+        :param old_state: DiseaseState
+        :param new_state: DiseaseState
+        """
+        for rule in self._state_change_rules.get((old_state, new_state), ()):
+            rule.apply(self, person, old_state, new_state)
+
 
     def infect_random_set(self,num_infected :int, infection_doc :str, per_to_immune=0.0,Immune_compliance :float =1,order:ORDER = ORDER.NONE, city_name=None,min_age=0,people_per_day =1):
         """
@@ -369,39 +447,34 @@ class Simulation(object):
             self.register_events(events)
 
         original_date = self._date
-        for date in sorted(self._events.keys()):
-            if date < original_date:
-                self._date = date
-                self._events[date].apply(self)
-                del self._events[date]
+        for day in self._events.days():
+            if day < self._day:
+                self._date = self._initial_date + timedelta(days=day)
+                for event in self._events.drain(day):
+                    event.apply(self)
         self._date = original_date
 
-    def run_simulation(self, num_days, name, datas_to_plot=None,run_simulation = None,extensionsList = None):
+    def load_extensions(self, extensionsList):
         """
-        This main loop of the simulation.
-        It advances the simulation day by day and saves,
-        and after it finishes it saves the output data to the relevant files.
-        :param num_days: int - The number of days to run
-        :param name: str - The name of this simulation, will determine output
-        directory path and filenames.
-        :param datas_to_plot: Indicates what sort of data we wish to plot
-        and save at the end of the simulation.
-        :param Extension: user's class that contains function that is called at the end of each day
+        :param extensionsList: list of names of extension classes (in src.extensions), or None
+        :return: list of the extension objects of this simulation
         """
-        assert self.num_days_to_run is None
-        self.num_days_to_run = num_days
-        if datas_to_plot is None:
-            datas_to_plot = dict()
-        log.info("Starting simulation " + name)
-
         extensions = []
         if extensionsList != None:
             for ExtName in extensionsList:
                 mod  = __import__('src.extensions.' + ExtName,fromlist=[ExtName])
                 ExtensionType = getattr(mod,ExtName)
                 extensions = extensions + [ExtensionType(self)]
-            
+        return extensions
 
+    def simulate_days(self, num_days, extensions=()):
+        """
+        Simulate the given number of days, or less if the simulation stops early
+        (when it is static, or when the first infected people are done, see stop_early)
+        :param num_days: int - The number of days to simulate
+        :param extensions: list of extension objects, called at the start and at the end of each day
+        :return: bool - True if the simulation stopped early
+        """
         for day in range(num_days):
             for ext in extensions:
                 ext.start_of_day_processing()
@@ -414,8 +487,29 @@ class Simulation(object):
             if self.stats.is_static() or self.first_people_are_done():
                 if self._verbosity:
                     log.info('simulation stopping after {} days'.format(day))
-                break
-                
+                return True
+        return False
+
+    def run_simulation(self, num_days, name, datas_to_plot=None,run_simulation = None,extensionsList = None):
+        """
+        This main loop of the simulation.
+        It advances the simulation day by day and saves,
+        and after it finishes it saves the output data to the relevant files.
+        :param num_days: int - The number of days to run
+        :param name: str - The name of this simulation, will determine output
+        directory path and filenames.
+        :param datas_to_plot: Indicates what sort of data we wish to plot
+        and save at the end of the simulation.
+        :param Extension: user's class that contains function that is called at the end of each day
+        """
+        assert self.num_days_to_run is None
+        # A simulation restored from a checkpoint already ran the days before it
+        self.num_days_to_run = self._day + num_days
+        if datas_to_plot is None:
+            datas_to_plot = dict()
+        log.info("Starting simulation " + name)
+
+        self.simulate_days(num_days, self.load_extensions(extensionsList))
 
         self.stats.mark_ending(self._world.all_people())
         self.stats.calc_r0_data(self._world.all_people(), self.num_r_days)
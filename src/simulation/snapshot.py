@@ -0,0 +1,102 @@
+"""
+Pickling a running simulation (see Simulation.checkpoint).
+Plain pickle saves the state of an object where it is first referenced, so when every person references
+its environments and every environment its people, it recurses along a chain of people and environments
+that is much deeper than the recursion limit.
+Here a person is saved as a reference (its index, class and id) wherever it is referenced,
+and the states of the referenced people are saved afterwards, each of them on its own.
+"""
+import io
+import pickle
+
+from src.world import Person
+
+
+class _SnapshotPickler(pickle.Pickler):
+    __slots__ = ('_indices', 'people')
+
+    def __init__(self, file):
+        super(_SnapshotPickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        # The index of each referenced person, by its python id
+        self._indices = {}
+        self.people = []
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, Person):
+            return None
+        index = self._indices.get(id(obj))
+        if index is None:
+            index = self._indices[id(obj)] = len(self.people)
+            self.people.append(obj)
+        return index, type(obj), obj._id
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    __slots__ = ('people',)
+
+    def __init__(self, file):
+        super(_SnapshotUnpickler, self).__init__(file)
+        self.people = {}
+
+    def persistent_load(self, pid):
+        index, person_type, person_id = pid
+        person = self.people.get(index)
+        if person is None:
+            person = self.people[index] = person_type.__new__(person_type)
+            # The person may be hashed (see Person.__hash__) before its state is loaded
+            person._id = person_id
+        return person
+
+
+def dump_snapshot(obj):
+    """
+    :param obj: object to pickle, usually a Simulation with its World
+    :return: bytes
+    """
+    file = io.BytesIO()
+    pickler = _SnapshotPickler(file)
+    pickler.dump(obj)
+    # The states of the people may reference more people, which are saved in the next batch
+    num_saved = 0
+    while num_saved < len(pickler.people):
+        batch = pickler.people[num_saved:]
+        num_saved = len(pickler.people)
+        pickler.dump([person.__reduce_ex__(pickle.HIGHEST_PROTOCOL)[2] for person in batch])
+    pickler.dump(None)
+    return file.getvalue()
+
+
+def load_snapshot(snapshot):
+    """
+    :param snapshot: bytes returned by dump_snapshot
+    :return: a copy of the pickled object
+    """
+    unpickler = _SnapshotUnpickler(io.BytesIO(snapshot))
+    obj = unpickler.load()
+    index = 0
+    batch = unpickler.load()
+    while batch is not None:
+        for state in batch:
+            _set_state(unpickler.people[index], state)
+            index += 1
+        batch = unpickler.load()
+    return obj
+
+
+def _set_state(obj, state):
+    """
+    Set the state of an object like unpickling does
+    :param obj: object made by __new__
+    :param state: the state of the object, the third item of its __reduce_ex__
+    """
+    if hasattr(obj, '__setstate__'):
+        obj.__setstate__(state)
+        return
+    slots_state = None
+    if isinstance(state, tuple):
+        state, slots_state = state
+    if state:
+        obj.__dict__.update(state)
+    if slots_state:
+        for name, value in slots_state.items():
+            setattr(obj, name, value)
@@ -1,4 +1,4 @@
-from src.util.distribution import Distribution, DiscreteDistribution
+from src.util.distribution import Distribution, DiscreteDistribution, WeightedSampler
 from src.util.divide_array import divide_array, divide_weighted_array
 from src.util.Enumerations import machine_type
 
@@ -8,4 +8,5 @@ __all__ = [
     'divide_array',
     'divide_weighted_array',
     'machine_type',
+    'WeightedSampler',
 ]
@@ -74,3 +74,155 @@ class Distribution(object):
         """
         return sum(
             [self.segment_distribution.probs[i] * (self.segments[i][0] + self.segments[i][1]) / 2.0 for i in range(len(self.segments))])
+
+
+class WeightedSampler(object):
+    """
+    A weighted distribution on objects that can be updated in place.
+    The probability to sample an object is its weight divided by the total weight.
+    Weights are kept in a Fenwick (binary indexed) tree,
+    so setting a weight, removing an object and sampling all take O(log n),
+    instead of rebuilding a DiscreteDistribution whenever the weights change.
+    """
+    __slots__ = ('_objects', '_weights', '_tree', '_index', '_free', '_num_updates')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all the objects from the sampler
+        """
+        # slot i holds self._objects[i] with weight self._weights[i], freed slots hold None
+        self._objects = []
+        self._weights = []
+        # 1-based Fenwick tree over self._weights
+        self._tree = [0.0]
+        self._index = {}
+        self._free = []
+        # updates since the tree was last rebuilt, used to bound the floating point drift
+        self._num_updates = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, obj):
+        return obj in self._index
+
+    def set_weight(self, obj, weight):
+        """
+        Add the object to the sampler, or update its weight if it is already in it
+        :param obj: a hashable object
+        :param weight: non negative float
+        """
+        assert weight >= 0, "Weight {} is negative".format(weight)
+        idx = self._index.get(obj)
+        if idx is None:
+            idx = self._new_slot(obj)
+        delta = weight - self._weights[idx]
+        self._weights[idx] = weight
+        self._add(idx, delta)
+
+    def remove(self, obj):
+        """
+        Remove the object from the sampler, if it is in it
+        :param obj: a hashable object
+        """
+        idx = self._index.pop(obj, None)
+        if idx is None:
+            return
+        delta = -self._weights[idx]
+        self._weights[idx] = 0.0
+        self._objects[idx] = None
+        self._free.append(idx)
+        self._add(idx, delta)
+
+    def total_weight(self):
+        """
+        :return: float, the sum of the weights of all the objects
+        """
+        return max(self._prefix_sum(len(self._weights)), 0.0)
+
+    def sample(self):
+        """
+        :return: A random object, chosen with probability proportional to its weight.
+        If all the weights are zero, an arbitrary object is returned.
+        """
+        assert len(self._index) > 0, "Can't sample from an empty sampler"
+        idx = self._find(_random.random() * self.total_weight())
+        if idx >= len(self._weights) or self._weights[idx] <= 0:
+            # We landed on a freed slot due to floating point drift, rebuild the tree and try again
+            self._rebuild()
+            idx = self._find(_random.random() * self.total_weight())
+            if idx >= len(self._weights) or self._weights[idx] <= 0:
+                return next(iter(self._index))
+        return self._objects[idx]
+
+    def _new_slot(self, obj):
+        if self._free:
+            idx = self._free.pop()
+            self._objects[idx] = obj
+        else:
+            idx = len(self._weights)
+            self._objects.append(obj)
+            self._weights.append(0.0)
+            # the new tree node covers the slots (i - lowbit(i), i], all but the last are already in the tree
+            i = idx + 1
+            self._tree.append(self._prefix_sum(idx) - self._prefix_sum(i - (i & -i)))
+        self._index[obj] = idx
+        return idx
+
+    def _add(self, idx, delta):
+        """
+        Add delta to the tree nodes covering the given slot, self._weights must already be updated
+        """
+        self._num_updates += 1
+        if self._num_updates > 4 * len(self._weights) + 64:
+            self._rebuild()
+            return
+        i = idx + 1
+        tree = self._tree
+        n = len(tree)
+        while i < n:
+            tree[i] += delta
+            i += i & -i
+
+    def _prefix_sum(self, count):
+        """
+        :return: the sum of the weights of the first count slots
+        """
+        total = 0.0
+        tree = self._tree
+        while count > 0:
+            total += tree[count]
+            count -= count & -count
+        return total
+
+    def _find(self, value):
+        """
+        :return: the smallest slot index such that the sum of the weights up to it (inclusive) is above value
+        """
+        tree = self._tree
+        n = len(tree) - 1
+        pos = 0
+        step = 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= value:
+                pos = nxt
+                value -= tree[nxt]
+            step >>= 1
+        return pos
+
+    def _rebuild(self):
+        """
+        Recompute the tree from the exact weights, in O(n)
+        """
+        tree = [0.0] + list(self._weights)
+        n = len(tree)
+        for i in range(1, n):
+            parent = i + (i & -i)
+            if parent < n:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._num_updates = 0
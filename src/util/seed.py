@@ -14,3 +14,12 @@ def set_random_seed():
         random.seed(CONSTANT_SEED)
         np.random.seed(CONSTANT_SEED)
 
+
+def reseed_process():
+    """
+    Seeds numpy's random number generator from the OS, to be called in a new process.
+    A forked process inherits the numpy random state of its parent (unlike the random module,
+    which is reseeded on fork), so the workers of a forked pool would otherwise all draw the same numbers.
+    The tasks still fix the seed when CONSTANT_SEED is set, see set_random_seed
+    """
+    np.random.seed()
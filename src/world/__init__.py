@@ -1,5 +1,6 @@
 from src.world.person import Person, RedactedPerson, RedactedPersonAndEnv
 from src.world.world import World
+from src.world.population_store import PopulationStore, StoredPerson
 from src.world.infection_data import InfectionData
 import src.world.city_data
 import src.world.population_generation
@@ -10,6 +11,8 @@ __all__ = [
     'RedactedPerson',
     'RedactedPersonAndEnv',
     'World',
+    'PopulationStore',
+    'StoredPerson',
     'InfectionData',
     'city_data',
     'population_generation',
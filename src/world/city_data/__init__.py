@@ -1,7 +1,8 @@
 from src.world.city_data.city import City
-from src.world.city_data.cities import get_city_list_from_dem_xls
+from src.world.city_data.cities import get_city_list_from_dem_xls, get_cities_file_path
 
 __all__ = [
     'City',
     'get_city_list_from_dem_xls',
+    'get_cities_file_path',
 ]
@@ -125,6 +125,14 @@ def city_from_csv_line(line, nafa_col_values):
         workplace_city_distribution=None
     )
 
+def get_cities_file_path(file_path):
+    """
+    :param file_path: The path of the cities data file, as written in config.json (relative to this directory)
+    :return: The path to open the file with
+    """
+    return os.path.join(os.path.dirname(__file__), file_path)
+
+
 def get_city_list_from_dem_xls(file_path: object) -> object:
     """
     Parses the xlsx file (saved in the hardcoded DATA_FILE_PATH path),
@@ -133,7 +141,7 @@ def get_city_list_from_dem_xls(file_path: object) -> object:
     with workplace_city_distribution-s not yet initialized
     """
 
-    full_path = os.path.join(os.path.dirname(__file__),file_path)
+    full_path = get_cities_file_path(file_path)
     sheet = xlrd.open_workbook(full_path, 'r').sheet_by_index(0)
     assert sheet.cell(0, TOWN_SYMBOL_COLUMN).value == 'ids', 'Wrong file! %0'
     assert sheet.cell(2, TOWN_SYMBOL_COLUMN).value == 'town symbol', 'Wrong file!'
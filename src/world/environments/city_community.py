@@ -5,24 +5,30 @@ from src.world.environments.homogeneous_environment import HomogeneousEnvironmen
 
 
 class CityCommunity(HomogeneousEnvironment):
-    __slots__ = ('_city', '_sub_environments_dict', '_already_sorted_envs')
+    __slots__ = ('_city', '_sub_environments_dict', '_sorted_environments')
     name = "city_community"
 
     def __init__(self, city, contact_prob_between_each_two_people):
         super(CityCommunity, self).__init__(contact_prob_between_each_two_people)
         self._city = city
         self._sub_environments_dict = defaultdict(list)
-        self._already_sorted_envs = set()
+        # The shuffled sub environments by their name, the generated order is kept for reset
+        self._sorted_environments = {}
 
     def add_environment(self, env):
-        assert not (env.name in self._already_sorted_envs), "Can't add an anvironment after sorting them!"
+        assert not (env.name in self._sorted_environments), "Can't add an anvironment after sorting them!"
         self._sub_environments_dict[env.name].append(env)
 
     def get_sorted_environments(self, env_name):
         assert env_name in self._sub_environments_dict, "Don't have environments of name '%s'" % env_name
-        if env_name in self._already_sorted_envs:
-            return self._sub_environments_dict[env_name]
-        random.shuffle(self._sub_environments_dict[env_name])
-        self._already_sorted_envs.add(env_name)
+        if env_name in self._sorted_environments:
+            return self._sorted_environments[env_name]
+        sorted_environments = list(self._sub_environments_dict[env_name])
+        random.shuffle(sorted_environments)
         # Tuple since we don't want anyone changing it
-        return tuple(self._sub_environments_dict[env_name])
+        self._sorted_environments[env_name] = tuple(sorted_environments)
+        return self._sorted_environments[env_name]
+
+    def reset(self):
+        super(CityCommunity, self).reset()
+        self._sorted_environments = {}
@@ -24,7 +24,7 @@ class Environment(object):
     """
     Represents a place where a group of people can interact and infect each other.
     """
-    __slots__ = ('_id', '_attributes', '_full_name')
+    __slots__ = ('_id', '_attributes', '_full_name', '_world')
     num_total_environments = 0
 
     def __init__(self, full_name):
@@ -35,6 +35,8 @@ class Environment(object):
         self._id = Environment.num_total_environments  # Used only for debugging purposes
         self._attributes = {}
         self._full_name = full_name
+        # The World that tracks whether this environment is active, set by the World itself
+        self._world = None
         Environment.num_total_environments += 1
 
     def __repr__(self):
@@ -49,6 +51,21 @@ class Environment(object):
         """
         raise NotImplementedError()
 
+    def is_active(self):
+        """
+        Returns whether propagate_infection may infect anyone today.
+        Environments that can't tell are always considered active.
+        :return: bool
+        """
+        return True
+
+    def reset(self):
+        """
+        Bring the environment back to the state it had before any simulation ran on it,
+        so the World can be reused for another simulation (see World.reset)
+        """
+        self._attributes = {}
+
     def propagate_infection(self, date):
         """
         Needs to be implemented for every subclass
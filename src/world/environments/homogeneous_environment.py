@@ -1,8 +1,23 @@
 import random
 from math import exp
+import numpy as _np
 
 from src.world.environments.environment import Environment
-from src.util import Distribution
+from src.util import WeightedSampler
+
+
+def _uniform_draws(count):
+    """
+    Draw uniform floats in [0, 1) from the generator of the random module (the one the per-person loop uses),
+    so that random.seed reproduces them, with one call to it.
+    :param count: int number of draws
+    :return: numpy array of floats
+    """
+    if count == 0:
+        return _np.empty(0)
+    bits = random.getrandbits(64 * count).to_bytes(8 * count, 'little')
+    # The top 53 bits of each 64 bits, like random.random()
+    return (_np.frombuffer(bits, dtype='<u8') >> 11) * (1. / (1 << 53))
 
 
 class HomogeneousEnvironment(Environment):
@@ -16,7 +31,13 @@ class HomogeneousEnvironment(Environment):
     __slots__ = (
         '_person_dict',
         '_infectious_people_and_weights',
-        '_contact_prob_between_each_two_people'
+        '_infection_source_sampler',
+        '_contact_prob_between_each_two_people',
+        '_member_rows',
+        '_members',
+        '_member_weights',
+        '_member_susceptibility',
+        '_policy_version'
     )
 
     def __init__(self, contact_prob_between_each_two_people : float, full_name=None):
@@ -25,8 +46,92 @@ class HomogeneousEnvironment(Environment):
         super(HomogeneousEnvironment, self).__init__(full_name)
         self._person_dict = {}
         self._infectious_people_and_weights = {}
+        self._infection_source_sampler = WeightedSampler()
         self._contact_prob_between_each_two_people = \
             contact_prob_between_each_two_people
+        # The version of the policies of the world that the weights in self._person_dict follow
+        self._policy_version = 0
+        self._clear_member_arrays()
+
+    def _clear_member_arrays(self):
+        """
+        Drop the NumPy arrays used by the vectorized infection draw.
+        They are rebuilt from self._person_dict the next time they are needed.
+        """
+        self._member_rows = None
+        self._members = None
+        self._member_weights = None
+        self._member_susceptibility = None
+
+    def _build_member_arrays(self):
+        """
+        Build the NumPy arrays used by the vectorized infection draw:
+        row i of each array describes the person self._members[i].
+        Once built, sign_up_for_today keeps them in sync with self._person_dict.
+        """
+        self._members = list(self._person_dict.keys())
+        self._member_rows = {person: row for row, person in enumerate(self._members)}
+        self._member_weights = _np.fromiter(self._person_dict.values(), dtype=float, count=len(self._members))
+        self._member_susceptibility = _np.fromiter(
+            (person.is_susceptible for person in self._members), dtype=bool, count=len(self._members)
+        )
+
+    def _update_member_arrays(self, person, weight):
+        """
+        Update the row of the given person in the vectorized arrays (if they were built).
+        Dead people keep their row, with zero weight, so the other rows don't move.
+        """
+        if self._member_rows is None:
+            return
+        row = self._member_rows.get(person)
+        if row is None:
+            if person.is_dead:
+                return
+            row = len(self._members)
+            self._member_rows[person] = row
+            self._members.append(person)
+            self._member_weights = _np.append(self._member_weights, 0.)
+            self._member_susceptibility = _np.append(self._member_susceptibility, False)
+        if person.is_dead:
+            self._member_weights[row] = 0.
+            self._member_susceptibility[row] = False
+        else:
+            self._member_weights[row] = weight
+            self._member_susceptibility[row] = person.is_susceptible
+
+    def _get_policy_weight(self, person, weight):
+        """
+        :param person: Person
+        :param weight: the routine weight of the person in this environment
+        :return: the weight of the person in this environment under the active policies of its group
+        (see PolicyMultipliers)
+        """
+        group = person.get_policy_group()
+        if group == 0 or self._world is None:
+            return weight
+        return weight * self._world.get_policies().get_multiplier(self.name, group)
+
+    def _apply_policies(self):
+        """
+        Weigh all the members again if the active policies changed since they were weighed,
+        so starting or ending a policy doesn't have to sign its people up again.
+        """
+        if self._world is None:
+            return
+        version = self._world.get_policies().version
+        if version == self._policy_version:
+            return
+        self._policy_version = version
+        for person, old_weight in self._person_dict.items():
+            weight = self._get_policy_weight(person, person.get_routine()[self.name])
+            if weight == old_weight:
+                continue
+            self._person_dict[person] = weight
+            if person in self._infectious_people_and_weights:
+                total_weight = person.get_prob_to_infect_on_contact() * weight
+                self._infectious_people_and_weights[person] = total_weight
+                self._infection_source_sampler.set_weight(person, total_weight)
+            self._update_member_arrays(person, weight)
 
     def sign_up_for_today(self, person, weight):
         """
@@ -34,18 +139,25 @@ class HomogeneousEnvironment(Environment):
         This amount (weight) is based to 1 and may change with interventions.
         If the weight is zero, this person won't go to this rnviroment until a further change.
         """
+        was_active = self.is_active()
+        weight = self._get_policy_weight(person, weight)
         if person.is_dead:
             self._person_dict.pop(person, None)
             self._infectious_people_and_weights.pop(person, None)
-            return
-
-        if person.is_infectious:
-            total_weight = person.get_prob_to_infect_on_contact() * weight
-            self._infectious_people_and_weights[person] = total_weight
+            self._infection_source_sampler.remove(person)
         else:
-            self._infectious_people_and_weights.pop(person, None)
+            if person.is_infectious:
+                total_weight = person.get_prob_to_infect_on_contact() * weight
+                self._infectious_people_and_weights[person] = total_weight
+                self._infection_source_sampler.set_weight(person, total_weight)
+            else:
+                self._infectious_people_and_weights.pop(person, None)
+                self._infection_source_sampler.remove(person)
+            self._person_dict[person] = weight
+        self._update_member_arrays(person, weight)
 
-        self._person_dict[person] = weight
+        if self._world is not None and was_active != self.is_active():
+            self._world.set_environment_activity(self, not was_active)
 
     def clear(self):
         """
@@ -53,6 +165,23 @@ class HomogeneousEnvironment(Environment):
         """
         self._person_dict = {}
         self._infectious_people_and_weights = {}
+        self._infection_source_sampler.clear()
+        self._clear_member_arrays()
+        if self._world is not None:
+            self._world.set_environment_activity(self, False)
+
+    def reset(self):
+        """
+        Kick all the people out of the environment, see Environment.reset
+        """
+        super(HomogeneousEnvironment, self).reset()
+        self.clear()
+
+    def is_active(self):
+        """
+        An environment is active as long as it has at least one infectious member
+        """
+        return len(self._infectious_people_and_weights) > 0
 
     def propagate_infection(self, date):
         """
@@ -69,30 +198,31 @@ class HomogeneousEnvironment(Environment):
         """
         if len(self._infectious_people_and_weights) == 0:
             return []
+        self._apply_policies()
 
-        total_infected_weights = sum(self._infectious_people_and_weights.values(), 0.0)
+        total_infected_weights = self._infection_source_sampler.total_weight()
 
         log_weightless_non_infection_prob = \
             - self._contact_prob_between_each_two_people * total_infected_weights
         weightless_non_infection_prob = exp(log_weightless_non_infection_prob)
 
-        infection_source_distribution = Distribution(
-            list(self._infectious_people_and_weights.keys()),
-            list(self._infectious_people_and_weights.values()),
-            check_sum=False,
-            is_singleton=True
-        )
         new_events = []
         num_infections = 0
-        for person, weight in self._person_dict.items():
-            if person.is_susceptible:
-                infection_prob = 1 - (weightless_non_infection_prob ** weight)
-                if random.random() < infection_prob:
-                    num_infections += 1
-                    infection_source = infection_source_distribution.sample()
-                    # print("propagate_infection calling infect_and_get_events for id:{} date:{}".format(person.get_id(),date))
-                    curr_events = person.infect_and_get_events(date, self, infection_source)
-                    new_events += curr_events
+        if self._use_vectorized_draw():
+            for person in self._draw_infected_members(log_weightless_non_infection_prob):
+                num_infections += 1
+                infection_source = self._infection_source_sampler.sample()
+                new_events += person.infect_and_get_events(date, self, infection_source)
+        else:
+            for person, weight in self._person_dict.items():
+                if person.is_susceptible:
+                    infection_prob = 1 - (weightless_non_infection_prob ** weight)
+                    if random.random() < infection_prob:
+                        num_infections += 1
+                        infection_source = self._infection_source_sampler.sample()
+                        # print("propagate_infection calling infect_and_get_events for id:{} date:{}".format(person.get_id(),date))
+                        curr_events = person.infect_and_get_events(date, self, infection_source)
+                        new_events += curr_events
 
         if num_infections > 0:
             for p, weight in self._infectious_people_and_weights.items():
@@ -100,6 +230,33 @@ class HomogeneousEnvironment(Environment):
 
         return new_events
 
+    def _use_vectorized_draw(self):
+        """
+        Whether to draw today's infections with one vectorized NumPy call instead of a Python loop.
+        Set in the 'infection_propagation' section of params.json (read by the World),
+        and only worth it for large environments.
+        """
+        if self._world is None:
+            return False
+        min_env_size = self._world.get_vectorized_min_env_size()
+        return min_env_size is not None and len(self._person_dict) >= min_env_size
+
+    def _draw_infected_members(self, log_weightless_non_infection_prob):
+        """
+        The vectorized equivalent of the loop in propagate_infection:
+        each susceptible member j is infected with probability 1 - exp(log_weightless_non_infection_prob * w_j).
+        :param log_weightless_non_infection_prob: float, see propagate_infection
+        :return: list of the newly infected Person objects
+        """
+        if self._member_rows is None:
+            self._build_member_arrays()
+        infection_probs = -_np.expm1(log_weightless_non_infection_prob * self._member_weights)
+        draws = _uniform_draws(len(self._members))
+        rows = _np.flatnonzero(self._member_susceptibility & (draws < infection_probs))
+        # A member may have been infected in another environment earlier today,
+        # which only updates the arrays on the next sign up
+        return [self._members[row] for row in rows if self._members[row].is_susceptible]
+
     def get_people(self):
         """
         Returns an iterator of the people that come to the environment
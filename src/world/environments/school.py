@@ -22,6 +22,10 @@ class School(HomogeneousEnvironment):
     def set_city_env(self, city_env):
         self._city_env = city_env
 
+    def reset(self):
+        super(School, self).reset()
+        self._intervention_state = SchoolInterventionState.OPEN
+
     def set_intervention_state(self, old_state, new_state):
         assert self._intervention_state == old_state, (
             "Trying to switch a school from state {} to state {}, "
@@ -7,9 +7,9 @@ import numpy as _np
 
 from src.simulation.event import (
     Event,
-    DayEvent,
     EmptyTrigger,
-    DiseaseStateChangeEffect
+    DiseaseStateChangeEffect,
+    StateChangeEvent
 )
 from src.seir import DiseaseState,sample_seir_times
 from src.simulation.params import Params
@@ -48,6 +48,10 @@ class Person(object):
         '_seir_times',
         'state_machine_type',
         '_my_neighborhood',
+        '_world',
+        '_policy_group',
+        '_store',
+        '_row',
     )
     num_people_so_far = 0
 
@@ -58,15 +62,11 @@ class Person(object):
         #if random.random() < R0:
         #   StartAsRecovered = True
 
-        self._changed = True
         if not environments:
             environments = []
-        self._age = age
         assert len(set([env.name for env in environments])) == len(environments), "Got duplicate environment names"
-        self._environments = {env.name: env for env in environments}
-        self._current_routine = {env_name: 1 for env_name in self._environments}
         params = Params.loader()['person']
-        self._infectiousness_prob = \
+        infectiousness_prob = \
             min(params['base_infectiousness'] * \
             _np.random.gamma(
                 params['individual_infectiousness_gamma_shape'],
@@ -77,15 +77,52 @@ class Person(object):
         #   self.is_susceptible = False
         #   self.is_infected = True
         #else:
+        str_type = params['state_macine_type']
+        assert str_type in ['SIRS','SIR']
+        self._init_susceptible(
+            Person.num_people_so_far, age, infectiousness_prob, machine_type[str_type],
+            environments, [1] * len(environments)
+        )
+        Person.num_people_so_far += 1
+
+    @classmethod
+    def from_columns(cls, person_id, age, infectiousness_prob, state_machine_type, environments, routine_weights):
+        """
+        Make a susceptible person out of its saved data (see population_cache),
+        without sampling its infectiousness or taking a new id
+        :param person_id: int id of the person
+        :param age: int age
+        :param infectiousness_prob: float
+        :param state_machine_type: machine_type, or None
+        :param environments: list of the person's environments
+        :param routine_weights: list of the routine weight of each of the environments
+        :return: Person
+        """
+        person = cls.__new__(cls)
+        person._init_susceptible(person_id, age, infectiousness_prob, state_machine_type, environments, routine_weights)
+        return person
+
+    def _init_susceptible(self, person_id, age, infectiousness_prob, state_machine_type, environments, routine_weights):
+        """
+        Set all the slots of a person as the population generation leaves it, see __init__ and from_columns
+        """
+        self._changed = True
+        # The World this person belongs to, set by the World itself
+        self._world = None
+        # The PopulationStore row holding this person's data, if any (see src.world.population_store)
+        self._store = None
+        self._row = None
+        self._age = age
+        self._environments = {env.name: env for env in environments}
+        self._current_routine = {env.name: weight for env, weight in zip(environments, routine_weights)}
+        self._infectiousness_prob = infectiousness_prob
         self._disease_state = DiseaseState.SUSCEPTIBLE
         self.is_susceptible = True
         self.is_dead = False
         self.is_infectious = False
         self.is_infected = False
-        str_type = params['state_macine_type']
-        assert str_type in ['SIRS','SIR']
-        self.state_machine_type = machine_type[str_type]
-        self._id = Person.num_people_so_far
+        self.state_machine_type = state_machine_type
+        self._id = person_id
         # hold all the events that are triggered by some disease state(s) change(s), like isolation when symptomatic
         self.state_to_events = {}
         # The following counts the number of different interventions that force each routine change on this person.
@@ -94,6 +131,8 @@ class Person(object):
         # then go out of quarantine when the symptoms pass.
         self.routine_change_multiplicities = {}
         self.routine_changes = {}
+        # The group of the policies this person joined, see PolicyMultipliers
+        self._policy_group = 0
         self._infection_data = None
         # Table that currespond to seir times and events so it will be easier to mange
         self._seir_times= None
@@ -103,7 +142,6 @@ class Person(object):
         #    self.last_state =RedactedPerson(self.get_age(), self.get_disease_state())
         #else:
         self.last_state = None
-        Person.num_people_so_far += 1
 
     def _init_event(self, old_state, new_state):
         """
@@ -133,6 +171,7 @@ class Person(object):
         new_person.state_to_events = {}
         new_person.routine_change_multiplicities = {}
         new_person.routine_changes = {}
+        new_person._policy_group = 0
         return new_person
 
     def hook_on_change(self, states, event):
@@ -171,6 +210,13 @@ class Person(object):
         """
         return self._current_routine
 
+    def iter_routine(self):
+        """
+        :return: iterator of pairs of (environment, its weight in the person's routine)
+        """
+        routine = self._current_routine
+        return ((env, routine[env_name]) for env_name, env in self._environments.items())
+
     def get_environment(self, name):
         """
         get environment by name
@@ -195,8 +241,8 @@ class Person(object):
         """
         if not self._changed:
             return
-        for env_name, env in self._environments.items():
-            env.sign_up_for_today(self, self._current_routine[env_name])
+        for env, weight in self.iter_routine():
+            env.sign_up_for_today(self, weight)
 
     def _change(self):
         """
@@ -208,6 +254,8 @@ class Person(object):
         self.is_infected = self._disease_state.is_infected()
         self.is_dead = self._disease_state.is_dead()
         # print("in _change id:{} is_susceptible:{}".format(self.get_id(),self.is_susceptible))
+        if not self._changed and self._world is not None:
+            self._world.mark_changed(self)
         self._changed = True
 
     def get_prob_to_infect_on_contact(self):
@@ -237,6 +285,26 @@ class Person(object):
         """
         return self._infection_data
 
+    def get_disease_course(self):
+        """
+        gets the disease states this person goes through since its last infection, and the date of each of them,
+        by its infection data and seir times (see infect_and_get_events)
+        :return: list of (DiseaseState, date) pairs, empty if the person wasn't infected
+        """
+        if (self._infection_data is None) or (not self._seir_times):
+            return []
+        # The date of the infection data is the end of the first state of the infection
+        for state, duration in self._seir_times:
+            if state != DiseaseState.SUSCEPTIBLE:
+                break
+        curr_date = self._infection_data.date - duration
+        course = []
+        for state, duration in self._seir_times:
+            course.append((state, curr_date))
+            if duration is not None:
+                curr_date += duration
+        return course
+
     def get_id(self):
         """
         get the person's unique id in the population
@@ -300,10 +368,8 @@ class Person(object):
             curr_date += states_and_times[i - 1][1]
             old_state = last_state
             new_state = states_and_times[i][0]
-            new_event = DayEvent(curr_date)
             self._init_event(old_state, new_state)
-            new_event.hook(self.state_to_events[(old_state, new_state)])
-            events.append(new_event)
+            events.append(StateChangeEvent(curr_date, self.state_to_events[(old_state, new_state)]))
             last_state = states_and_times[i][0]
         assert states_and_times[-1][1] is None
         return events
@@ -460,6 +526,21 @@ class Person(object):
             self.routine_change_multiplicities[key] = 1
             self.update_routine()
 
+    def get_policy_group(self):
+        """
+        :return: int id of the group of the policies this person joined, see PolicyMultipliers
+        """
+        return self._policy_group
+
+    def join_policy(self, policies, policy):
+        """
+        Make this person follow the given policy whenever it is active.
+        Unlike add_routine_change, this doesn't change the routine of the person, see PolicyMultipliers
+        :param policies: PolicyMultipliers of the world of this person
+        :param policy: int id of the policy
+        """
+        self._policy_group = policies.join(self._policy_group, policy)
+
     def remove_routine_change(self, key):
         """
         remove a routine with the given name from the person's routine changes and update the routine.
@@ -487,6 +568,23 @@ class Person(object):
         self._current_routine = new_routine
         self._change()
 
+    def reset(self):
+        """
+        Bring the person back to the state it had before any simulation ran on it:
+        susceptible, without any events, routine changes or infection data.
+        Used by World.reset, which also marks the person as changed.
+        """
+        self._disease_state = DiseaseState.SUSCEPTIBLE
+        self.state_to_events = {}
+        self.routine_change_multiplicities = {}
+        self.routine_changes = {}
+        self._policy_group = 0
+        self._infection_data = None
+        self._seir_times = None
+        self._num_infections = 0
+        self.last_state = None
+        self.update_routine()
+
     def get_city_name(self):
         """
         return person's city name
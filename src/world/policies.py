@@ -0,0 +1,129 @@
+class PolicyMultipliers(object):
+    """
+    The routine multipliers of the policies (timed interventions) of a World, applied to groups of people at once.
+    A policy is a routine change (see Person.add_routine_change) that the same people follow between two dates.
+    Instead of adding the routine change to each of its people when it starts and removing it when it ends,
+    the people join the policy once, and activating or deactivating it is a single operation.
+    The people that joined the same policies share a group (an int, 0 is the group of no policies),
+    and the environments weigh their members by the multiplier of their group (see get_multiplier).
+    """
+    __slots__ = (
+        '_keys',
+        '_multiplier_generators',
+        '_multiplier_args',
+        '_active_counts',
+        '_groups',
+        '_group_ids',
+        '_multipliers',
+        'version'
+    )
+
+    def __init__(self):
+        # The key, the multiplier generator and its args of each policy, by its id
+        self._keys = []
+        self._multiplier_generators = []
+        self._multiplier_args = []
+        # The number of times each policy was activated and not deactivated yet, by its id
+        self._active_counts = []
+        # Each group is a sorted tuple of policy ids, its id is its index in self._groups
+        self._groups = [()]
+        self._group_ids = {(): 0}
+        # Cache of get_multiplier, valid as long as the active policies don't change
+        self._multipliers = {}
+        # Changes whenever the multipliers change, so the environments know when to weigh their members again.
+        # It only grows (even through reset), so a version that was seen once is never seen again.
+        self.version = 0
+
+    def add_policy(self, key, multiplier_generator, args=None):
+        """
+        Add an inactive policy
+        :param key: str key of the routine change of the policy, policies with the same key aren't multiplied together
+        (like routine changes with the same key on a person)
+        :param multiplier_generator: function that gets an environment name (and args) and returns its weight multiplier
+        :param args: extra args for the multiplier_generator
+        :return: int id of the new policy
+        """
+        self._keys.append(key)
+        self._multiplier_generators.append(multiplier_generator)
+        self._multiplier_args.append(args)
+        self._active_counts.append(0)
+        return len(self._keys) - 1
+
+    def join(self, group, policy):
+        """
+        :param group: int id of a group
+        :param policy: int id of a policy
+        :return: int id of the group of the people of the given group that also joined the given policy
+        """
+        policies = self._groups[group]
+        if policy in policies:
+            return group
+        policies = tuple(sorted(policies + (policy,)))
+        if policies not in self._group_ids:
+            self._group_ids[policies] = len(self._groups)
+            self._groups.append(policies)
+        return self._group_ids[policies]
+
+    def activate(self, policy):
+        """
+        Start applying the given policy to its groups
+        :param policy: int id of a policy
+        """
+        self._active_counts[policy] += 1
+        if self._active_counts[policy] == 1:
+            self._changed()
+
+    def deactivate(self, policy):
+        """
+        Stop applying the given policy to its groups
+        :param policy: int id of an active policy
+        """
+        assert self._active_counts[policy] > 0, "Policy {} ('{}') isn't active".format(policy, self._keys[policy])
+        self._active_counts[policy] -= 1
+        if self._active_counts[policy] == 0:
+            self._changed()
+
+    def is_active(self, policy):
+        """
+        :param policy: int id of a policy
+        :return: bool
+        """
+        return self._active_counts[policy] > 0
+
+    def get_multiplier(self, env_name, group):
+        """
+        The multiplier of the routine weight of the people of the given group in the given environment.
+        This is the product of the multipliers of the active policies of the group, taking one policy of each key.
+        :param env_name: str name of an environment
+        :param group: int id of a group
+        :return: float (or int) multiplier
+        """
+        cache_key = (env_name, group)
+        multiplier = self._multipliers.get(cache_key)
+        if multiplier is None:
+            multiplier = 1
+            keys = set()
+            for policy in self._groups[group]:
+                if self._active_counts[policy] > 0 and self._keys[policy] not in keys:
+                    keys.add(self._keys[policy])
+                    multiplier *= self._get_policy_multiplier(policy, env_name)
+            self._multipliers[cache_key] = multiplier
+        return multiplier
+
+    def _get_policy_multiplier(self, policy, env_name):
+        args = self._multiplier_args[policy]
+        if args is None:
+            return self._multiplier_generators[policy](env_name)
+        return self._multiplier_generators[policy](env_name, args)
+
+    def reset(self):
+        """
+        Remove all the policies and groups, see World.reset
+        """
+        version = self.version
+        self.__init__()
+        self.version = version + 1
+
+    def _changed(self):
+        self._multipliers = {}
+        self.version += 1
@@ -1,8 +1,12 @@
 from src.world.population_generation.city_generation import generate_city, generate_entire_country
 from src.world.population_generation.population_loader import PopulationLoader
+from src.world.population_generation.population_cache import PICKLE_FORMAT, COLUMNAR_FORMAT, population_key
 
 __all__ = [
     'generate_city',
     'generate_entire_country',
     'PopulationLoader',
+    'PICKLE_FORMAT',
+    'COLUMNAR_FORMAT',
+    'population_key',
 ]
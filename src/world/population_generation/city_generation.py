@@ -1,11 +1,16 @@
 # This file generates all environments of a city using the model explained
 # in the specification document.
 
+import multiprocessing as _mp
 import random as _random
 from collections import namedtuple
 
+import numpy as _np
+
 from src.world.city_data import City
-from src.world.environments import CityCommunity, School, Workplace
+from src.world.environments import CityCommunity, School, Workplace, NeighborhoodCommunity
+from src.world.environments.environment import Environment
+from src.world.person import Person
 from src.world.population_generation.smart_population_generation import generate_all_households_and_communities_of_city_smart
 from src.world.population_generation.naive_population_generation import generate_all_households_and_communities_of_city_naive
 from src.simulation.params import Params
@@ -278,7 +283,107 @@ def generate_city(city, is_smart_household_generation, internal_workplaces=True,
     return all_people, all_environments
 
 
-def generate_entire_country(city_list, is_smart_household_generation=True, scaling=1.0, verbosity=False):
+def _generate_city_of_country(city, is_smart_household_generation, scaling, verbosity, city_seed):
+    """
+    Generates a city of generate_entire_country in this process, with the random generators seeded by city_seed,
+    so it is the same city that a worker would generate (see _generate_city_in_worker).
+    The state of the random generators of this process is kept as it was.
+    :return: A pair (all_people, all_environments) of the city
+    """
+    random_state, np_random_state = _random.getstate(), _np.random.get_state()
+    _random.seed(city_seed)
+    _np.random.seed(city_seed)
+    try:
+        return generate_city(
+            city,
+            is_smart_household_generation=is_smart_household_generation,
+            internal_workplaces=False,
+            scaling=scaling,
+            verbosity=verbosity,
+            to_world=False
+        )
+    finally:
+        _random.setstate(random_state)
+        _np.random.set_state(np_random_state)
+
+
+def _init_generation_worker(params):
+    """
+    Initializes a worker process of generate_entire_country
+    :param params: The Params object of the parent process
+    """
+    Params.singleton = params
+
+
+def _generate_city_in_worker(args):
+    """
+    Generates a city of generate_entire_country in a worker process.
+    The ids of the people, environments and neighborhoods are counted from 0,
+    and are shifted by the parent (see _add_generated_city).
+    The environments are sent back without their city, which the parent sets again,
+    so the pickled results don't hold copies of all the cities.
+    :param args: tuple (city, is_smart_household_generation, scaling, verbosity, city_seed)
+    :return: A tuple (all_people, all_environments, number of people, environments and neighborhoods created)
+    """
+    Person.num_people_so_far = 0
+    Environment.num_total_environments = 0
+    NeighborhoodCommunity.num_total_hoods = 0
+    city_people, city_environments = _generate_city_of_country(*args)
+    for environment in city_environments:
+        environment._city = None
+    return (
+        city_people,
+        city_environments,
+        Person.num_people_so_far,
+        Environment.num_total_environments,
+        NeighborhoodCommunity.num_total_hoods
+    )
+
+
+def _add_generated_city(city, result):
+    """
+    Gives the people, environments and neighborhoods of a city generated by _generate_city_in_worker
+    the ids they would have had if it was generated in this process
+    :param city: The City that was generated
+    :param result: The return value of _generate_city_in_worker
+    :return: A pair (all_people, all_environments) of the city
+    """
+    city_people, city_environments, num_people, num_environments, num_hoods = result
+    for person in city_people:
+        person._id += Person.num_people_so_far
+    for environment in city_environments:
+        environment._id += Environment.num_total_environments
+        environment._city = city
+        if isinstance(environment, NeighborhoodCommunity):
+            environment._hood_id += NeighborhoodCommunity.num_total_hoods
+    Person.num_people_so_far += num_people
+    Environment.num_total_environments += num_environments
+    NeighborhoodCommunity.num_total_hoods += num_hoods
+    return city_people, city_environments
+
+
+def _generate_cities_of_country(city_list, is_smart_household_generation, scaling, verbosity, num_workers):
+    """
+    Generates the cities of generate_entire_country, each with its own seed (drawn from the random generator),
+    so the generated cities don't depend on num_workers
+    :return: A generator of pairs (city, (all_people, all_environments))
+    """
+    city_args = [
+        (city, is_smart_household_generation, scaling, verbosity, _random.randrange(2 ** 32))
+        for city in city_list
+    ]
+    if num_workers == 1:
+        for args in city_args:
+            yield args[0], _generate_city_of_country(*args)
+        return
+    ctx = _mp.get_context("spawn")
+    with ctx.Pool(num_workers, initializer=_init_generation_worker, initargs=(Params.loader(),)) as pool:
+        for args, result in zip(city_args, pool.imap(_generate_city_in_worker, city_args)):
+            yield args[0], _add_generated_city(args[0], result)
+
+
+def generate_entire_country(city_list, is_smart_household_generation=True, scaling=1.0, verbosity=False,
+                            num_workers=1):
     """
     Generates the World of a model of the entire country, in the same way as
     was detailed in the specification document.
@@ -289,6 +394,9 @@ def generate_entire_country(city_list, is_smart_household_generation=True, scali
     This should only be False for testing/debugging purposes.
     :param scaling: The scale that should multiply all of the cities involved.
     :param verbosity: Whether or not we should print debug information.
+    :param num_workers: The number of processes that generate the cities.
+    The workplaces between the cities are always divided in this process,
+    and the World is the same for any number of workers.
     :return: A world object corresponding to a model of all of these cities.
     """
     all_people = []
@@ -300,15 +408,9 @@ def generate_entire_country(city_list, is_smart_household_generation=True, scali
         if env_params["env_name"] == 'workplace':
             workplace_node = load_cross_environment_data_from_json(env_params)
     assert workplace_node is not None, "Could not find workplace in params.json!"
-    for city in city_list:
-        city_people, city_environments = generate_city(
-            city,
-            is_smart_household_generation=is_smart_household_generation,
-            internal_workplaces=False,
-            scaling=scaling,
-            verbosity=verbosity,
-            to_world=False
-        )
+    for city, (city_people, city_environments) in _generate_cities_of_country(
+        city_list, is_smart_household_generation, scaling, verbosity, num_workers
+    ):
         for person in city_people:
             all_people.append(person)
             if workplace_node.age_segment[0] <= person.get_age() <= workplace_node.age_segment[1]:
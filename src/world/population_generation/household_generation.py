@@ -128,17 +128,12 @@ def update_rems_from_weights(vals, rems, need_sum, num_add):
     return([vals,0])
     
 
-# age_distrib - list of triplets, each triplet has percentage, min_age, max_age (not inclusive)
-# house_size_distrib - list of probs of house size (first is zero), last is probability of that size or more
-# percentage_65 - percentage of households with someone over 65
-# percentage_child - percentage of households with someone under 18
-# n_house = number of households
-# tot_pop - total population
-# perc_sing_house - percentage of single parent house (out of house with children)
-# perc_sing_child - percentage of children that live in single parent home
-# child_per_house - distribution of number of children in households with children (if known)
-
-def sim_houses(age_distrib, house_size_distrib, percentage_65, percentage_child, org_n_house, tot_pop, perc_sing_house, perc_sing_child, child_per_house = None, print_fail=0):
+# Get the counters of all the stats a simulation of the households should match:
+# number of people of each age, number of households with 0, 1, 2... people over 65,
+# number of households without and with children, number of single parent households
+# with 0, 1, 2... children and number of households of each size.
+# The parameters are the same as in sim_houses
+def get_household_counters(age_distrib, house_size_distrib, percentage_65, percentage_child, org_n_house, tot_pop, perc_sing_house, perc_sing_child):
     # Get size probabilities that give correct average household size
     [prb_sizes, n_house] = normalize_house_sizes(tot_pop, org_n_house, house_size_distrib)
     
@@ -159,6 +154,21 @@ def sim_houses(age_distrib, house_size_distrib, percentage_65, percentage_child,
     rem_child = from_probs_to_nums([1-percentage_child, percentage_child], n_house)
     rem_sing = [0]+from_probs_to_nums(sing_real, n_house)[1:]
     rem_sizes = from_probs_to_nums(prb_sizes, n_house, tot_pop)
+    return([rem_ages, rem_65, rem_child, rem_sing, rem_sizes])
+
+# age_distrib - list of triplets, each triplet has percentage, min_age, max_age (not inclusive)
+# house_size_distrib - list of probs of house size (first is zero), last is probability of that size or more
+# percentage_65 - percentage of households with someone over 65
+# percentage_child - percentage of households with someone under 18
+# n_house = number of households
+# tot_pop - total population
+# perc_sing_house - percentage of single parent house (out of house with children)
+# perc_sing_child - percentage of children that live in single parent home
+# child_per_house - distribution of number of children in households with children (if known)
+
+def sim_houses(age_distrib, house_size_distrib, percentage_65, percentage_child, org_n_house, tot_pop, perc_sing_house, perc_sing_child, child_per_house = None, print_fail=0):
+    [rem_ages, rem_65, rem_child, rem_sing, rem_sizes] = get_household_counters(
+        age_distrib, house_size_distrib, percentage_65, percentage_child, org_n_house, tot_pop, perc_sing_house, perc_sing_child)
 
     if print_fail:
         print ('at start', rem_ages, rem_sizes, rem_sing, rem_child, rem_65)
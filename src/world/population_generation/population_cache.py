@@ -0,0 +1,314 @@
+import copy
+import functools
+import gc
+import hashlib
+import json
+import os
+import struct
+import zipfile
+import numpy as _np
+
+from src.seir import DiseaseState
+from src.util.Enumerations import machine_type
+from src.world.environments import CityCommunity, NeighborhoodCommunity, Household, School, Workplace
+from src.world.environments.classroom import Classroom
+from src.world.person import Person
+from src.world.world import World
+
+# Bump this whenever the layout of the arrays changes, so stale cache files are regenerated instead of misread
+COLUMNAR_CACHE_VERSION = 3
+# Bump this whenever the population generation changes, so worlds generated by the old code are not loaded
+GENERATOR_VERSION = 2
+# The sections of params.json that the population generation reads. Changes to the other sections
+# (the disease parameters, the interventions...) don't change the generated world, so they don't change its key
+POPULATION_PARAMS_SECTIONS = ('person', 'population', 'city_environments')
+# The params in these sections that only change how a loaded world is stored, not the generated world
+# (see World.load_runtime_params), so they aren't part of its key either
+RUNTIME_ONLY_PARAMS = (('population', 'use_population_store'),)
+
+PICKLE_FORMAT = "pickle"
+COLUMNAR_FORMAT = "columnar"
+CACHE_FORMAT_TO_EXTENSION = {
+    PICKLE_FORMAT: "pkl",
+    COLUMNAR_FORMAT: "npz",
+}
+
+_ENV_TYPES = [Household, NeighborhoodCommunity, School, Workplace, Classroom, CityCommunity]
+_ENV_TYPE_TO_CODE = {env_type: code for code, env_type in enumerate(_ENV_TYPES)}
+# The environment types whose constructor takes an age segment and a full name
+_AGE_SEGMENTED_ENV_TYPES = (School, Workplace, Classroom)
+
+# The arrays of the cache file that hold the static columns of a PopulationStore of the loaded world,
+# by the column name. see PopulationStore.share_static_columns
+_STORE_COLUMN_TO_ARRAY = {
+    'ages': 'ages',
+    'infectiousness': 'infectiousness',
+    'env_offsets': 'person_env_offsets',
+    'env_ids': 'person_env_ids',
+}
+
+
+def population_key(cities_file_path, city_name, is_smart, scale, params):
+    """
+    Content address of a generated world: a hash of everything the population generation reads,
+    so worlds are cached once for all the params that only differ outside of POPULATION_PARAMS_SECTIONS
+    :param cities_file_path: The path of the cities data file the world is generated from
+    :param city_name: The name of the generated city ('all' for entire country)
+    :param is_smart: Is the world generated using smart generation
+    :param scale: The scale by which the city size is multiplied
+    :param params: Params object the world is generated with
+    :return: str hex digest
+    """
+    key_params = copy.deepcopy({section: params[section] for section in POPULATION_PARAMS_SECTIONS})
+    for section, name in RUNTIME_ONLY_PARAMS:
+        key_params[section].pop(name, None)
+    key_data = {
+        'generator_version': GENERATOR_VERSION,
+        'cities_file': _file_digest(os.path.abspath(cities_file_path)),
+        'city_name': city_name,
+        'is_smart': bool(is_smart),
+        'scale': float(scale),
+        'params': key_params,
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(filepath):
+    """
+    :param filepath: The path of a file, which is not expected to change while the process runs
+    :return: str hex digest of the file contents
+    """
+    with open(filepath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def save_world_columns(world, filepath, key):
+    """
+    Save a freshly generated World (before any simulation ran on it) as columns in an uncompressed .npz file:
+    one row per person (age, infectiousness, id, neighborhood),
+    one row per environment (type, name, contact probability, city, age segment, neighborhood id, city environment),
+    and the environments of each person in CSR form (person_env_offsets, person_env_ids, person_env_weights).
+    Environments are referred to by their index in world.all_environments.
+    The people columns are laid out like the static columns of a PopulationStore of the world,
+    so the store of a loaded world can map them instead of holding its own copy (see map_store_columns).
+    :param world: The World to save
+    :param filepath: The path of the .npz file
+    :param key: The population_key of the world
+    :return: None
+    """
+    environments = world.all_environments
+    env_to_index = {env: index for index, env in enumerate(environments)}
+    city_names = []
+    city_name_to_index = {}
+
+    def city_index(city):
+        if city is None:
+            return -1
+        if city.english_name not in city_name_to_index:
+            city_name_to_index[city.english_name] = len(city_names)
+            city_names.append(city.english_name)
+        return city_name_to_index[city.english_name]
+
+    num_envs = len(environments)
+    env_types = _np.empty(num_envs, dtype=_np.int8)
+    env_ids = _np.empty(num_envs, dtype=_np.int64)
+    env_contact_probs = _np.empty(num_envs, dtype=float)
+    env_cities = _np.empty(num_envs, dtype=_np.int32)
+    env_city_envs = _np.full(num_envs, -1, dtype=_np.int64)
+    env_age_segments = _np.full((num_envs, 2), -1, dtype=_np.int16)
+    env_hood_ids = _np.full(num_envs, -1, dtype=_np.int64)
+    env_full_names = []
+    for index, env in enumerate(environments):
+        env_type = type(env)
+        assert env_type in _ENV_TYPE_TO_CODE, "Can't save environments of type %s" % env_type
+        env_types[index] = _ENV_TYPE_TO_CODE[env_type]
+        env_ids[index] = env._id
+        env_contact_probs[index] = env._contact_prob_between_each_two_people
+        env_cities[index] = city_index(env._city)
+        env_full_names.append(env._full_name)
+        if env_type is not CityCommunity and env._city_env is not None:
+            env_city_envs[index] = env_to_index[env._city_env]
+        if env_type in _AGE_SEGMENTED_ENV_TYPES:
+            env_age_segments[index] = env._age_segment
+        if env_type is NeighborhoodCommunity:
+            env_hood_ids[index] = env.get_neighborhood_id()
+
+    people = world.all_people()
+    num_people = len(people)
+    ages = _np.empty(num_people, dtype=_np.int16)
+    infectiousness = _np.empty(num_people, dtype=float)
+    person_ids = _np.empty(num_people, dtype=_np.int64)
+    neighborhoods = _np.empty(num_people, dtype=_np.int64)
+    person_env_offsets = _np.zeros(num_people + 1, dtype=_np.int64)
+    person_env_ids = []
+    person_env_weights = []
+    state_machine_types = set()
+    for row, person in enumerate(people):
+        assert person.get_disease_state() == DiseaseState.SUSCEPTIBLE and not person.state_to_events, \
+            "Can only save the population before the simulation runs"
+        ages[row] = person.get_age()
+        infectiousness[row] = person._infectiousness_prob
+        person_ids[row] = person.get_id()
+        neighborhood = person.get_neighberhood()
+        neighborhoods[row] = -1 if neighborhood is None else env_to_index[neighborhood]
+        routine = person.get_routine()
+        for env_name, env in person._environments.items():
+            person_env_ids.append(env_to_index[env])
+            person_env_weights.append(routine[env_name])
+        person_env_offsets[row + 1] = len(person_env_ids)
+        state_machine_types.add(person.state_machine_type.name)
+    assert len(state_machine_types) <= 1, "Got people of different state machine types"
+
+    with open(filepath, 'wb') as f:
+        _np.savez(
+            f,
+            version=_np.array(COLUMNAR_CACHE_VERSION),
+            key=_np.array(key),
+            generating_city_name=_np.array(world._generating_city_name),
+            generating_scale=_np.array(world._generating_scale),
+            state_machine_type=_np.array(state_machine_types.pop() if state_machine_types else ""),
+            city_names=_np.array(city_names, dtype=str),
+            env_types=env_types,
+            env_ids=env_ids,
+            env_contact_probs=env_contact_probs,
+            env_cities=env_cities,
+            env_city_envs=env_city_envs,
+            env_age_segments=env_age_segments,
+            env_hood_ids=env_hood_ids,
+            env_full_names=_np.array(env_full_names, dtype=str),
+            ages=ages,
+            infectiousness=infectiousness,
+            person_ids=person_ids,
+            neighborhoods=neighborhoods,
+            person_env_offsets=person_env_offsets,
+            person_env_ids=_np.array(person_env_ids, dtype=_np.int32),
+            person_env_weights=_np.array(person_env_weights, dtype=float),
+        )
+
+
+def read_cache_version_and_key(filepath):
+    """
+    Read only the header of a columnar cache file, without loading its columns
+    :param filepath: The path of the .npz file
+    :return: pair (int version, str population_key of the saved world)
+    """
+    with _np.load(filepath, allow_pickle=False) as columns:
+        return int(columns['version']), str(columns['key'])
+
+
+def load_world_columns(filepath, get_city_by_name):
+    """
+    Build the World that was saved with save_world_columns.
+    The columns are read from the file lazily, one array at a time,
+    and the people are built directly from them, without running the population generation.
+    If the world has a PopulationStore ('use_population_store' in params.json),
+    its static columns are read-only memory maps of the file, shared by all the processes that load it.
+    :param filepath: The path of the .npz file
+    :param get_city_by_name: function from a city name to the City object, see PopulationLoader.get_city_by_name
+    :return: World object
+    """
+    # The loaded objects all stay alive, so the collections triggered by creating them are wasted time
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        world = _build_world(filepath, get_city_by_name)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    if world.get_population_store() is not None:
+        world.get_population_store().share_static_columns(map_store_columns(filepath))
+    return world
+
+
+def map_store_columns(filepath):
+    """
+    :param filepath: The path of a .npz file saved by save_world_columns
+    :return: dict from the name of a static PopulationStore column to a read-only memory map of its array in the file
+    """
+    return {column: _map_array(filepath, name) for column, name in _STORE_COLUMN_TO_ARRAY.items()}
+
+
+def _map_array(filepath, name):
+    """
+    Memory map an array of an uncompressed .npz file (np.load can only map .npy files)
+    :param filepath: The path of the .npz file
+    :param name: The name of the array
+    :return: read-only np.ndarray backed by the file
+    """
+    with zipfile.ZipFile(filepath) as archive:
+        info = archive.getinfo(name + '.npy')
+    assert info.compress_type == zipfile.ZIP_STORED, "Can't map the compressed array '%s'" % name
+    with open(filepath, 'rb') as f:
+        # The .npy file starts after the local file header of the zip entry, and its own name and extra field
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = _np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = _np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = _np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if _np.prod(shape) == 0:
+        return _np.empty(shape, dtype=dtype)
+    return _np.memmap(
+        filepath, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C'
+    ).view(_np.ndarray)
+
+
+def _build_world(filepath, get_city_by_name):
+    """
+    see load_world_columns
+    """
+    with _np.load(filepath, allow_pickle=False) as columns:
+        assert int(columns['version']) == COLUMNAR_CACHE_VERSION, \
+            "Population cache '%s' has a different version" % filepath
+        cities = [get_city_by_name(name) for name in columns['city_names'].tolist()]
+        environments = []
+        for env_type_code, env_id, contact_prob, city_index, age_segment, hood_id, full_name in zip(
+            columns['env_types'].tolist(),
+            columns['env_ids'].tolist(),
+            columns['env_contact_probs'].tolist(),
+            columns['env_cities'].tolist(),
+            columns['env_age_segments'].tolist(),
+            columns['env_hood_ids'].tolist(),
+            columns['env_full_names'].tolist(),
+        ):
+            env_type = _ENV_TYPES[env_type_code]
+            city = None if city_index < 0 else cities[city_index]
+            if env_type in _AGE_SEGMENTED_ENV_TYPES:
+                env = env_type(city, contact_prob, tuple(age_segment), full_name=full_name)
+            else:
+                env = env_type(city, contact_prob)
+            env._id = env_id
+            if env_type is NeighborhoodCommunity:
+                env._hood_id = hood_id
+            environments.append(env)
+        for env, city_env_index in zip(environments, columns['env_city_envs'].tolist()):
+            if city_env_index >= 0:
+                city_env = environments[city_env_index]
+                city_env.add_environment(env)
+                env.set_city_env(city_env)
+
+        state_machine_type_name = str(columns['state_machine_type'])
+        person_state_machine_type = machine_type[state_machine_type_name] if state_machine_type_name else None
+        person_env_offsets = columns['person_env_offsets'].tolist()
+        person_env_ids = columns['person_env_ids'].tolist()
+        person_env_weights = columns['person_env_weights'].tolist()
+        people = []
+        for row, (age, infectiousness_prob, person_id, neighborhood_index) in enumerate(zip(
+            columns['ages'].tolist(),
+            columns['infectiousness'].tolist(),
+            columns['person_ids'].tolist(),
+            columns['neighborhoods'].tolist(),
+        )):
+            start, end = person_env_offsets[row], person_env_offsets[row + 1]
+            person_environments = [environments[env_index] for env_index in person_env_ids[start:end]]
+            person = Person.from_columns(
+                person_id, age, infectiousness_prob, person_state_machine_type,
+                person_environments, person_env_weights[start:end]
+            )
+            person._my_neighborhood = None if neighborhood_index < 0 else environments[neighborhood_index]
+            people.append(person)
+        return World(people, environments, str(columns['generating_city_name']), float(columns['generating_scale']))
@@ -2,8 +2,10 @@ import os
 import pickle
 import logging
 from src.world.population_generation import generate_city, generate_entire_country
-from src.world.city_data import get_city_list_from_dem_xls
+from src.world.city_data import get_city_list_from_dem_xls, get_cities_file_path
 from src.world.population_generation.yomemut import make_city_work_destination_distributions
+from src.world.population_generation.population_cache import save_world_columns, load_world_columns, \
+    read_cache_version_and_key, population_key, COLUMNAR_CACHE_VERSION, COLUMNAR_FORMAT, CACHE_FORMAT_TO_EXTENSION
 from src.simulation.params import Params
 
 log = logging.getLogger(__name__)
@@ -17,21 +19,44 @@ class PopulationLoader(object):
     """
     An object which wraps the generation and caching of World objects.
     """
-    __slots__ = ('m_all_cities','city_smart_scale_to_world', 'output_dir', 'verbosity', 'with_caching', 'added_description')
+    __slots__ = (
+        'm_all_cities', 'cities_file_path', 'key_to_world', 'output_dir', 'verbosity', 'with_caching',
+        'added_description', 'cache_format', 'generation_workers'
+    )
 
-    def __init__(self,filePath, added_description="", with_caching=True, output_dir=OUTPUT_DIR_PATH, verbosity=False):
+    def __init__(self,filePath, added_description="", with_caching=True, output_dir=OUTPUT_DIR_PATH, verbosity=False,
+                 cache_format=COLUMNAR_FORMAT, generation_workers=1):
         """
         :param added_description: A string to concatenate to the end of saved filenames.
+        It is only a label: the cached worlds are told apart by their population_key (see population_cache.py)
         :param with_caching: Should the loader read from files and use internal caching to lower run times
         :param output_dir: The directory of the loaded/saved serialized files
         :param verbosity: Should the world-generation algorithm print debug info
+        :param cache_format: The format of the saved files, either COLUMNAR_FORMAT (arrays in a .npz file,
+        see population_cache.py) or PICKLE_FORMAT (the whole World object pickled)
+        :param generation_workers: The number of processes that generate the cities of the entire country
+        (see generate_entire_country). It doesn't change the generated world, only the time it takes
         """
+        assert cache_format in CACHE_FORMAT_TO_EXTENSION, "Unknown cache format '%s'" % cache_format
         self.m_all_cities = get_city_list_from_dem_xls(filePath)
-        self.city_smart_scale_to_world = {}
+        self.cities_file_path = get_cities_file_path(filePath)
+        self.key_to_world = {}
         self.output_dir = output_dir
         self.verbosity = verbosity
         self.with_caching = with_caching
         self.added_description = added_description
+        self.cache_format = cache_format
+        self.generation_workers = generation_workers
+
+    def _get_key(self, city_name, is_smart, scale):
+        """
+        Gets the population_key of a certain generated World, with the current params
+        :param city_name: The name of the city to generate
+        :param is_smart: Are we using smart generation
+        :param scale: The scale by which to multiply the city size
+        :return: str hex digest, see population_key
+        """
+        return population_key(self.cities_file_path, city_name, is_smart, scale, Params.loader())
 
     def _get_filepath(self, city_name, is_smart, scale):
         """
@@ -43,7 +68,10 @@ class PopulationLoader(object):
         :param scale: The scale by which to multiply the city size
         :return: The path that this serialized file should be saved to
         """
-        filename = "%s_%s_%s_%s%s.pkl" % (OUTPUT_NAME, city_name, is_smart, scale, self.added_description)
+        filename = "%s_%s_%s_%s_%s%s.%s" % (
+            OUTPUT_NAME, city_name, is_smart, scale, self._get_key(city_name, is_smart, scale)[:16],
+            self.added_description, CACHE_FORMAT_TO_EXTENSION[self.cache_format]
+        )
         return os.path.join(self.output_dir, filename)
 
     def _save_to_file(self, world, is_smart):
@@ -54,12 +82,16 @@ class PopulationLoader(object):
         :return: None
         """
         filepath = self._get_filepath(world._generating_city_name, is_smart, world._generating_scale)
+        key = self._get_key(world._generating_city_name, is_smart, world._generating_scale)
         assert not os.path.exists(filepath), "File '%s' already exists!" % filepath
         log.info("Saving the new results to {} ...".format(filepath))
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
+        if self.cache_format == COLUMNAR_FORMAT:
+            save_world_columns(world, filepath, key)
+            return
         with open(filepath, 'wb') as f:
-            pickle.dump((world, Params.loader()), f)
+            pickle.dump((world, key), f)
 
     def _save_on_me(self, world, is_smart):
         """
@@ -68,21 +100,9 @@ class PopulationLoader(object):
         :param is_smart: Was the world generated using smart world generation
         :return: None
         """
-        tup = (world._generating_city_name, is_smart, world._generating_scale)
-        assert tup not in self.city_smart_scale_to_world, "Dumping an existent city"
-        self.city_smart_scale_to_world[tup] = (world, Params.loader())
-
-    @staticmethod
-    def assert_params_are_valid(params):
-        """
-        Makes sure the params that appear in a serialized file are the same as
-        the current ones we are using
-        (otherwise there will be compatibility errors)
-        :param params: The params that should be checked against the curret ones
-        :return: None (throws an exception of it does not hold)
-        """
-        assert params == Params.loader(), \
-            "Trying to load a file corresponding to different params!"
+        key = self._get_key(world._generating_city_name, is_smart, world._generating_scale)
+        assert key not in self.key_to_world, "Dumping an existent city"
+        self.key_to_world[key] = world
 
     def try_deserialize(self, city_name, is_smart, scale):
         """
@@ -95,10 +115,20 @@ class PopulationLoader(object):
         filepath = self._get_filepath(city_name, is_smart, scale)
         if not os.path.exists(filepath):
             return None
+        key = self._get_key(city_name, is_smart, scale)
+        if self.cache_format == COLUMNAR_FORMAT:
+            version, saved_key = read_cache_version_and_key(filepath)
+            if version != COLUMNAR_CACHE_VERSION:
+                log.info("Removing '{}' which was saved by another version of the population cache".format(filepath))
+                os.remove(filepath)
+                return None
+            assert saved_key == key, "Trying to load a file corresponding to a different population!"
+            log.info("Loading data")
+            return load_world_columns(filepath, self.get_city_by_name)
         with open(filepath, 'rb') as f:
             log.info("Loading data")
-            world, params = pickle.load(f)
-            self.assert_params_are_valid(params)
+            world, saved_key = pickle.load(f)
+            assert saved_key == key, "Trying to load a file corresponding to a different population!"
             return world
 
     def try_load(self, city_name, is_smart, scale):
@@ -109,16 +139,16 @@ class PopulationLoader(object):
         :param scale: The scale by which to multiply the city size
         :return: Either a loaded World or None if there was no cached/saved version
         """
-        tup = (city_name, is_smart, scale)
-        if tup in self.city_smart_scale_to_world:
-            world, params = self.city_smart_scale_to_world[tup]
-            self.assert_params_are_valid(params)
-            return world
-        ret = self.try_deserialize(city_name, is_smart, scale)
-        if ret is None:
-            return None
-        world = ret
-        self._save_on_me(world, is_smart)
+        key = self._get_key(city_name, is_smart, scale)
+        if key in self.key_to_world:
+            world = self.key_to_world[key]
+        else:
+            world = self.try_deserialize(city_name, is_smart, scale)
+            if world is None:
+                return None
+            self._save_on_me(world, is_smart)
+        # The world may have been cached with other values of the params that aren't part of its key
+        world.load_runtime_params()
         return world
 
     def get_city_by_name(self, city_name):
@@ -172,7 +202,7 @@ class PopulationLoader(object):
         if city_name == 'all':
             city_list = self.get_all_large_enough_cities(scale)
             world = generate_entire_country(
-                city_list, is_smart, scale, verbosity=self.verbosity
+                city_list, is_smart, scale, verbosity=self.verbosity, num_workers=self.generation_workers
             )
             log.info("Generated a total of %d people in %d environments" % (len(world.all_people()), len(world.all_environments)))
         else:
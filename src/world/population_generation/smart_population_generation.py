@@ -4,6 +4,7 @@
 # validates the output and wraps it to the needed format,
 
 from src.world.population_generation.household_generation import sim_houses
+from src.world.population_generation.vectorized_household_generation import sim_houses_vectorized
 
 from src.world.city_data import City
 from src.world import Person
@@ -50,7 +51,7 @@ def generate_all_households_and_communities_of_city_smart(city, scaling=1.0, ver
     if verbosity:
         print("Generating city '%s'" % city.english_name)
     # Calling the actual code that generates houses
-    households_ages = sim_houses(
+    households_ages = (sim_houses_vectorized if params['vectorized_household_generation'] else sim_houses)(
         city.age_data,
         city.household_size_data,
         city.percentage_of_households_with_65_plus,
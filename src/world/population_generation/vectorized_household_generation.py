@@ -0,0 +1,211 @@
+# This code is a vectorized alternative to sim_houses (see household_generation.py).
+# It starts from the same counters (get_household_counters), but instead of building the households
+# one at a time with retry loops, it decides the composition of all the households together
+# and then deals the ages out of the counters in bulk:
+# 1. The household sizes are exactly the counted sizes, in a random order.
+# 2. Households of a large enough size are drawn for each count of people over 65.
+# 3. Households with exactly room for a single parent and k children are drawn as single parent households,
+#    then the rest of the households with children are drawn among the ones with room for two parents
+#    (households of 6 or more first, as in sim_houses). The children of these households are then balanced
+#    against the number of children in the counters, turning children into grown-up children or
+#    second parents into children.
+# 4. The ages of each group (children, people over 65, grown-up children, adults) are taken out of
+#    the counters of that group, so the age distribution is the counted one whenever the groups add up.
+#    Children and people over 65 are dealt in (almost) sorted blocks, so the people in a household are close in age.
+#    Each parent wants an age 20-40 years older than the oldest child of the household, and the parents are dealt
+#    the adult ages closest to the wanted ones (matching the counts of each age, not one parent at a time).
+
+import numpy as _np
+
+from src.world.population_generation.household_generation import get_household_counters
+
+CHILD_MAX_AGE = 17
+OLD_MIN_AGE = 65
+# The ages of the adult children that live with their parents, like the extra adults of sim_houses
+GROWN_UP_CHILD_MAX_AGE = 25
+# The age difference between the youngest parent and the oldest child, like in sim_houses
+MIN_PARENT_AGE_GAP = 20
+MAX_PARENT_AGE_GAP = 40
+# The parents of a household are dealt ages that are about this many years apart at most
+PARTNERS_AGE_SPREAD = 5
+# The children of a household are dealt ages that are about this many years apart at most
+SIBLINGS_AGE_SPREAD = 8
+# sim_houses assumes all the households of this size or more have children
+LARGE_HOUSEHOLD_SIZE = 6
+
+
+def sim_houses_vectorized(age_distrib, house_size_distrib, percentage_65, percentage_child, org_n_house, tot_pop,
+                          perc_sing_house, perc_sing_child, child_per_house=None):
+    """
+    Simulate the households of a city, with the same parameters and output as sim_houses.
+    Uses the numpy random generator.
+    :param age_distrib: list of triplets (percentage, min_age, max_age (not inclusive))
+    :param house_size_distrib: list of probs of house size (first is zero), last is probability of that size or more
+    :param percentage_65: percentage of households with someone over 65
+    :param percentage_child: percentage of households with someone under 18
+    :param org_n_house: number of households
+    :param tot_pop: total population
+    :param perc_sing_house: percentage of single parent house (out of house with children)
+    :param perc_sing_child: percentage of children that live in single parent home
+    :param child_per_house: distribution of number of children in households with children (unused, as in sim_houses)
+    :return: list of households, each a list of the ages of its members
+    """
+    [rem_ages, rem_65, rem_child, rem_sing, rem_sizes] = get_household_counters(
+        age_distrib, house_size_distrib, percentage_65, percentage_child, org_n_house, tot_pop,
+        perc_sing_house, perc_sing_child
+    )
+    sizes = _np.random.permutation(_np.repeat(_np.arange(len(rem_sizes)), rem_sizes))
+    sizes = sizes[sizes > 0]
+    num_houses = len(sizes)
+    ages = _np.repeat(_np.arange(len(rem_ages)), rem_ages)
+
+    num_old = _draw_num_old(sizes, rem_65)
+    num_children, num_parents, num_grown_up = _draw_num_children(
+        sizes, sizes - num_old, rem_child[1], rem_sing, int(_np.count_nonzero(ages <= CHILD_MAX_AGE))
+    )
+    num_other_adults = sizes - num_old - num_children - num_parents - num_grown_up
+
+    children = _take(ages[ages <= CHILD_MAX_AGE], num_children.sum(), ages)[0]
+    children = children[_np.argsort(children + _np.random.uniform(0, SIBLINGS_AGE_SPREAD, len(children)))]
+    children_houses = _deal_sorted_blocks(_np.random.permutation(_np.flatnonzero(num_children)), num_children)
+    oldest_child = _np.full(num_houses, -1)
+    _np.maximum.at(oldest_child, children_houses, children)
+
+    old = _np.sort(_take(ages[ages >= OLD_MIN_AGE], num_old.sum(), ages)[0])
+    old_houses = _deal_sorted_blocks(_np.random.permutation(_np.flatnonzero(num_old)), num_old)
+
+    adult_ages = ages[(ages > CHILD_MAX_AGE) & (ages < OLD_MIN_AGE)]
+    is_young_adult = adult_ages <= GROWN_UP_CHILD_MAX_AGE
+    # The grown-up children are taken out of the young adults, the rest are dealt to the parents and other adults
+    grown_up, young_adults_left = _take(adult_ages[is_young_adult], num_grown_up.sum(), adult_ages)
+    grown_up_houses = _np.repeat(_np.arange(num_houses), num_grown_up)
+    adults = _take(
+        _np.concatenate([young_adults_left, adult_ages[~is_young_adult]]), (num_parents + num_other_adults).sum(), ages
+    )[0]
+    available = _np.bincount(adults, minlength=len(rem_ages))
+    # The parents are dealt the available ages closest to the ones they want by their oldest child
+    parent_houses = _np.repeat(_np.arange(num_houses), num_parents)
+    wanted_ages = oldest_child + _np.random.uniform(MIN_PARENT_AGE_GAP, MAX_PARENT_AGE_GAP, num_houses)
+    wanted_ages = wanted_ages[parent_houses] + _np.random.uniform(
+        -PARTNERS_AGE_SPREAD / 2, PARTNERS_AGE_SPREAD / 2, len(parent_houses))
+    wanted_ages = _np.clip(_np.rint(wanted_ages).astype(int), CHILD_MAX_AGE + 1, OLD_MIN_AGE - 1)
+    parent_counts = _choose_closest_counts(_np.bincount(wanted_ages, minlength=len(rem_ages)), available)
+    parents = _np.repeat(_np.arange(len(rem_ages)), parent_counts)
+    parent_houses = parent_houses[_np.argsort(wanted_ages, kind='stable')]
+    # The rest of the adults are dealt in sorted blocks, so adults that live together are close in age
+    others = _np.repeat(_np.arange(len(rem_ages)), available - parent_counts)
+    other_houses = _deal_sorted_blocks(_np.random.permutation(_np.flatnonzero(num_other_adults)), num_other_adults)
+
+    person_houses = _np.concatenate([children_houses, old_houses, parent_houses, other_houses, grown_up_houses])
+    person_ages = _np.concatenate([children, old, parents, others, grown_up])
+    order = _np.argsort(person_houses, kind='stable')
+    person_ages = person_ages[order].tolist()
+    offsets = _np.concatenate([[0], _np.cumsum(_np.bincount(person_houses, minlength=num_houses))]).tolist()
+    return [person_ages[offsets[house]:offsets[house + 1]] for house in range(num_houses)]
+
+
+def _draw_num_old(sizes, rem_65):
+    """
+    Draw the number of people over 65 in each household, so there are rem_65[k] households with k of them
+    (as long as there are enough households of size k or more)
+    :param sizes: np.ndarray of the household sizes
+    :param rem_65: the counter of households by the number of people over 65 in them
+    :return: np.ndarray of the number of people over 65 in each household
+    """
+    num_old = _np.zeros(len(sizes), dtype=int)
+    for k in range(len(rem_65) - 1, 0, -1):
+        eligible = _np.flatnonzero((num_old == 0) & (sizes >= k))
+        chosen = _np.random.choice(eligible, min(rem_65[k], len(eligible)), replace=False)
+        num_old[chosen] = k
+    return num_old
+
+
+def _draw_num_children(sizes, room, num_child_houses, rem_sing, num_children_wanted):
+    """
+    Draw the households with children and the number of children, parents and grown-up children in each
+    :param sizes: np.ndarray of the household sizes
+    :param room: np.ndarray of the number of people under 65 each household has room for
+    :param num_child_houses: the number of households with children
+    :param rem_sing: the counter of single parent households by their number of children
+    :param num_children_wanted: the number of children in the population
+    :return: tuple of np.ndarray-s (number of children, number of parents, number of grown-up children)
+    """
+    num_houses = len(sizes)
+    num_children = _np.zeros(num_houses, dtype=int)
+    num_parents = _np.zeros(num_houses, dtype=int)
+    for k in range(1, len(rem_sing)):
+        eligible = _np.flatnonzero((num_parents == 0) & (room == k + 1))
+        chosen = _np.random.choice(eligible, min(rem_sing[k], len(eligible)), replace=False)
+        num_children[chosen] = k
+        num_parents[chosen] = 1
+    num_two_parent_houses = max(num_child_houses - int(_np.count_nonzero(num_parents)), 0)
+    eligible = _np.flatnonzero((num_parents == 0) & (room >= 3))
+    is_large = sizes[eligible] >= LARGE_HOUSEHOLD_SIZE
+    large, rest = _np.random.permutation(eligible[is_large]), eligible[~is_large]
+    two_parent_houses = _np.concatenate([
+        large[:num_two_parent_houses],
+        _np.random.choice(rest, min(max(num_two_parent_houses - len(large), 0), len(rest)), replace=False)
+    ]).astype(int)
+    num_children[two_parent_houses] = room[two_parent_houses] - 2
+    num_parents[two_parent_houses] = 2
+
+    num_grown_up = _np.zeros(num_houses, dtype=int)
+    num_extra_children = int(num_children.sum()) - num_children_wanted
+    if num_extra_children > 0:
+        # The oldest children of two parent households are grown-ups, keeping at least one child in each
+        units = _np.repeat(two_parent_houses, num_children[two_parent_houses] - 1)
+        grown_up = _np.random.choice(units, min(num_extra_children, len(units)), replace=False)
+        num_grown_up = _np.bincount(grown_up, minlength=num_houses)
+        num_children -= num_grown_up
+    elif num_extra_children < 0:
+        # Some two parent households are single parent households with another child
+        single = _np.random.choice(two_parent_houses, min(-num_extra_children, len(two_parent_houses)), replace=False)
+        num_children[single] += 1
+        num_parents[single] -= 1
+    return num_children, num_parents, num_grown_up
+
+
+def _choose_closest_counts(wanted, available):
+    """
+    Choose people out of the available ones, with ages as close as possible to the wanted ones
+    :param wanted: np.ndarray of the number of wanted people of each age
+    :param available: np.ndarray of the number of available people of each age
+    :return: np.ndarray of the number of chosen people of each age,
+    which sums to the number of wanted people (if there are enough available ones)
+    """
+    chosen = _np.minimum(wanted, available)
+    missing = wanted - chosen
+    for age in _np.flatnonzero(missing):
+        for distance in range(1, len(wanted)):
+            for other_age in (age - distance, age + distance):
+                if 0 <= other_age < len(wanted) and missing[age]:
+                    taken = min(missing[age], available[other_age] - chosen[other_age])
+                    chosen[other_age] += taken
+                    missing[age] -= taken
+            if not missing[age]:
+                break
+    return chosen
+
+
+def _take(pool, n, fallback):
+    """
+    Take n random ages out of a pool of ages
+    :param pool: np.ndarray of ages
+    :param n: the number of ages to take. If the pool is too small, the missing ages are sampled from it
+    (or from fallback, if it is empty)
+    :param fallback: np.ndarray of ages to sample from if the pool is empty
+    :return: pair of np.ndarray-s (the n ages in a random order, the ages left in the pool)
+    """
+    pool = _np.random.permutation(pool)
+    if n <= len(pool):
+        return pool[:n], pool[n:]
+    return _np.concatenate([pool, _np.random.choice(pool if len(pool) else fallback, n - len(pool))]), pool[:0]
+
+
+def _deal_sorted_blocks(houses_in_order, counts):
+    """
+    :param houses_in_order: np.ndarray of households, in the order they are dealt sorted ages
+    :param counts: np.ndarray of the number of ages each household gets (by household)
+    :return: np.ndarray of the household of each of the sorted ages
+    """
+    return _np.repeat(houses_in_order, counts[houses_in_order])
@@ -0,0 +1,317 @@
+import numpy as _np
+
+from src.seir import DiseaseState
+from src.world.person import Person
+
+# The Person slots that are kept in the PopulationStore columns instead of on the person itself
+COLUMN_SLOTS = ('_age', '_infectiousness_prob', '_disease_state', '_environments', '_current_routine')
+# The PopulationStore columns that don't change during the simulation, see PopulationStore.share_static_columns
+STATIC_COLUMNS = ('ages', 'infectiousness', 'env_offsets', 'env_ids')
+
+# DiseaseState by its value, to decode the disease state column without calling the Enum constructor
+_STATE_BY_VALUE = [None] + [DiseaseState(value) for value in range(1, DiseaseState.IMMUNE.value + 1)]
+
+
+class PopulationStore(object):
+    """
+    Columnar (struct-of-arrays) storage of the people of a World.
+    Row i of every column describes the person self.people[i].
+    The environments of the person in row i are self.environments[env_ids[j]]
+    for j in range(env_offsets[i], env_offsets[i + 1]), and their routine weights are routine_weights[j].
+    Attaching people to the store turns them into StoredPerson objects,
+    which read and write their age, infectiousness, disease state, environments and routine from their row.
+    This saves most of the memory of a Person, and makes bulk operations array operations.
+    """
+    __slots__ = (
+        'people',
+        'ages',
+        'infectiousness',
+        'disease_states',
+        'environments',
+        'env_offsets',
+        'env_ids',
+        'routine_weights'
+    )
+
+    def __init__(self, people, environments=None):
+        """
+        Build the columns from the given people and attach the people to the store.
+        :param people: list of Person objects which are not attached to any store yet
+        :param environments: optional list of the environments, to fix the order of self.environments
+        (and so the values of env_ids). Environments that aren't in it are added in the order they are met.
+        """
+        self.people = list(people)
+        num_people = len(self.people)
+        self.ages = _np.empty(num_people, dtype=_np.int16)
+        self.infectiousness = _np.empty(num_people, dtype=float)
+        self.disease_states = _np.empty(num_people, dtype=_np.int8)
+        self.env_offsets = _np.zeros(num_people + 1, dtype=_np.int64)
+        self.environments = [] if environments is None else list(environments)
+        env_to_index = {env: index for index, env in enumerate(self.environments)}
+        env_ids = []
+        routine_weights = []
+        for row, person in enumerate(self.people):
+            assert type(person) is Person, "Person {} is already attached to a store".format(person.get_id())
+            self.ages[row] = person._age
+            self.infectiousness[row] = person._infectiousness_prob
+            self.disease_states[row] = person._disease_state.value
+            for env_name, env in person._environments.items():
+                if env not in env_to_index:
+                    env_to_index[env] = len(self.environments)
+                    self.environments.append(env)
+                env_ids.append(env_to_index[env])
+                routine_weights.append(person._current_routine[env_name])
+            self.env_offsets[row + 1] = len(env_ids)
+        self.env_ids = _np.array(env_ids, dtype=_np.int32)
+        self.routine_weights = _np.array(routine_weights, dtype=float)
+        for row, person in enumerate(self.people):
+            self._attach(person, row)
+
+    def _attach(self, person, row):
+        """
+        Turn the given Person into a StoredPerson that reads its data from the given row.
+        StoredPerson adds no slots to Person, so the person can change its class in place
+        (and whoever references it keeps the same object). The properties of StoredPerson shadow the Person slots
+        of the columns, so the values in these slots would never be read again, and are deleted to free them.
+        """
+        for name in COLUMN_SLOTS:
+            # The slot itself, since the person's attribute of the same name is a property once it's a StoredPerson
+            _PERSON_SLOTS[name].__delete__(person)
+        person._store = self
+        person._row = row
+        person.__class__ = StoredPerson
+
+    def detach(self):
+        """
+        Turn the people of the store back into regular Person objects with the data of their rows,
+        the opposite of _attach. The store shouldn't be used afterwards.
+        """
+        for person in self.people:
+            values = [getattr(person, name) for name in COLUMN_SLOTS]
+            person.__class__ = Person
+            for name, value in zip(COLUMN_SLOTS, values):
+                setattr(person, name, value)
+            person._store = None
+            person._row = None
+
+    def __len__(self):
+        return len(self.people)
+
+    def share_static_columns(self, columns):
+        """
+        Replace the columns that don't change during the simulation (see STATIC_COLUMNS)
+        by the given arrays with the same contents. These are typically read-only memory maps of the population
+        cache file (see population_cache.map_store_columns), so all the processes that load the same population
+        share a single copy of them, and only allocate the columns that the simulation changes.
+        :param columns: dict from a name in STATIC_COLUMNS to the array to use
+        """
+        for name in STATIC_COLUMNS:
+            column, current_column = columns[name], getattr(self, name)
+            assert column.dtype == current_column.dtype and _np.array_equal(column, current_column), \
+                "Column '{}' doesn't match the people of the store".format(name)
+            setattr(self, name, column)
+
+    def get_environments(self, row):
+        """
+        :param row: int row of a person
+        :return: dict from environment name to the environment, for the person in the given row
+        """
+        environments = self.environments
+        return {
+            environments[env_id].name: environments[env_id]
+            for env_id in self.env_ids[self.env_offsets[row]:self.env_offsets[row + 1]]
+        }
+
+    def find_environment(self, row, name):
+        """
+        :param row: int row of a person
+        :param name: str environment name
+        :return: the environment of the person in the given row with the given name, or None if there isn't one
+        """
+        environments = self.environments
+        for env_id in self.env_ids[self.env_offsets[row]:self.env_offsets[row + 1]].tolist():
+            if environments[env_id].name == name:
+                return environments[env_id]
+        return None
+
+    def iter_routine(self, row):
+        """
+        :param row: int row of a person
+        :return: iterator of pairs of (environment, its routine weight), for the person in the given row
+        """
+        start, end = self.env_offsets[row], self.env_offsets[row + 1]
+        environments = self.environments
+        return zip(
+            [environments[env_id] for env_id in self.env_ids[start:end].tolist()],
+            self.routine_weights[start:end].tolist()
+        )
+
+    def add_environment(self, row, environment, weight=1):
+        """
+        Add an environment to the person in the given row, see Person.add_environment.
+        Copies the environment columns, so this should only be called when generating a population.
+        :param row: int row of a person
+        :param environment: Environment the person doesn't have yet
+        :param weight: its routine weight
+        """
+        if environment in self.environments:
+            env_id = self.environments.index(environment)
+        else:
+            env_id = len(self.environments)
+            self.environments.append(environment)
+        end = self.env_offsets[row + 1]
+        self.env_ids = _np.insert(self.env_ids, end, env_id)
+        self.routine_weights = _np.insert(self.routine_weights, end, weight)
+        # A copy, since the offsets may be a read-only memory map (see share_static_columns)
+        env_offsets = self.env_offsets.copy()
+        env_offsets[row + 1:] += 1
+        self.env_offsets = env_offsets
+
+    def get_routine(self, row):
+        """
+        :param row: int row of a person
+        :return: dict from environment name to its weight, for the person in the given row
+        """
+        start, end = self.env_offsets[row], self.env_offsets[row + 1]
+        environments = self.environments
+        return {
+            environments[env_id].name: weight
+            for env_id, weight in zip(self.env_ids[start:end].tolist(), self.routine_weights[start:end].tolist())
+        }
+
+    def set_routine(self, row, routine):
+        """
+        :param row: int row of a person
+        :param routine: dict from environment name to its weight, must have all of the person's environments
+        """
+        start, end = self.env_offsets[row], self.env_offsets[row + 1]
+        assert len(routine) == end - start, "Routine {} doesn't match the person's environments".format(routine)
+        for j in range(start, end):
+            self.routine_weights[j] = routine[self.environments[self.env_ids[j]].name]
+
+    def count_by_disease_state(self):
+        """
+        :return: dict from DiseaseState to the number of people in it
+        """
+        counts = _np.bincount(self.disease_states, minlength=len(_STATE_BY_VALUE))
+        return {state: int(counts[state.value]) for state in DiseaseState}
+
+    def get_people_by_age(self, min_age, max_age):
+        """
+        :param min_age: int, inclusive
+        :param max_age: int, inclusive
+        :return: list of the people whose age is within the given range
+        """
+        rows = _np.flatnonzero((self.ages >= min_age) & (self.ages <= max_age))
+        return [self.people[row] for row in rows]
+
+
+_PERSON_SLOTS = {name: Person.__dict__[name] for name in Person.__slots__}
+
+
+class StoredPerson(Person):
+    """
+    A Person whose columnar data lives in a PopulationStore row (see COLUMN_SLOTS).
+    It has the same memory layout as Person (people become StoredPerson when attached to a store),
+    and the properties below shadow the matching Person slots.
+    """
+    __slots__ = ()
+
+    @property
+    def _age(self):
+        return int(self._store.ages[self._row])
+
+    @_age.setter
+    def _age(self, value):
+        self._store.ages[self._row] = value
+
+    @property
+    def _infectiousness_prob(self):
+        return float(self._store.infectiousness[self._row])
+
+    @_infectiousness_prob.setter
+    def _infectiousness_prob(self, value):
+        self._store.infectiousness[self._row] = value
+
+    @property
+    def _disease_state(self):
+        return _STATE_BY_VALUE[self._store.disease_states[self._row]]
+
+    @_disease_state.setter
+    def _disease_state(self, value):
+        self._store.disease_states[self._row] = value.value
+
+    @property
+    def _environments(self):
+        return self._store.get_environments(self._row)
+
+    @property
+    def _current_routine(self):
+        return self._store.get_routine(self._row)
+
+    @_current_routine.setter
+    def _current_routine(self, value):
+        self._store.set_routine(self._row, value)
+
+    def add_environment(self, environment):
+        assert not self.has_environment(environment.name), \
+            "Person {} already has a '{}' environment".format(self._id, environment.name)
+        if environment.name == "neighborhood_community":
+            self._my_neighborhood = environment
+        self._store.add_environment(self._row, environment)
+        self._change()
+
+    def iter_routine(self):
+        return self._store.iter_routine(self._row)
+
+    def get_environment(self, name):
+        environment = self._store.find_environment(self._row, name)
+        assert environment is not None, "Unknown environment: '%s'" % name
+        return environment
+
+    def has_environment(self, name):
+        return self._store.find_environment(self._row, name) is not None
+
+    def to_person(self):
+        """
+        :return: a regular Person with the same data, which isn't attached to the store
+        """
+        new_person = Person.__new__(Person)
+        for name, slot in _PERSON_SLOTS.items():
+            if name in COLUMN_SLOTS:
+                slot.__set__(new_person, getattr(self, name))
+            else:
+                try:
+                    slot.__set__(new_person, slot.__get__(self))
+                except AttributeError:
+                    pass
+        new_person._store = None
+        new_person._row = None
+        return new_person
+
+    def make_eventless_copy(self):
+        """
+        make a copy of this person without any events or routine changes, see Person.make_eventless_copy.
+        The copy is a regular Person, so changing it doesn't change this person's row.
+        """
+        new_person = self.to_person()
+        new_person.state_to_events = {}
+        new_person.routine_change_multiplicities = {}
+        new_person.routine_changes = {}
+        new_person._policy_group = 0
+        return new_person
+
+    def __getstate__(self):
+        # The columns are pickled with the store itself
+        state = {}
+        for name, slot in _PERSON_SLOTS.items():
+            if name not in COLUMN_SLOTS:
+                try:
+                    state[name] = slot.__get__(self)
+                except AttributeError:
+                    pass
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            _PERSON_SLOTS[name].__set__(self, value)
@@ -1,9 +1,25 @@
+from src.simulation.params import Params
+from src.world.population_store import PopulationStore
+from src.world.policies import PolicyMultipliers
+
+
 
 class World(object):
     """
     The World class holds all the people and their environments for the simulation.
     """
-    __slots__ = ('_people_dict', 'all_environments', '_city_name_to_env', '_generating_city_name', '_generating_scale')
+    __slots__ = (
+        '_people_dict',
+        'all_environments',
+        '_city_name_to_env',
+        '_generating_city_name',
+        '_generating_scale',
+        '_changed_people',
+        '_active_environments',
+        '_population_store',
+        '_policies',
+        '_vectorized_min_env_size'
+    )
 
     def __init__(self, all_people, all_environments, generating_city_name, generating_scale):
         """
@@ -16,11 +32,38 @@ class World(object):
         and all the environments shrinks as well.
         """
         self._people_dict = {p.get_id(): p for p in all_people}
+        self._population_store = None
         self.all_environments = all_environments
+        self._policies = PolicyMultipliers()
+        self.load_runtime_params()
+        # The people whose state changed since the end of the last simulated day.
+        # A dict (rather than a set) so the iteration order is deterministic.
+        self._changed_people = {}
+        for person in self._people_dict.values():
+            person._world = self
+            if person._changed:
+                self._changed_people[person] = None
+        self._bind_environments()
         self._init_city_name_to_env_dict()
         self._generating_city_name = generating_city_name.lower()
         self._generating_scale = generating_scale
 
+    def load_runtime_params(self):
+        """
+        Apply the params that change how this world is stored and simulated, but not the world itself,
+        so a world that was generated (and cached, see population_key) with other values of them can be reused:
+        'use_population_store' in the 'population' section, and the 'infection_propagation' section,
+        which is read once here instead of on every propagate_infection of every environment
+        """
+        use_population_store = Params.loader()['population']['use_population_store']
+        if use_population_store and self._population_store is None:
+            self._population_store = PopulationStore(self._people_dict.values(), self.all_environments)
+        elif not use_population_store and self._population_store is not None:
+            self._population_store.detach()
+            self._population_store = None
+        params = Params.loader()['infection_propagation']
+        self._vectorized_min_env_size = params['vectorized_min_env_size'] if params['vectorized'] else None
+
     def _init_city_name_to_env_dict(self):
         """
         Save all the city environments by the city name
@@ -32,6 +75,60 @@ class World(object):
                 assert name not in self._city_name_to_env, "Got the city '%s' multiple times!" % name
                 self._city_name_to_env[name] = env
 
+    def _bind_environments(self):
+        """
+        Make all the environments report their activity to this world,
+        and collect the ones that are already active.
+        The environments may be shared with another World (see InitialStateSimulation),
+        so this is done again whenever people sign up to them.
+        """
+        self._active_environments = {}
+        for env in self.all_environments:
+            env._world = self
+            if env.is_active():
+                self._active_environments[env] = None
+
+    def set_environment_activity(self, env, is_active):
+        """
+        Called by an environment when it gains its first infectious member or loses its last one
+        :param env: Environment
+        :param is_active: bool, whether the environment is now active
+        """
+        if is_active:
+            self._active_environments[env] = None
+        else:
+            self._active_environments.pop(env, None)
+
+    def get_active_environments(self):
+        """
+        return the environments in which someone might get infected today
+        :return: list of Environment
+        """
+        return list(self._active_environments)
+
+    def get_population_store(self):
+        """
+        return the columnar store of the people of this world,
+        or None if 'use_population_store' is off in params.json
+        :return: PopulationStore or None
+        """
+        return self._population_store
+
+    def get_vectorized_min_env_size(self):
+        """
+        return the size from which the environments draw their infections with one vectorized call
+        (see HomogeneousEnvironment.propagate_infection), or None if the vectorized draw is off in params.json
+        :return: int or None
+        """
+        return self._vectorized_min_env_size
+
+    def get_policies(self):
+        """
+        return the policies of the timed interventions on this world, and the groups of people that follow them
+        :return: PolicyMultipliers
+        """
+        return self._policies
+
     def get_city_community(self, city_name):
         """
         :param city_name: str city name
@@ -47,9 +144,51 @@ class World(object):
         The registration happens according to the person's routine
         This is needed for the infection to spread.
         """
+        self._bind_environments()
         for person in self.all_people():
             person.register_to_daily_environments()
 
+    def reset(self):
+        """
+        Bring the world back to the state it had before any simulation ran on it,
+        so it can be reused for another simulation instead of being generated or loaded again:
+        all the people are susceptible again, and all the environments are empty.
+        """
+        for env in self.all_environments:
+            env.reset()
+        for person in self._people_dict.values():
+            person.reset()
+        self._policies.reset()
+        # The world may be reused with other params, see load_reusable_world
+        self.load_runtime_params()
+        self._changed_people = {person: None for person in self._people_dict.values()}
+        self._bind_environments()
+
+    def mark_changed(self, person):
+        """
+        Add the given person to the people that changed today.
+        Called by the person itself, see Person._change
+        :param person: Person
+        """
+        self._changed_people[person] = None
+
+    def get_changed_people(self):
+        """
+        return the people that changed since the last call to clear_changed_people,
+        without scanning the entire population
+        :return: list of Person
+        """
+        return list(self._changed_people)
+
+    def clear_changed_people(self):
+        """
+        Save the state of all the changed people and forget about them,
+        so the next day starts with no changed people
+        """
+        for person in self._changed_people:
+            person.save_state()
+        self._changed_people = {}
+
     def get_all_city_communities(self):
         """
         return all the city environments in the world
@@ -3,7 +3,7 @@ import json
 from collections import Counter
 
 from src.run_utils import INITIAL_DATE
-from src.seir import DiseaseState, disease_state,sample_seir_times,RealDataSeirTimesGeneration,SIRS
+from src.seir import DiseaseState, disease_state,sample_seir_times,RealDataSeirTimesGeneration,SIRS,SeirTimesCache
 from src.simulation.params import Params
 from src.world import Person
 from src.world.environments import InitialGroup
@@ -208,4 +208,44 @@ def test_SIRS_second_infection():
     p.set_disease_state(DiseaseState.SUSCEPTIBLE)
     event_lst2 = p.infect_and_get_events(INITIAL_DATE,InitialGroup.initial_group())
     assert not (event_lst == event_lst2)
-    
\ No newline at end of file
+    
+
+
+def test_batch_sampled_seir_times():
+    """
+    Tests that the batch sampled courses follow the same distribution as the ones sampled one by one
+    """
+    #Pretest
+    Params.clean()
+    RealDataSeirTimesGeneration.clean()
+
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+
+    curr_machine_type = machine_type["SIR"]
+    p = Person(75)
+    num_samples = 20000
+    paths = []
+    mean_latent_days = []
+    for batch_sampling in [False, True]:
+        Params.loader()["seir_times_sampling"]["batch_sampling"] = batch_sampling
+        path_counter = Counter()
+        latent_days = 0
+        for _ in range(num_samples):
+            table = sample_seir_times(curr_machine_type, p)
+            assert table[0][0] == DiseaseState.LATENT
+            assert table[-1][1] is None
+            path_counter[tuple(state for state, _ in table)] += 1
+            latent_days += table[0][1].days
+        paths.append(path_counter)
+        mean_latent_days.append(latent_days / num_samples)
+    Params.loader()["seir_times_sampling"]["batch_sampling"] = False
+    assert SeirTimesCache.singleton is not None
+
+    assert set(paths[1]) == set(paths[0])
+    for path, count in paths[0].items():
+        assert abs(count - paths[1][path]) < 0.05 * num_samples
+    assert abs(mean_latent_days[0] - mean_latent_days[1]) < 0.2
@@ -1,12 +1,15 @@
 from datetime import date
 import json
+import numpy as np
 from numpy.lib.function_base import median
 import os
 import random
+from math import exp
 
 from src.simulation.params import Params
 from src.seir.disease_state import DiseaseState
 from src.world.person import Person
+from src.world import World
 from src.world.population_generation import population_loader
 from src.world.environments.homogeneous_environment import HomogeneousEnvironment
 from src.world.environments import NeighborhoodCommunity
@@ -121,4 +124,69 @@ def test_neiborhoods_diff_IDs():
     for env in my_world.all_environments:
         if env.name == "neighborhood_community":
             sample.append(env)
-    assert not(sample[0].get_neighborhood_id() == sample[1].get_neighborhood_id())
\ No newline at end of file
+    assert not(sample[0].get_neighborhood_id() == sample[1].get_neighborhood_id())
+
+def test_vectorized_propagate_infection_matches_loop(params_path):
+    """
+    Tests that the vectorized infection draw infects each person as often as the original per-person loop,
+    for the same environment, and that both are reproduced by random.seed
+    """
+    Params.load_from(params_path)
+    DiseaseState.init_infectiousness_list()
+    contact_prob = 0.2
+    num_of_people = 600
+    num_of_infectious = 30
+    loops = 200
+    weight_list = [max(0.3, random.random()) for _ in range(num_of_people)]
+    people = [Person(random.randint(20, 60)) for _ in range(num_of_people)]
+
+    class TestEnvironment(HomogeneousEnvironment):
+        __slots__ = ()
+        name = "test"
+
+    env = TestEnvironment(contact_prob)
+
+    def reset_people():
+        for i, p in enumerate(people):
+            p._disease_state = DiseaseState.ASYMPTOMATICINFECTIOUS if i < num_of_infectious \
+                else DiseaseState.SUSCEPTIBLE
+            p._infection_data = None
+            p._seir_times = None
+            p._change()
+            env.sign_up_for_today(p, weight_list[i])
+
+    reset_people()
+    total_infected_weights = sum(env._infectious_people_and_weights.values())
+    non_infection_prob = exp(-contact_prob * total_infected_weights)
+    expected_probs = np.array([1 - non_infection_prob ** w for w in weight_list[num_of_infectious:]])
+
+    params = Params.loader()['infection_propagation']
+    old_params = dict(params)
+    try:
+        params['vectorized_min_env_size'] = 0
+        infection_counts = []
+        for vectorized in (False, True):
+            params['vectorized'] = vectorized
+            # The world reads the params once, when it's built
+            World(people, [env], "test", 1.0)
+            assert env._use_vectorized_draw() == vectorized
+            seeded_counts = []
+            for _ in range(2):
+                random.seed(1)
+                counts = np.zeros(num_of_people - num_of_infectious)
+                for _ in range(loops):
+                    reset_people()
+                    env.propagate_infection(date(year=2020, month=12, day=1))
+                    counts += [not p.is_susceptible for p in people[num_of_infectious:]]
+                seeded_counts.append(counts)
+            assert (seeded_counts[0] == seeded_counts[1]).all()
+            infection_counts.append(seeded_counts[0])
+    finally:
+        params.update(old_params)
+    variances = loops * expected_probs * (1 - expected_probs)
+    for counts in infection_counts:
+        # The number of times each person is infected is binomial with that person's infection probability
+        assert abs(counts.sum() - loops * expected_probs.sum()) < 0.05 * loops * expected_probs.sum()
+        assert ((counts - loops * expected_probs) ** 2 / variances).mean() < 1.3
+    loop_counts, vectorized_counts = infection_counts
+    assert ((vectorized_counts - loop_counts) ** 2 / (2 * variances)).mean() < 1.3
@@ -1,21 +1,31 @@
 from datetime import timedelta
+import itertools
 import json
 import os
 import pytest
 import random
+import tempfile
 from test.conftest import helpers
 
 from src.run_utils import SimpleJob, run, INITIAL_DATE
 from src.seir import daysdelta
 from src.seir.disease_state import DiseaseState
-from src.simulation.event import DayEvent
+from src.simulation.event import (
+    AddRoutineChangeEffect, AddRoutineChangeEnvironmentEffect, AfterTrigger, AndTrigger, DayEvent, DelayedEffect,
+    EmptyTrigger, Event, OrTrigger, RemoveRoutineChangeEffect, RemoveRoutineChangeEnvironmentEffect, StateChangeRule,
+    TimeRangeTrigger
+)
 from src.simulation.interventions import *
+from src.simulation.interventions.intervention import household_isolation_routine, quarantine_routine
 from src.simulation.initial_infection_params import SmartInitialInfectionParams
 from src.simulation.params import Params
 from src.simulation.simulation import Simulation
 from src.logs import Statistics
 from src.world import Person,World
+from src.world.environments import InitialGroup
 from src.world.environments.household import Household
+from src.world.environments.homogeneous_environment import HomogeneousEnvironment
+from src.world.population_generation import population_loader
 
 
 
@@ -138,13 +148,207 @@ def test_SymptomaticIsolationIntervention_Genarete_events(helpers):
     lst =  my_intervention.generate_events(small_world)
     #Assert results 
     assert lst is not None
-    assert len(lst) == 3
-    for i in range(1):
-        assert isinstance(lst[i],DayEvent)
+    assert len(lst) == 2
+    assert isinstance(lst[0],StateChangeRule)
+    assert isinstance(lst[1],DayEvent)
     for person in persons_arr:
-        assert len(list(person.state_to_events.keys())) == (1+4)
+        assert len(list(person.state_to_events.keys())) == 0
     
     my_simulation.run_simulation(name="test",num_days = 60)
+
+
+def test_SymptomaticIsolationIntervention_isolates_while_symptomatic():
+    """
+    Tests that a person is isolated a day after getting symptoms (see SymptomsIsolationRule),
+    until the symptoms are over
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "..", "src", "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), "..", "src", paramsDataPath), override=True)
+
+    persons_arr = list(map(Person, [10, 20]))
+    small_world = World(all_people=persons_arr, all_environments=[], generating_city_name="test", generating_scale=1)
+    my_intervention = SymptomaticIsolationIntervention(compliance=1, start_date=INITIAL_DATE, duration=daysdelta(40))
+    my_simulation = Simulation(world=small_world, initial_date=INITIAL_DATE, interventions=[my_intervention])
+    seir_times = [
+        (DiseaseState.LATENT, daysdelta(2)),
+        (DiseaseState.INCUBATINGPOSTLATENT, daysdelta(2)),
+        (DiseaseState.SYMPTOMATICINFECTIOUS, daysdelta(5)),
+        (DiseaseState.IMMUNE, None)
+    ]
+    person = persons_arr[0]
+    my_simulation.register_events(
+        person.infect_and_get_events(INITIAL_DATE, InitialGroup.initial_group(), seir_times=seir_times)
+    )
+    is_isolated = []
+    for _ in range(12):
+        my_simulation.simulate_day()
+        is_isolated.append('quarantine' in person.routine_changes)
+    assert is_isolated == [False] * 5 + [True] * 4 + [False] * 3
+    assert persons_arr[1].routine_changes == {}
+
+
+def _old_isolation_events(intervention, world):
+    """
+    Build the per person event graph that symptomatic isolation and household isolation used to generate
+    (before SymptomsIsolationRule), for compliance 1. Used as a reference for the rule.
+    :param intervention: SymptomaticIsolationIntervention or HouseholdIsolationIntervention
+    :param world: World object
+    :return: list of new Events to register on the simulation
+    """
+    is_household = isinstance(intervention, HouseholdIsolationIntervention)
+    symptoms_end = list(itertools.product(
+        [DiseaseState.SYMPTOMATICINFECTIOUS, DiseaseState.CRITICAL],
+        [DiseaseState.IMMUNE, DiseaseState.DECEASED]
+    ))
+    ret = []
+    for person in world.all_people():
+        if is_household:
+            household_environment = person.get_environment('household')
+            add_effect = AddRoutineChangeEnvironmentEffect(
+                environment=household_environment,
+                routine_change_key='household_isolation',
+                routine_change_generator=household_isolation_routine
+            )
+            remove_effect = RemoveRoutineChangeEnvironmentEffect(
+                environment=household_environment, routine_change_key='household_isolation'
+            )
+            delay = intervention.delay_on_enter
+        else:
+            add_effect = AddRoutineChangeEffect(
+                person=person, routine_change_key='quarantine', routine_change_val=quarantine_routine(person)
+            )
+            remove_effect = RemoveRoutineChangeEffect(person=person, routine_change_key='quarantine')
+            delay = timedelta(intervention.delay)
+        states = (DiseaseState.INCUBATINGPOSTLATENT, DiseaseState.SYMPTOMATICINFECTIOUS)
+        entry_moment = Event()
+        add_event = Event(
+            AndTrigger(AfterTrigger(entry_moment), TimeRangeTrigger(intervention.start_date, intervention.end_date)),
+            add_effect
+        )
+        entry_moment.hook(add_event)
+        day_event = DayEvent(intervention.start_date)
+        day_event.hook(add_event)
+        ret.append(day_event)
+        if delay:
+            person.hook_on_change(states, Event(EmptyTrigger(), DelayedEffect(entry_moment, delay)))
+        else:
+            person.hook_on_change(states, entry_moment)
+        if is_household and not intervention.is_exit_after_recovery:
+            add_event.hook(Event(
+                AfterTrigger(add_event), DelayedEffect(Event(effect=remove_effect), intervention.delay_on_exit)
+            ))
+            continue
+        if is_household:
+            remove_effect = DelayedEffect(Event(effect=remove_effect), intervention.delay_on_exit)
+        for end_states in symptoms_end:
+            person._init_event(*end_states)
+        remove_event = Event(
+            AndTrigger(
+                OrTrigger([AfterTrigger(person.state_to_events[end_states]) for end_states in symptoms_end]),
+                AfterTrigger(add_event)
+            ),
+            remove_effect
+        )
+        for end_states in symptoms_end:
+            person.hook_on_change(end_states, remove_event)
+    return ret
+
+
+def _symptoms_course(latent, pre_symptomatic, symptomatic, critical=None):
+    """
+    :return: seir_times of a symptomatic person, with the given number of days in each state
+    """
+    seir_times = [
+        (DiseaseState.LATENT, daysdelta(latent)),
+        (DiseaseState.INCUBATINGPOSTLATENT, daysdelta(pre_symptomatic)),
+        (DiseaseState.SYMPTOMATICINFECTIOUS, daysdelta(symptomatic))
+    ]
+    if critical is None:
+        return seir_times + [(DiseaseState.IMMUNE, None)]
+    return seir_times + [(DiseaseState.CRITICAL, daysdelta(critical)), (DiseaseState.DECEASED, None)]
+
+
+# Person index -> (seir_times, whether the symptoms are over before the isolation is due)
+# The intervention starts on day 5 and ends on day 15, and the isolation is due 2 days after the symptoms.
+ISOLATION_COURSES = {
+    0: (_symptoms_course(1, 1, 1), True),    # symptoms over before the delay passes
+    3: (_symptoms_course(1, 1, 5), False),   # due before the start date, isolated on the start date
+    6: (_symptoms_course(1, 1, 2), True),    # symptoms over before the start date
+    9: (_symptoms_course(3, 1, 4), False),
+    10: (_symptoms_course(8, 2, 3, critical=4), False),  # in a house with another case
+    12: (_symptoms_course(8, 1, 1), True),   # symptoms over before the delay passes, after the start date
+    15: (_symptoms_course(12, 2, 6), False),  # due after the end date
+    16: ([(DiseaseState.LATENT, daysdelta(2)), (DiseaseState.ASYMPTOMATICINFECTIOUS, daysdelta(4)),
+          (DiseaseState.IMMUNE, None)], False),
+}
+
+
+def _daily_routine_changes(intervention, use_old_events):
+    """
+    Simulate a small world where only the people in ISOLATION_COURSES are infected, with no infections between people
+    :return: list of the routine change multiplicities of every person, for each day
+    """
+    houses = [Household(city=None, contact_prob_between_each_two_people=0) for _ in range(6)]
+    persons_arr = [Person(age, [house]) for house in houses for age in (10, 35, 40)]
+    small_world = World(all_people=persons_arr, all_environments=houses, generating_city_name="test", generating_scale=1)
+    my_simulation = Simulation(
+        world=small_world, initial_date=INITIAL_DATE, interventions=[] if use_old_events else [intervention]
+    )
+    if use_old_events:
+        my_simulation.register_events(_old_isolation_events(intervention, small_world))
+    for index, (seir_times, _) in ISOLATION_COURSES.items():
+        my_simulation.register_events(
+            persons_arr[index].infect_and_get_events(INITIAL_DATE, InitialGroup.initial_group(), seir_times=seir_times)
+        )
+    ret = []
+    for _ in range(25):
+        my_simulation.simulate_day()
+        ret.append([dict(person.routine_change_multiplicities) for person in persons_arr])
+    return ret
+
+
+@pytest.mark.parametrize("intervention_type", ["symptomatic", "household", "household_exit_after_recovery"])
+def test_isolation_rule_matches_old_events(intervention_type):
+    """
+    Tests that SymptomsIsolationRule isolates the same people on the same days as the event graph
+    the interventions used to generate.
+    The only difference is that when the isolation ends with the symptoms,
+    people whose symptoms are over before their isolation is due are not isolated any more
+    (before, they were isolated and never released).
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "..", "src", "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), "..", "src", paramsDataPath), override=True)
+
+    DiseaseState.init_infectiousness_list()
+
+    if intervention_type == "symptomatic":
+        intervention = SymptomaticIsolationIntervention(
+            compliance=1, start_date=INITIAL_DATE + daysdelta(5), duration=daysdelta(10), delay=2
+        )
+        skipped = {index for index, (_, is_over) in ISOLATION_COURSES.items() if is_over}
+    else:
+        is_exit_after_recovery = intervention_type == "household_exit_after_recovery"
+        intervention = HouseholdIsolationIntervention(
+            compliance=1, start_date=INITIAL_DATE + daysdelta(5), duration=daysdelta(10),
+            delay_on_enter=2, delay_on_exit=3, is_exit_after_recovery=is_exit_after_recovery
+        )
+        # The houses of the skipped people
+        skipped = {0, 1, 2, 6, 7, 8, 12, 13, 14} if is_exit_after_recovery else set()
+    old_changes = _daily_routine_changes(intervention, use_old_events=True)
+    new_changes = _daily_routine_changes(intervention, use_old_events=False)
+    assert any(any(day_changes) for day_changes in new_changes)
+    for old_day, new_day in zip(old_changes, new_changes):
+        for index, (old_person, new_person) in enumerate(zip(old_day, new_day)):
+            if index in skipped:
+                assert new_person == {}
+            else:
+                assert new_person == old_person
     
     
 def test_ImmuneGeneralPopulationIntervention():
@@ -264,4 +468,53 @@ def test_ImmuneByHouseholdIntervention():
     cnt_immune = sum([1 for p in persons_arr if p.get_disease_state()==DiseaseState.IMMUNE])
     assert cnt_immune == 5 
     my_simulation.simulate_day()
-    
\ No newline at end of file
+    
+
+
+def test_policy_interventions_match_routine_changes():
+    """
+    Tests that the timed interventions that join their people to a policy (see PolicyMultipliers)
+    weigh the people in their environments like adding the routine change to each of them does
+    """
+    config_path = os.path.join(os.path.dirname(__file__), "..", "src", "config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), "..", "src", paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    world = population_loader.PopulationLoader(citiesDataPath).get_world(city_name='Atlit', scale=1)
+
+    def get_weights_by_day(with_policies):
+        world.reset()
+        random.seed(11)
+        interventions = [
+            SocialDistancingIntervention(INITIAL_DATE + daysdelta(1), daysdelta(4), 0.7, (0, 99)),
+            WorkplaceClosureIntervention(INITIAL_DATE + daysdelta(2), daysdelta(4), 0.8),
+            SocialDistancingIntervention(INITIAL_DATE + daysdelta(3), daysdelta(4), 0.5, (20, 60))
+        ]
+        if not with_policies:
+            for intervention in interventions:
+                intervention._multiplier_generator = None
+        sim = Simulation(world=world, initial_date=INITIAL_DATE, interventions=interventions, outdir=tempfile.mkdtemp())
+        weights_by_day = []
+        for _ in range(8):
+            sim.simulate_day()
+            weights = {}
+            for env in world.all_environments:
+                if isinstance(env, HomogeneousEnvironment):
+                    env._apply_policies()
+                    weights[env] = {person.get_id(): weight for person, weight in env._person_dict.items()}
+            weights_by_day.append(weights)
+        assert all(person.routine_changes == {} for person in world.all_people())
+        return weights_by_day
+
+    weights_with_policies = get_weights_by_day(with_policies=True)
+    assert any(person.get_policy_group() != 0 for person in world.all_people())
+    assert not any(world.get_policies().is_active(policy) for policy in range(3))
+    weights_with_routine_changes = get_weights_by_day(with_policies=False)
+    assert weights_with_policies[0] != weights_with_policies[4]
+    assert weights_with_policies == weights_with_routine_changes
+
+    world.reset()
+    assert len(SocialDistancingIntervention(INITIAL_DATE, daysdelta(4), 0.7, (0, 99)).generate_events(world)) == 2
@@ -1,12 +1,22 @@
 import os
 import json
+import random
+import tempfile
+
+import numpy as np
 
 from src.run_utils import INITIAL_DATE
+from src.seir import DiseaseState
 from src.simulation.simulation import Simulation
 from src.simulation.initial_infection_params import InitialImmuneType, NaiveInitialInfectionParams
 from src.simulation.params import Params
+from src.world import Person
 from src.world.population_generation import population_loader
-from src.world.population_generation import generate_city
+from src.world.population_generation import generate_city, generate_entire_country
+from src.world.population_generation.yomemut import make_city_work_destination_distributions
+from src.world.population_generation.smart_population_generation import get_distribution_distance
+from src.world.population_generation.vectorized_household_generation import sim_houses_vectorized
+from src.world.population_generation import COLUMNAR_FORMAT
 
 
 def test_CityGeneration():
@@ -162,4 +172,221 @@ def test_Atlit_population_generation():
     print(kids_reality)
     for i in range(len(kids_reality)):
         assert abs(kids_reality[i+1] - kids_expected[i]) < 0.1
-        
\ No newline at end of file
+
+
+def test_columnar_population_cache():
+    """
+    Checking that a world loaded from the columnar cache is the same as the generated one,
+    and runs the same simulation
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    output_dir = tempfile.mkdtemp()
+    generated_world = population_loader.PopulationLoader(
+        citiesDataPath, output_dir=output_dir, cache_format=COLUMNAR_FORMAT).get_world(city_name='Atlit', scale=1)
+    [filename] = os.listdir(output_dir)
+    assert filename.startswith("population_atlit_True_1_") and filename.endswith(".npz")
+    loaded_world = population_loader.PopulationLoader(
+        citiesDataPath, output_dir=output_dir, cache_format=COLUMNAR_FORMAT).get_world(city_name='Atlit', scale=1)
+    assert loaded_world is not generated_world
+    # The loaded people are made by Person.from_columns, which sets the same slots as the constructor
+    assert all(hasattr(p, name) for p in loaded_world.all_people() for name in Person.__slots__)
+
+    def describe_person(person):
+        return (
+            person.get_id(), person.get_age(), person._infectiousness_prob, person.get_routine(),
+            [(name, env._id, env._full_name) for name, env in person._environments.items()],
+            person.get_neighberhood().get_neighborhood_id()
+        )
+
+    def describe_environment(env):
+        return (
+            type(env), env._id, env._full_name, env._contact_prob_between_each_two_people, env._city.get_name(),
+            tuple(getattr(env, '_age_segment', ()))
+        )
+
+    assert [describe_person(p) for p in loaded_world.all_people()] == \
+        [describe_person(p) for p in generated_world.all_people()]
+    assert [describe_environment(env) for env in loaded_world.all_environments] == \
+        [describe_environment(env) for env in generated_world.all_environments]
+    assert [env._id for env in loaded_world.get_city_community('atlit')._sub_environments_dict['household']] == \
+        [env._id for env in generated_world.get_city_community('atlit')._sub_environments_dict['household']]
+
+    def run_simulation(world):
+        random.seed(3)
+        np.random.seed(3)
+        sim = Simulation(world = world, initial_date= INITIAL_DATE)
+        sim.infect_random_set(num_infected = 20, infection_doc = "")
+        for _ in range(30):
+            sim.simulate_day()
+        return [(p.get_id(), p.get_disease_state()) for p in world.all_people()]
+
+    assert run_simulation(loaded_world) == run_simulation(generated_world)
+
+
+def test_memory_mapped_population_store():
+    """
+    Checking that the PopulationStore of a world loaded from the columnar cache maps its static columns
+    read-only from the cache file, and keeps the columns that the simulation changes private
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    population_params = Params.loader()["population"]
+    old_use_population_store = population_params["use_population_store"]
+    try:
+        population_params["use_population_store"] = True
+        DiseaseState.init_infectiousness_list()
+        output_dir = tempfile.mkdtemp()
+        generated_world = population_loader.PopulationLoader(
+            citiesDataPath, output_dir=output_dir, cache_format=COLUMNAR_FORMAT).get_world(city_name='Atlit', scale=1)
+        loaded_world = population_loader.PopulationLoader(
+            citiesDataPath, output_dir=output_dir, cache_format=COLUMNAR_FORMAT).get_world(city_name='Atlit', scale=1)
+        generated_store = generated_world.get_population_store()
+        loaded_store = loaded_world.get_population_store()
+        for name in ['ages', 'infectiousness', 'env_offsets', 'env_ids']:
+            assert not getattr(loaded_store, name).flags.writeable, name
+            assert np.array_equal(getattr(loaded_store, name), getattr(generated_store, name)), name
+        assert loaded_store.disease_states.flags.writeable
+        assert loaded_store.routine_weights.flags.writeable
+        person = loaded_world.all_people()[0]
+        assert person.get_age() == generated_world.all_people()[0].get_age()
+
+        sim = Simulation(world = loaded_world, initial_date= INITIAL_DATE)
+        sim.infect_random_set(num_infected = 20, infection_doc = "")
+        for _ in range(10):
+            sim.simulate_day()
+        assert loaded_store.count_by_disease_state()[DiseaseState.SUSCEPTIBLE] < len(loaded_store)
+    finally:
+        population_params["use_population_store"] = old_use_population_store
+
+
+def test_population_cache_key():
+    """
+    Checking that the population cache is shared by params that differ only in what the generation doesn't read
+    (including the params that only change how the loaded world is stored),
+    and that a change in the population params generates a new world
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    output_dir = tempfile.mkdtemp()
+    generated_world = population_loader.PopulationLoader(
+        citiesDataPath, output_dir=output_dir).get_world(city_name='Atlit', scale=1)
+
+    disease_params, population_params = Params.loader()["disease_parameters"], Params.loader()["population"]
+    old_symptomatic = disease_params["symptomatic_given_infected_per_age"]
+    old_community_approx_size = population_params["community_approx_size"]
+    old_use_population_store = population_params["use_population_store"]
+    try:
+        disease_params["symptomatic_given_infected_per_age"] = [0.5 * p for p in old_symptomatic]
+        loader = population_loader.PopulationLoader(citiesDataPath, output_dir=output_dir)
+        loaded_world = loader.get_world(city_name='Atlit', scale=1)
+        assert loaded_world is not generated_world
+        assert loaded_world.num_people() == generated_world.num_people()
+        assert len(os.listdir(output_dir)) == 1
+        assert loader.get_world(city_name='Atlit', scale=1) is loaded_world
+
+        # Only changes how the loaded world is stored
+        population_params["use_population_store"] = True
+        assert loader.get_world(city_name='Atlit', scale=1) is loaded_world
+        assert loaded_world.get_population_store() is not None
+        assert population_loader.PopulationLoader(citiesDataPath, output_dir=output_dir).get_world(
+            city_name='Atlit', scale=1).get_population_store() is not None
+        population_params["use_population_store"] = False
+        assert loader.get_world(city_name='Atlit', scale=1).get_population_store() is None
+        assert len(os.listdir(output_dir)) == 1
+
+        population_params["community_approx_size"] = 2 * old_community_approx_size
+        assert loader.get_world(city_name='Atlit', scale=1) is not loaded_world
+        assert len(os.listdir(output_dir)) == 2
+    finally:
+        disease_params["symptomatic_given_infected_per_age"] = old_symptomatic
+        population_params["community_approx_size"] = old_community_approx_size
+        population_params["use_population_store"] = old_use_population_store
+
+
+def test_parallel_country_generation():
+    """
+    Checking that generating the cities of the country in worker processes gives the same world
+    as generating them in this process
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    pop = population_loader.PopulationLoader(citiesDataPath, with_caching=False)
+    city_list = [pop.get_city_by_name(name) for name in ['Atlit', 'Rosh Pina', 'Caesarea']]
+    make_city_work_destination_distributions(city_list)
+
+    def describe_world(num_workers):
+        random.seed(5)
+        np.random.seed(5)
+        world = generate_entire_country(city_list, scaling=0.5, num_workers=num_workers)
+        first_person_id = min(p.get_id() for p in world.all_people())
+        first_env_id = min(env._id for env in world.all_environments)
+        return [
+            (
+                p.get_id() - first_person_id, p.get_age(), p._infectiousness_prob,
+                sorted((name, env._id - first_env_id, env._city.get_name()) for name, env in p._environments.items())
+            )
+            for p in world.all_people()
+        ]
+
+    assert describe_world(num_workers=2) == describe_world(num_workers=1)
+
+
+def test_vectorized_household_generation():
+    """
+    Checking that the vectorized household generation matches the demographic data of the city
+    as closely as sim_houses, and that the smart population generation uses it when asked to
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    pop = population_loader.PopulationLoader(citiesDataPath, with_caching=False)
+    city = pop.get_city_by_name('Holon')
+    households_ages = sim_houses_vectorized(
+        city.age_data,
+        city.household_size_data,
+        city.percentage_of_households_with_65_plus,
+        city.percentage_of_households_with_17_minus,
+        int(city.total_households * 0.1),
+        int(city.population * 0.1),
+        city.percentage_of_households_with_single_parent,
+        city.percentage_of_children_with_single_parent_in_household,
+        city.kids_per_household_data
+    )
+    assert sum(len(household) for household in households_ages) == int(city.population * 0.1)
+    assert abs(len(households_ages) / int(city.total_households * 0.1) - 1) < 0.01
+    age_groups = [min(age // 5, 15) for household in households_ages for age in household]
+    assert get_distribution_distance(age_groups, [t[0] for t in city.age_data])[0] < 0.01
+    household_sizes = [min(len(household), len(city.household_size_data) - 1) for household in households_ages]
+    assert get_distribution_distance(household_sizes, city.household_size_data)[0] < 0.01
+    assert all(max(household) >= 18 for household in households_ages)
+
+    population_params = Params.loader()["population"]
+    old_vectorized_household_generation = population_params["vectorized_household_generation"]
+    population_params["vectorized_household_generation"] = True
+    try:
+        world = pop.get_world(city_name='Holon', scale=0.1)
+    finally:
+        population_params["vectorized_household_generation"] = old_vectorized_household_generation
+    assert world.num_people() == int(city.population * 0.1)
@@ -1,10 +1,27 @@
 import pytest
+import csv
+import json
 import os
+import random
+import tempfile
+import time
 
-from src.seir import DiseaseState
+import numpy as np
+
+from src.seir import DiseaseState, daysdelta
 from src.simulation.initial_infection_params import NaiveInitialInfectionParams
-from src.run_utils import SimpleJob, run
-from src.logs import Statistics
+from src.simulation.interventions import SocialDistancingIntervention, SymptomaticIsolationIntervention, \
+    HouseholdIsolationIntervention
+from src.simulation.params import Params
+from src.simulation.simulation import Simulation
+from src.run_utils import SimpleJob, RepeatJob, BranchingJob, Task, TaskCostModel, TaskScheduler, run, INITIAL_DATE, \
+    create_task_pool
+from src.simulation.calendar_queue import CalendarQueue
+from src.logs import Statistics, make_age_and_state_datas_to_plot, make_infections_age_datas_to_plot, \
+    make_infections_infector_state_datas_to_plot
+from src.logs.stats import StreamedDaysData, nan_mean_std_confidence
+from src.logs.summary import TableFormat
+from src.world.population_generation import population_loader
 
 
 def test_simple_simulation_single():
@@ -78,3 +95,490 @@ def test_param_change_immune_parm(params):
     )[-1]
     assert 0.89 * 23061 <= total_immuned 
 
+
+
+def test_calendar_queue():
+    """
+    Tests that the events of a day are drained in the order they were pushed,
+    including events pushed to that day while it is drained
+    """
+    queue = CalendarQueue()
+    queue.push(1, 'c')
+    queue.push(0, 'a')
+    queue.push(0, 'b')
+    assert queue.days() == [0, 1]
+    assert len(queue) == 3
+
+    drained = []
+    for event in queue.drain(0):
+        drained.append(event)
+        if event == 'a':
+            queue.push(0, 'a2')
+    assert drained == ['a', 'b', 'a2']
+    assert 0 not in queue
+    assert list(queue.drain(0)) == []
+    assert list(queue.drain(1)) == ['c']
+    assert len(queue) == 0
+
+
+def test_streamed_days_data():
+    """
+    Tests that the statistics of a simulation that streams its days data to a file
+    are the same as the statistics of the same simulation that keeps them in memory
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    world = population_loader.PopulationLoader(citiesDataPath).get_world(city_name='Atlit', scale=1)
+
+    def run_simulation(stream_days_data):
+        Params.loader()["statistics"]["stream_days_data"] = stream_days_data
+        world.reset()
+        random.seed(7)
+        np.random.seed(7)
+        sim = Simulation(world=world, initial_date=INITIAL_DATE, outdir=tempfile.mkdtemp())
+        sim.infect_random_set(num_infected=20, infection_doc="")
+        for _ in range(30):
+            sim.simulate_day()
+        return sim.stats
+
+    statistics_params = Params.loader()["statistics"]
+    old_stream_days_data = statistics_params["stream_days_data"]
+    try:
+        in_memory = run_simulation(stream_days_data=False)
+        streamed = run_simulation(stream_days_data=True)
+    finally:
+        statistics_params["stream_days_data"] = old_stream_days_data
+    assert isinstance(streamed.get_days_data(), StreamedDaysData)
+    assert len(streamed.get_days_data()) == len(in_memory.get_days_data()) == 30
+    assert streamed.get_dates() == in_memory.get_dates()
+    assert streamed.num_infected == in_memory.num_infected
+    for index in (0, 12, 28, -1):
+        streamed_day, in_memory_day = streamed.get_days_data()[index], in_memory.get_days_data()[index]
+        assert streamed_day.date == in_memory_day.date
+        assert np.array_equal(streamed_day.person_counts, in_memory_day.person_counts)
+        assert len(streamed_day.infections) == len(in_memory_day.infections)
+    datas_to_plot = make_age_and_state_datas_to_plot() + make_infections_age_datas_to_plot() + \
+        make_infections_infector_state_datas_to_plot()
+    for data_to_plot in datas_to_plot:
+        args = (data_to_plot.property_to_count, data_to_plot.is_integral, data_to_plot.infection_data)
+        assert streamed.sum_days_data(*args) == in_memory.sum_days_data(*args)
+    assert streamed.get_state_stratified_summary_table(TableFormat.CSV) == \
+        in_memory.get_state_stratified_summary_table(TableFormat.CSV)
+
+    streamed.dump('statistics.pkl')
+    loaded = Statistics.load(os.path.join(streamed._output_path, 'statistics.pkl'))
+    assert loaded.get_dates() == in_memory.get_dates()
+
+
+def test_day_statistics_counts():
+    """
+    Tests that the counts of the days data of a simulation add up to the states and infections of its people
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    world = population_loader.PopulationLoader(citiesDataPath).get_world(city_name='Atlit', scale=1)
+    world.reset()
+    random.seed(3)
+    np.random.seed(3)
+    sim = Simulation(world=world, initial_date=INITIAL_DATE, outdir=tempfile.mkdtemp())
+    sim.infect_random_set(num_infected=20, infection_doc="")
+    for _ in range(30):
+        sim.simulate_day()
+    stats = sim.stats
+    people = list(world.all_people())
+    for state in DiseaseState:
+        if state == DiseaseState.SUSCEPTIBLE:
+            continue
+        in_state = stats.sum_days_data(lambda person: person.disease_state == state, True)
+        assert in_state[-1] == sum(person.get_disease_state() == state for person in people)
+    infected_people = [person for person in people if person.get_infection_data() is not None]
+    total_infections = sum(stats.sum_days_data(lambda env: env in stats.environment_names, False, 'infection_env_short'))
+    # People are counted on the day they got infected, if their state changed that day
+    assert 20 < total_infections <= len(infected_people)
+    initial_infections = sum(stats.sum_days_data(
+        lambda infected_age_and_state: infected_age_and_state[1] is None, False,
+        ('infected_age', 'infector_disease_state')
+    ))
+    assert initial_infections == sum(stats.sum_days_data(lambda state: state is None, False, 'infector_disease_state'))
+    assert initial_infections == 20
+    for day in stats.get_days_data():
+        assert sum(day.person_count.values()) == day.person_counts.sum()
+        assert sum(day.infection_data_projection['infected_age'].values()) == len(day.infections)
+
+
+def test_days_data_series():
+    """
+    Tests that the days data indexed at the end of a simulation gives the same sums as the days themselves,
+    also after saving and loading the statistics
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    world = population_loader.PopulationLoader(citiesDataPath).get_world(city_name='Atlit', scale=1)
+    world.reset()
+    random.seed(5)
+    np.random.seed(5)
+    sim = Simulation(world=world, initial_date=INITIAL_DATE, outdir=tempfile.mkdtemp())
+    sim.infect_random_set(num_infected=20, infection_doc="")
+    for _ in range(30):
+        sim.simulate_day()
+    stats = sim.stats
+    queries = [
+        (data_to_plot.property_to_count, data_to_plot.is_integral, data_to_plot.infection_data)
+        for data_to_plot in make_age_and_state_datas_to_plot() + make_infections_age_datas_to_plot() +
+        make_infections_infector_state_datas_to_plot()
+    ]
+    queries.append((lambda ages: ages[1] is not None and ages[0] < ages[1], False, ('infected_age', 'infector_age')))
+    sums = [stats.sum_days_data(*query) for query in queries]
+    stats.mark_ending(world.all_people())
+    assert [stats.sum_days_data(*query) for query in queries] == sums
+    stats.dump('statistics.pkl')
+    loaded = Statistics.load(os.path.join(stats._output_path, 'statistics.pkl'))
+    assert [loaded.sum_days_data(*query) for query in queries] == sums
+
+
+def test_checkpoint_restore():
+    """
+    Tests that a simulation restored from a checkpoint continues exactly like the simulation it was taken of
+    (with the same random generators), also when its days data is streamed
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    world = population_loader.PopulationLoader(citiesDataPath).get_world(city_name='Atlit', scale=1)
+    world.reset()
+    random.seed(9)
+    np.random.seed(9)
+    interventions = [
+        SymptomaticIsolationIntervention(compliance=0.8, start_date=INITIAL_DATE, duration=daysdelta(100)),
+        SocialDistancingIntervention(INITIAL_DATE + daysdelta(15), daysdelta(10), 0.7, (0, 99))
+    ]
+    # The statistics read it when they are created, and the restored simulation keeps them
+    statistics_params = Params.loader()["statistics"]
+    old_stream_days_data = statistics_params["stream_days_data"]
+    statistics_params["stream_days_data"] = True
+    try:
+        sim = Simulation(world=world, initial_date=INITIAL_DATE, interventions=interventions, outdir=tempfile.mkdtemp())
+    finally:
+        statistics_params["stream_days_data"] = old_stream_days_data
+    assert isinstance(sim.stats.get_days_data(), StreamedDaysData)
+    sim.infect_random_set(num_infected=20, infection_doc="")
+    sim.simulate_days(10)
+    snapshot = sim.checkpoint()
+    sim.simulate_days(20)
+    restored = Simulation.restore(snapshot, outdir=tempfile.mkdtemp())
+    restored.simulate_days(20)
+
+    assert restored.stats._output_path != sim.stats._output_path
+    assert isinstance(restored.stats.get_days_data(), StreamedDaysData)
+    assert restored.stats.get_dates() == sim.stats.get_dates()
+    assert restored.stats.num_infected == sim.stats.num_infected
+    for data_to_plot in make_age_and_state_datas_to_plot() + make_infections_age_datas_to_plot():
+        args = (data_to_plot.property_to_count, data_to_plot.is_integral, data_to_plot.infection_data)
+        assert restored.stats.sum_days_data(*args) == sim.stats.sum_days_data(*args)
+    assert [person.get_disease_state() for person in restored._world.all_people()] == \
+        [person.get_disease_state() for person in world.all_people()]
+
+
+def test_branching_job():
+    """
+    Tests that the jobs of a BranchingJob share the days before the interventions they differ in
+    """
+    def isolation(compliance=0.8):
+        return SymptomaticIsolationIntervention(compliance=compliance, start_date=INITIAL_DATE, duration=daysdelta(100))
+
+    # Each job creates its own interventions, the equal ones are shared
+    jobs = [
+        SimpleJob("no_distancing", 'Atlit', 1.0, infection_params=NaiveInitialInfectionParams(20), days=20,
+                  interventions=[isolation()], datas_to_plot={}),
+        SimpleJob("distancing", 'Atlit', 1.0, infection_params=NaiveInitialInfectionParams(20), days=20,
+                  interventions=[
+                      isolation(),
+                      SocialDistancingIntervention(INITIAL_DATE + daysdelta(10), daysdelta(10), 0.1, (0, 99))
+                  ], datas_to_plot={})
+    ]
+    other_job = SimpleJob("less_isolation", 'Atlit', 1.0, infection_params=NaiveInitialInfectionParams(20), days=20,
+                          interventions=[isolation(compliance=0.5)], datas_to_plot={})
+    assert BranchingJob("test_branching", [jobs[0], other_job]).prefix_days == 0
+    job = BranchingJob("test_branching", jobs)
+    assert job.prefix_days == 10
+    assert job.branch_interventions[0] == [] and len(job.branch_interventions[1]) == 1
+    outdir = run([job], multi_processed=False)
+    stats = [Statistics.load(os.path.join(outdir, "test_branching", name, "statistics.pkl"))
+             for name in ["no_distancing", "distancing"]]
+    assert stats[0].get_dates() == stats[1].get_dates()
+    assert len(stats[0].get_dates()) == 20
+    prefixes = [[day.person_counts.tolist() for day in list(stat.get_days_data())[:10]] for stat in stats]
+    assert prefixes[0] == prefixes[1]
+    assert not os.path.exists(os.path.join(outdir, "test_branching", "prefix"))
+
+
+@pytest.mark.parametrize("make_isolation,routine_change_key", [
+    (lambda start_date: SymptomaticIsolationIntervention(
+        compliance=1., start_date=start_date, duration=daysdelta(100), delay=3
+    ), 'quarantine'),
+    (lambda start_date: HouseholdIsolationIntervention(
+        compliance=1., start_date=start_date, duration=daysdelta(100), delay_on_enter=3
+    ), 'household_isolation'),
+])
+def test_branch_isolates_earlier_symptoms(make_isolation, routine_change_key):
+    """
+    Tests that a symptoms isolation added to a branch (see BranchingJob) also isolates the people
+    that got symptoms before the branch date, like the same isolation in a simulation that has it from the start
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__), paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    world = population_loader.PopulationLoader(citiesDataPath).get_world(city_name='Atlit', scale=1)
+    branch_date = INITIAL_DATE + daysdelta(10)
+
+    def run_isolations(sim, num_days):
+        isolated = []
+        for _ in range(num_days):
+            sim.simulate_day()
+            isolated.append(sorted(
+                person.get_id() for person in sim._world.all_people() if routine_change_key in person.routine_changes
+            ))
+        return isolated
+
+    # Without infections both simulations have the disease courses of the initial infection,
+    # even though only the one with the isolation from the start draws the compliance of the prefix
+    DiseaseState.infectiousness_list = [0.] * len(DiseaseState.infectiousness_list)
+    try:
+        world.reset()
+        random.seed(9)
+        np.random.seed(9)
+        sim = Simulation(world=world, initial_date=INITIAL_DATE, interventions=[make_isolation(branch_date)],
+                         outdir=tempfile.mkdtemp())
+        sim.infect_random_set(num_infected=100, infection_doc="")
+        expected = run_isolations(sim, 30)
+
+        world.reset()
+        random.seed(9)
+        np.random.seed(9)
+        sim = Simulation(world=world, initial_date=INITIAL_DATE, outdir=tempfile.mkdtemp())
+        sim.infect_random_set(num_infected=100, infection_doc="")
+        prefix = run_isolations(sim, 10)
+        branch = Simulation.restore(sim.checkpoint(), outdir=tempfile.mkdtemp())
+        branch.add_interventions([make_isolation(branch_date)])
+        isolated = prefix + run_isolations(branch, 20)
+    finally:
+        DiseaseState.init_infectiousness_list()
+
+    assert expected[9] == [] and expected[10] != []
+    assert isolated == expected
+
+
+@pytest.mark.parametrize("tolerance,num_launched", [(10.0, 2), (1e-9, 5)])
+def test_repeat_job_tolerances(tolerance, num_launched):
+    """
+    Tests that a RepeatJob with tolerances stops after the first wave when the metrics are precise enough,
+    and runs all the repetitions otherwise
+    """
+    job = RepeatJob(
+        SimpleJob("test_tolerances", 'Atlit', 1.0, infection_params=NaiveInitialInfectionParams(20), days=15,
+                  datas_to_plot={}),
+        num_repetitions=5, tolerances={"Total infected": tolerance}, wave_size=2
+    )
+    outdir = run([job], multi_processed=False)
+    assert job.num_launched == len(job.metric_values) == num_launched
+    assert sorted(name for name in os.listdir(os.path.join(outdir, "test_tolerances")) if name.startswith("sample_")) \
+        == ["sample_" + str(index) for index in range(num_launched)]
+    with open(os.path.join(outdir, "test_tolerances", "test_tolerances_precision.csv")) as f:
+        rows = list(csv.DictReader(f))
+    assert [row['metric'] for row in rows] == ["Total infected"]
+    assert rows[0]['converged'] == str(num_launched < 5)
+    assert int(rows[0]['repetitions']) == num_launched
+
+
+def test_run_schedules_finalize(capsys):
+    """
+    Tests that a multi processed run finalizes its jobs in tasks of the TaskScheduler, after their other tasks
+    """
+    job = RepeatJob(
+        SimpleJob("test_finalize", 'Atlit', 1.0, infection_params=NaiveInitialInfectionParams(20), days=5,
+                  datas_to_plot={}),
+        num_repetitions=2, tolerances={"Total infected": 100.}, wave_size=2
+    )
+    outdir = run([job], multi_processed=True, num_workers=2)
+    assert os.path.exists(os.path.join(outdir, "test_finalize", "test_finalize_precision.csv"))
+    # The 2 repetitions and the finalize task
+    assert "3 tasks on 2 workers" in capsys.readouterr().out
+
+
+def test_task_scheduler():
+    """
+    Tests that the TaskScheduler starts the longest tasks first, as long as there are free workers and their memory fits
+    """
+    started = []
+    scheduler = TaskScheduler(num_workers=2, memory_budget=10, start_task=started.append)
+    short_tasks = [Task(None, (name, None)) for name in ["short1", "short2"]]
+    big_task = Task(None, ("big", None))
+    long_tasks = [Task(None, (name, None)) for name in ["long1", "long2"]]
+    scheduler.add(short_tasks, 1, 1)
+    scheduler.add([big_task], 5, 20)
+    scheduler.add(long_tasks, 3, 6)
+    assert started == []
+    scheduler.start()
+    # The big task doesn't fit in the memory budget, so it runs alone
+    assert started == [big_task]
+    scheduler.done(big_task)
+    # The second long task doesn't fit with the first, but a short one does
+    assert started == [big_task, long_tasks[0], short_tasks[0]]
+    scheduler.done(short_tasks[0])
+    assert started[-1] == short_tasks[1]
+    scheduler.done(long_tasks[0])
+    scheduler.done(short_tasks[1])
+    assert started[-1] == long_tasks[1]
+    scheduler.done(long_tasks[1])
+    assert len(started) == 5
+    assert "5 tasks on 2 workers" in scheduler.get_report()
+
+
+def test_task_scheduler_wait_finished():
+    """
+    Tests that the TaskScheduler returns the tasks that finished (and their errors) until no task runs or waits,
+    and that a failed task releases its memory for the pending tasks
+    """
+    started = []
+    scheduler = TaskScheduler(num_workers=2, memory_budget=10, start_task=started.append)
+    tasks = [Task(None, (name, None)) for name in ["first", "second"]]
+    scheduler.add(tasks, 1, 8)
+    scheduler.start()
+    assert started == [tasks[0]]
+    error = ValueError("failed")
+    scheduler.done(tasks[0], error)
+    assert started == tasks
+    assert scheduler.wait_finished() == [(tasks[0], error)]
+    scheduler.done(tasks[1])
+    assert scheduler.wait_finished() == [(tasks[1], None)]
+    assert scheduler.wait_finished() == []
+
+
+def test_task_cost_model():
+    """
+    Tests that the TaskCostModel estimates larger worlds and longer runs to cost more
+    """
+    file_path = os.path.dirname(__file__) + "/../src/config.json"
+    with open(file_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+    cost_model = TaskCostModel(citiesDataPath)
+    assert 8000 < cost_model.get_num_people('atlit', 1.0) < 8100
+    assert cost_model.get_num_people('atlit', 0.5) == cost_model.get_num_people('atlit', 1.0) / 2
+    assert cost_model.get_num_people('all', 0.1) > 10 * cost_model.get_num_people('haifa', 0.1)
+    short_seconds, memory = cost_model.estimate(SimpleJob("short", 'Atlit', 1.0, days=30))
+    long_seconds, same_memory = cost_model.estimate(SimpleJob("long", 'Atlit', 1.0, days=300))
+    assert long_seconds > short_seconds and memory == same_memory
+    large_seconds, large_memory = cost_model.estimate(SimpleJob("large", 'haifa', 1.0, days=30))
+    assert large_seconds > short_seconds and large_memory > memory
+    assert cost_model.get_num_people('Atlit', 1.0) == cost_model.get_num_people('atlit', 1.0)
+
+    simple_job = SimpleJob("simple", 'Atlit', 1.0, days=30)
+    repeat_job = RepeatJob(simple_job, num_repetitions=10)
+    repeat_job.num_launched = 10
+    simple_seconds, simple_memory = cost_model.estimate_finalize(simple_job)
+    repeat_seconds, repeat_memory = cost_model.estimate_finalize(repeat_job)
+    assert repeat_seconds > simple_seconds and repeat_memory > simple_memory
+
+
+def _draw_in_worker(_):
+    # Long enough for each worker of the pool to take a task
+    time.sleep(0.2)
+    return os.getpid(), np.random.random()
+
+
+def test_forked_workers_draw_different_numbers():
+    """
+    Tests that repetitions running in different forked workers (see run with use_fork_templates)
+    don't draw the same numbers from the numpy random generator they inherit
+    """
+    np.random.seed(0)
+    pool = create_task_pool(2, use_fork_templates=True)
+    try:
+        draws = dict(pool.map(_draw_in_worker, range(4), chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+    assert len(draws) == 2
+    assert len(set(draws.values())) == 2
+
+
+class _NoNextTasksJob(SimpleJob):
+    """
+    A job that fails after its tasks are done
+    """
+    def generate_next_tasks(self, outdir, stop_early=None):
+        raise ValueError("No next tasks for %s" % self.scenario_name)
+
+
+def test_run_raises_error_of_next_tasks():
+    """
+    Tests that a multi processed run raises the errors of Job.generate_next_tasks, instead of waiting forever
+    """
+    jobs = [
+        _NoNextTasksJob("test_no_next_tasks%d" % index, 'Atlit', 1.0,
+                        infection_params=NaiveInitialInfectionParams(20), days=2, datas_to_plot={})
+        for index in range(2)
+    ]
+    with pytest.raises(ValueError):
+        run(jobs, multi_processed=True, num_workers=2)
+
+
+def _fail_task(outdir, stop_early, with_population_caching, verbosity):
+    raise ValueError("The task failed")
+
+
+class _FailingTasksJob(SimpleJob):
+    """
+    A job whose tasks fail
+    """
+    def generate_tasks(self, outdir, stop_early=None):
+        return [Task(_fail_task, (outdir, stop_early)) for _ in range(3)]
+
+
+def test_run_raises_error_of_task():
+    """
+    Tests that a multi processed run raises the errors of its tasks, instead of waiting forever
+    """
+    jobs = [_FailingTasksJob("test_failing_tasks", 'Atlit', 1.0), _FailingTasksJob("test_failing_tasks2", 'Atlit', 1.0)]
+    with pytest.raises(ValueError):
+        run(jobs, multi_processed=True, with_population_caching=False, num_workers=2)
+
+
+def test_nan_mean_std_confidence():
+    """
+    Tests the statistics of the samples of several repetitions, with days that some or all of them do not have
+    """
+    samples = np.array([
+        [[1., 2.], [np.nan, 4.], [np.nan, 1.]],
+        [[3., 2.], [5., np.nan], [np.nan, 2.]],
+        [[5., 2.], [7., np.nan], [np.nan, 3.]],
+    ])
+    expectation, std, confidence = nan_mean_std_confidence(samples)
+    assert expectation.shape == std.shape == confidence.shape == (3, 2)
+    assert np.allclose(expectation, [[3., 2.], [6., 4.], [np.nan, 2.]], equal_nan=True)
+    assert np.allclose(std, [[np.std([1., 3., 5.]), 0.], [1., 0.], [np.nan, np.std([1., 2., 3.])]], equal_nan=True)
+    assert np.allclose(confidence, std / np.sqrt(3), equal_nan=True)
@@ -1,6 +1,6 @@
 from random import randint
 from src.util.divide_array import divide_array, divide_weighted_array
-from src.util.distribution import DiscreteDistribution, Distribution
+from src.util.distribution import DiscreteDistribution, Distribution, WeightedSampler
 
 
 def test_divide_array():
@@ -115,4 +115,29 @@ def test_Distribution2():
 
     assert abs(acc_samples_dic[1] - 2 * acc_samples_dic[2]) <= 10
     assert abs(acc_samples_dic[0] - 3 * acc_samples_dic[2]) <= 10
-    assert abs(acc_samples_dic[0] - 1.5 * acc_samples_dic[1]) <= 10
\ No newline at end of file
+    assert abs(acc_samples_dic[0] - 1.5 * acc_samples_dic[1]) <= 10
+
+
+def test_WeightedSampler():
+    sampler = WeightedSampler()
+    for obj in range(6):
+        sampler.set_weight(obj, 1)
+    sampler.remove(0)
+    sampler.remove(1)
+    sampler.set_weight(2, 0)
+    sampler.set_weight(3, 3)
+    sampler.set_weight(6, 2)
+    assert len(sampler) == 5
+    assert abs(sampler.total_weight() - 7) < 1e-9
+
+    samples_dic = {obj: 0 for obj in range(7)}
+    total_samples = 70000
+    for _ in range(total_samples):
+        samples_dic[sampler.sample()] += 1
+    assert samples_dic[0] == samples_dic[1] == samples_dic[2] == 0
+    for obj, weight in [(3, 3), (4, 1), (5, 1), (6, 2)]:
+        assert abs(samples_dic[obj] - total_samples * weight / 7) < 1000
+
+    sampler.clear()
+    assert len(sampler) == 0
+    assert sampler.total_weight() == 0
@@ -1,6 +1,8 @@
 import json
 import os
+import pickle
 import random
+import numpy as np
 
 from functools import cmp_to_key
 from src.run_utils import INITIAL_DATE 
@@ -10,6 +12,7 @@ from src.simulation.simulation import Simulation,ORDER
 from src.world import Person
 from src.world.environments.household import Household
 from src.world.environments.neighborhood import NeighborhoodCommunity
+from src.world.environments.workplace import Workplace
 from src.world.population_generation import population_loader
 from src.world.population_generation import generate_city
 from src.world.world import World
@@ -700,3 +703,262 @@ def test_count_infected_in_hood():
         assert d1 == 0 , "Day:" + str(6 + i)
         assert d2 == 0 , "Day:" + str(6 + i)
         my_simulation.simulate_day()
+
+def test_count_infected_without_hood():
+    '''
+    Test that people who don't live in any neighborhood are not counted,
+    and that nothing is counted when neighborhood tracking is disabled
+    '''
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    for track_neighborhoods in [True, False]:
+        Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+        Params.loader()["person"]["state_macine_type"] = "SIR"
+        DiseaseState.init_infectiousness_list()
+
+        n1 = NeighborhoodCommunity(city= None,contact_prob_between_each_two_people= 1)
+        persons_arr = list(map(Person, [30, 40, 50]))
+        persons_arr[0].add_environment(n1)
+        states_table = ((DiseaseState.LATENT,daysdelta(1)),
+                        (DiseaseState.ASYMPTOMATICINFECTIOUS,daysdelta(1)),
+                        (DiseaseState.IMMUNE, None))
+        events_acc = []
+        for person in persons_arr:
+            events_acc += person.gen_and_register_events_from_seir_times(date = INITIAL_DATE,states_and_times= states_table)
+
+        my_world = World(
+            all_people = persons_arr,
+            all_environments=[n1],
+            generating_city_name = "test",
+            generating_scale = 1,)
+        # The statistics read it when they are created
+        statistics_params = Params.loader()["statistics"]
+        old_track_neighborhoods = statistics_params["track_neighborhoods"]
+        statistics_params["track_neighborhoods"] = track_neighborhoods
+        try:
+            my_simulation = Simulation(world = my_world, initial_date= INITIAL_DATE)
+        finally:
+            statistics_params["track_neighborhoods"] = old_track_neighborhoods
+        my_simulation.register_events(events_acc)
+        for i in range(3):
+            my_simulation.simulate_day()
+
+        expected = [0, 1, 0] if track_neighborhoods else [0, 0, 0]
+        for i in range(3):
+            d1 = my_simulation.stats.get_neiborhood_data(INITIAL_DATE + daysdelta(i),n1.get_neighborhood_id())
+            assert d1 == expected[i], "Day:" + str(i)
+
+def test_only_changed_people_are_tracked():
+    """
+    Tests that the world keeps track of exactly the people that changed during the day,
+    and forgets about them once the day is over
+    """
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+
+    persons_arr = [Person(random.randint(20, 60)) for _ in range(10)]
+    my_world = World(
+        all_people = persons_arr,
+        all_environments=[],
+        generating_city_name = "test",
+        generating_scale = 1)
+    assert len(my_world.get_changed_people()) == 10
+
+    my_simulation = Simulation(world = my_world, initial_date= INITIAL_DATE)
+    my_simulation.simulate_day()
+    assert my_world.get_changed_people() == []
+    assert not any(person._changed for person in my_world.all_people())
+
+    states_table = ((DiseaseState.SUSCEPTIBLE, daysdelta(1)),
+                    (DiseaseState.IMMUNE, None))
+    chosen = persons_arr[3]
+    my_simulation.register_events(chosen.gen_and_register_events_from_seir_times(INITIAL_DATE, states_table))
+    my_simulation.simulate_day()
+    assert my_world.get_changed_people() == []
+    assert chosen.get_disease_state() == DiseaseState.IMMUNE
+    assert chosen.get_last_state().disease_state == DiseaseState.IMMUNE
+    assert all(person.get_last_state().disease_state == DiseaseState.SUSCEPTIBLE
+               for person in my_world.all_people() if person is not chosen)
+
+def test_active_environments():
+    """
+    Tests that only environments with infectious members are considered active,
+    and that an environment stops being active when its last infectious member recovers
+    """
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+
+    house1 = Household(city = None,contact_prob_between_each_two_people=0)
+    house2 = Household(city = None,contact_prob_between_each_two_people=0)
+    hood = NeighborhoodCommunity(city= None,contact_prob_between_each_two_people= 0)
+    house1Lst = [Person(random.randint(20, 60), [house1, hood]) for _ in range(3)]
+    house2Lst = [Person(random.randint(20, 60), [house2, hood]) for _ in range(3)]
+    for person in house1Lst + house2Lst:
+        person._my_neighborhood = hood
+    my_world = World(
+        all_people = house1Lst + house2Lst,
+        all_environments=[house1, house2, hood],
+        generating_city_name = "test",
+        generating_scale = 1)
+
+    my_simulation = Simulation(world = my_world, initial_date= INITIAL_DATE)
+    assert my_world.get_active_environments() == []
+
+    states_table = ((DiseaseState.SUSCEPTIBLE, daysdelta(1)),
+                    (DiseaseState.ASYMPTOMATICINFECTIOUS, daysdelta(2)),
+                    (DiseaseState.IMMUNE, None))
+    my_simulation.register_events(house1Lst[0].gen_and_register_events_from_seir_times(INITIAL_DATE, states_table))
+    my_simulation.simulate_day()
+    assert my_world.get_active_environments() == []
+    my_simulation.simulate_day()
+    assert my_world.get_active_environments() == [house1, hood]
+    my_simulation.simulate_day()
+    assert my_world.get_active_environments() == [house1, hood]
+    my_simulation.simulate_day()
+    assert my_world.get_active_environments() == []
+
+
+def test_population_store():
+    """
+    Tests that people in a PopulationStore read and write their data from its columns,
+    and that the simulation and the pickling of the world work the same with them
+    """
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    Params.loader()["population"]["use_population_store"] = True
+    try:
+        house = Household(city = None,contact_prob_between_each_two_people=0)
+        hood = NeighborhoodCommunity(city= None,contact_prob_between_each_two_people= 0)
+        people = [Person(age, [house, hood]) for age in [5, 15, 25, 35, 45]]
+        for person in people:
+            person._my_neighborhood = hood
+        my_world = World(
+            all_people = people,
+            all_environments=[house, hood],
+            generating_city_name = "test",
+            generating_scale = 1)
+    finally:
+        Params.loader()["population"]["use_population_store"] = False
+    store = my_world.get_population_store()
+    assert len(store) == 5
+    assert [p.get_age() for p in store.get_people_by_age(10, 40)] == [15, 25, 35]
+    assert people[0].get_environment("household") is house
+    assert people[0].get_routine() == {"household": 1, "neighborhood_community": 1}
+
+    people[1].add_routine_change("quarantine", {"neighborhood_community": 0.5})
+    assert people[1].get_routine() == {"household": 1, "neighborhood_community": 0.5}
+    assert people[2].get_routine() == {"household": 1, "neighborhood_community": 1}
+
+    # The world is pickled (by the PopulationLoader) before anyone signs up to environments
+    loaded_world = pickle.loads(pickle.dumps(my_world))
+    loaded_person = loaded_world.get_person_from_id(people[1].get_id())
+    assert loaded_person.get_routine() == {"household": 1, "neighborhood_community": 0.5}
+    assert loaded_person.get_age() == 15
+    assert loaded_world.get_population_store() is loaded_person._store
+
+    my_simulation = Simulation(world = my_world, initial_date= INITIAL_DATE)
+    states_table = ((DiseaseState.SUSCEPTIBLE, daysdelta(1)),
+                    (DiseaseState.ASYMPTOMATICINFECTIOUS, daysdelta(1)),
+                    (DiseaseState.IMMUNE, None))
+    my_simulation.register_events(people[0].gen_and_register_events_from_seir_times(INITIAL_DATE, states_table))
+    copy = people[0].make_eventless_copy()
+    my_simulation.simulate_day()
+    my_simulation.simulate_day()
+    assert people[0].get_disease_state() == DiseaseState.ASYMPTOMATICINFECTIOUS
+    assert copy.get_disease_state() == DiseaseState.SUSCEPTIBLE
+    assert store.count_by_disease_state()[DiseaseState.ASYMPTOMATICINFECTIOUS] == 1
+    assert my_world.get_active_environments() == [house, hood]
+
+    workplace = Workplace(city = None,contact_prob_between_each_two_people=0,age_segment=None)
+    people[3].add_environment(workplace)
+    assert list(people[3].iter_routine()) == [(house, 1), (hood, 1), (workplace, 1)]
+    assert list(people[4].iter_routine()) == [(house, 1), (hood, 1)]
+    assert people[4].has_environment("neighborhood_community") and not people[4].has_environment("workplace")
+
+
+def test_stored_person_slots():
+    """
+    Tests that a person keeps the value of every Person slot when it's attached to a PopulationStore,
+    so adding a slot to Person that the StoredPerson doesn't handle fails here
+    """
+    from src.world.population_store import COLUMN_SLOTS, StoredPerson
+    from src.world import PopulationStore
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+    house = Household(city = None,contact_prob_between_each_two_people=0)
+    person = Person(30, [house])
+    person.add_routine_change("quarantine", {"household": 0.5})
+    values = {name: getattr(person, name) for name in Person.__slots__ if hasattr(person, name)}
+    assert set(values) == set(Person.__slots__)
+
+    PopulationStore([person])
+    assert type(person) is StoredPerson
+    assert all(isinstance(StoredPerson.__dict__[name], property) for name in COLUMN_SLOTS)
+    copy = person.to_person()
+    loaded = pickle.loads(pickle.dumps(person))
+    for name, value in values.items():
+        if name in ('_store', '_row'):
+            continue
+        assert getattr(person, name) == value, name
+        assert getattr(copy, name) == value, name
+        if name not in COLUMN_SLOTS:
+            assert getattr(loaded, name) == value, name
+
+
+
+def test_world_reset():
+    """
+    Tests that a world that is reset after a simulation
+    runs the next simulation exactly like a freshly loaded copy of the world
+    """
+    config_path = os.path.join(os.path.dirname(__file__),"..","src","config.json")
+    with open(config_path) as json_data_file:
+        ConfigData = json.load(json_data_file)
+        citiesDataPath = ConfigData['CitiesFilePath']
+        paramsDataPath = ConfigData['ParamsFilePath']
+    Params.load_from(os.path.join(os.path.dirname(__file__),"..","src", paramsDataPath), override=True)
+    DiseaseState.init_infectiousness_list()
+    pop = population_loader.PopulationLoader(citiesDataPath)
+    my_world = generate_city(pop.get_city_by_name('Atlit'),
+                             True,
+                             internal_workplaces=True,
+                             scaling=1.0,
+                             verbosity=False,
+                             to_world=True)
+    # The world is pickled (by the PopulationLoader) before anyone signs up to environments
+    fresh_world = pickle.loads(pickle.dumps(my_world))
+
+    def run_simulation(world):
+        random.seed(7)
+        np.random.seed(7)
+        my_simulation = Simulation(world = world, initial_date= INITIAL_DATE)
+        my_simulation.infect_random_set(num_infected = 20, infection_doc = "")
+        for _ in range(40):
+            my_simulation.simulate_day()
+        states = [(person.get_id(), person.get_disease_state()) for person in world.all_people()]
+        return my_simulation.stats.num_infected, states
+
+    first_run = run_simulation(my_world)
+    assert first_run[0] > 20
+    my_world.reset()
+    assert all(person.get_disease_state() == DiseaseState.SUSCEPTIBLE for person in my_world.all_people())
+    assert all(person.routine_changes == {} for person in my_world.all_people())
+    assert len(my_world.get_changed_people()) == my_world.num_people()
+    assert my_world.get_active_environments() == []
+    assert run_simulation(my_world) == run_simulation(fresh_world)